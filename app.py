@@ -1,23 +1,170 @@
 import os
+import sys
+import time
 import uuid
+import shutil
+import threading
+import collections
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+import tempfile
+import importlib
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, jsonify, send_file, abort
 from werkzeug.utils import secure_filename
-import document_processor as dp
+from werkzeug.middleware.proxy_fix import ProxyFix
+import metrics
+from metrics import timed
+from jobs import JobQueue, QueueFullError, QuotaExceededError, JobTooLargeError, JOB_DONE, JOB_FAILED
+from result_cache import ResultCache, CACHE_SUFFIX, file_digest
+from thumbnails import ThumbnailCache, THUMBNAIL_WIDTH, THUMBNAIL_WIDTHS
+from page_cache import PageCache
+from upload_store import UploadStore, ChunkedUploads, UploadError, DEFAULT_CHUNK_SIZE, Janitor, remove_expired_files
+
+class LazyModule:
+    """
+    Module imported on its first attribute access
+
+    importlib's LazyLoader is not thread-safe on Python 3.11: threads
+    touching the module while it executes see it half-initialized. Here
+    the first access imports it under a lock, so concurrent first jobs
+    and preflights wait for a complete module.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        self._name = name
+        self._module = sys.modules.get(name)
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# The processing backends (PyPDF2, reportlab, pdf2image, docx2pdf) load
+# on the first job rather than before the first page is served
+dp = LazyModule('document_processor')
+batch = LazyModule('batch')
+preflight = LazyModule('preflight')
 
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key-for-dev")
 
+# Behind PROXY_COUNT reverse proxies, the client address (which per-client
+# quotas are keyed by) is read from X-Forwarded-For
+PROXY_COUNT = int(os.environ.get('PROXY_COUNT', '0'))
+if PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_COUNT, x_proto=PROXY_COUNT)
+
 # Configure upload folder
 UPLOAD_FOLDER = '/tmp/uploads'
 PROCESSED_FOLDER = '/tmp/processed'
+THUMBNAIL_FOLDER = '/tmp/thumbnails'
+PAGE_CACHE_FOLDER = '/tmp/page_cache'
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx'}
 
 # Create required directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
+# Background processing: concurrent jobs and how many may wait in line
+# before new requests are rejected with HTTP 429. Jobs are scheduled by
+# their estimated cost in seconds (see preflight): the queue also holds at
+# most JOB_QUEUE_COST seconds of waiting work, each client JOB_CLIENT_QUOTA
+# seconds, jobs above JOB_MAX_COST are refused (HTTP 413) and jobs of
+# JOB_LARGE_COST or more leave one worker free for short ones
+job_queue = JobQueue(
+    workers=int(os.environ.get('JOB_WORKERS', '2')),
+    max_pending=int(os.environ.get('JOB_QUEUE_SIZE', '16')),
+    max_pending_cost=float(os.environ.get('JOB_QUEUE_COST', '3600')),
+    max_job_cost=float(os.environ.get('JOB_MAX_COST', '1800')),
+    owner_quota=float(os.environ.get('JOB_CLIENT_QUOTA', '1800')),
+    large_job_cost=float(os.environ.get('JOB_LARGE_COST', '60'))
+)
+
+# Processed documents are cached by input content and parameters, so
+# repeated requests reuse the existing output (size bound in bytes)
+result_cache = ResultCache(
+    PROCESSED_FOLDER,
+    max_bytes=int(os.environ.get('RESULT_CACHE_BYTES', str(1024 * 1024 * 1024)))
+)
+
+# Page thumbnails for the preview viewer (size bound in bytes)
+thumbnail_cache = ThumbnailCache(
+    THUMBNAIL_FOLDER,
+    max_bytes=int(os.environ.get('THUMBNAIL_CACHE_BYTES', str(256 * 1024 * 1024)))
+)
+
+# Pages rendered by the raster engine, so processing a document again
+# with other margins or orientation only places them (size bound in bytes,
+# 0 disables it)
+page_cache = PageCache(
+    PAGE_CACHE_FOLDER,
+    max_bytes=int(os.environ.get('PAGE_CACHE_BYTES', str(2 * 1024 * 1024 * 1024)))
+)
+
+# Uploads are stored once per content hash; large files can also be sent
+# as resumable chunked uploads
+upload_store = UploadStore(UPLOAD_FOLDER)
+chunked_uploads = ChunkedUploads(upload_store)
+
+# Periodic cleanup of old uploads and processed files (ages in seconds);
+# cached outputs are bounded by the result cache instead
+UPLOAD_TTL = int(os.environ.get('UPLOAD_TTL', str(6 * 3600)))
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+PROCESSED_TTL = int(os.environ.get('PROCESSED_TTL', str(24 * 3600)))
+janitor = Janitor([
+    lambda: upload_store.cleanup(UPLOAD_TTL, UPLOAD_MAX_BYTES),
+    lambda: chunked_uploads.cleanup(UPLOAD_TTL),
+    lambda: remove_expired_files(PROCESSED_FOLDER, PROCESSED_TTL, keep_suffix=CACHE_SUFFIX)
+], interval=int(os.environ.get('JANITOR_INTERVAL', '600')))
+janitor.start()
+
+# Prometheus metrics of this process are served on /metrics; with
+# SERVER_TIMING=1 responses also carry the time of their stages in a
+# Server-Timing header (job status responses carry the job's stages)
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+# Outputs go through the optimizer stage (see pdf_optimizer) when a
+# request asks for it with `optimize`, or by default with OPTIMIZE_OUTPUT=1
+OPTIMIZE_OUTPUT = os.environ.get('OPTIMIZE_OUTPUT', '0') == '1'
+metrics.REGISTRY.gauge('a5_queue_depth', 'Jobs waiting for a worker', function=job_queue.depth)
+metrics.REGISTRY.gauge('a5_jobs_running', 'Jobs being run', function=job_queue.running)
+metrics.REGISTRY.gauge('a5_queue_cost_seconds', 'Estimated seconds of work waiting for a worker', function=job_queue.pending_cost)
+metrics.REGISTRY.counter(
+    'a5_cache_requests_total', 'Cache lookups by result', ('cache', 'result'),
+    function=lambda: {
+        ('result', 'hit'): result_cache.hits,
+        ('result', 'miss'): result_cache.misses,
+        ('thumbnail', 'hit'): thumbnail_cache.hits,
+        ('thumbnail', 'miss'): thumbnail_cache.misses,
+        ('page', 'hit'): page_cache.hits,
+        ('page', 'miss'): page_cache.misses
+    }
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.request_stats = {}
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.endpoint or 'unmatched'
+    metrics.REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.REQUEST_DURATION.observe(elapsed, endpoint=endpoint)
+    
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = metrics.server_timing(g.get('request_stats', {}).get('timings'), total=elapsed)
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # Check if file extension is allowed
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -39,74 +186,423 @@ def upload_file():
         return redirect(request.url)
     
     if file and allowed_file(file.filename):
-        # Generate a unique filename to avoid collisions
-        unique_filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(file_path)
-        
-        # Get file extension
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
+        # Store the upload, hashing it while it is written; identical
+        # content is only stored once
+        stored = store_upload(file.stream, secure_filename(file.filename))
         
         # Return the file info for the next steps
-        return jsonify({
-            'success': True,
-            'message': 'File uploaded successfully',
-            'file_path': file_path,
-            'file_name': file.filename,
-            'file_id': unique_filename,
-            'file_type': file_extension
-        })
+        return jsonify(upload_response(stored, file.filename))
     
     flash('File type not supported. Please upload PDF, DOC, or DOCX files.', 'danger')
     return redirect(url_for('index'))
 
+def store_upload(stream, filename):
+    """
+    Store an uploaded stream in the upload store and count its bytes
+    """
+    with timed(g.request_stats, 'store'):
+        stored = upload_store.save(stream, filename)
+    metrics.UPLOAD_BYTES.inc(stored['size'], duplicate=str(stored['duplicate']).lower())
+    return stored
+
+# Preflight results per (content digest, file type); the least recently
+# used are dropped beyond PREFLIGHT_CACHE_SIZE
+PREFLIGHT_CACHE_SIZE = 1024
+_preflight_results = collections.OrderedDict()
+_preflight_lock = threading.Lock()
+
+def document_preflight(file_path, file_type):
+    """
+    Preflight of a stored document (see preflight.inspect_document)
+    
+    Results are kept per content, for the upload answer and the cost
+    estimate of the jobs that process it; uploads of the same content
+    under other paths share them.
+    """
+    key = (upload_store.digest(file_path) or file_digest(file_path), file_type)
+    with _preflight_lock:
+        if key in _preflight_results:
+            _preflight_results.move_to_end(key)
+            return _preflight_results[key]
+
+    result = preflight.inspect_document(file_path, file_type)
+    with _preflight_lock:
+        _preflight_results[key] = result
+        while len(_preflight_results) > PREFLIGHT_CACHE_SIZE:
+            _preflight_results.popitem(last=False)
+    return result
+
+def upload_response(stored, filename):
+    """
+    Build the JSON answer for a stored upload (plain or chunked)
+    
+    It includes the preflight of the document: page count, page sizes,
+    share of image pages and the estimated processing cost per engine.
+    """
+    file_type = filename.rsplit('.', 1)[1].lower()
+    with timed(g.request_stats, 'preflight'):
+        inspection = document_preflight(stored['path'], file_type)
+    return {
+        'success': True,
+        'message': 'File uploaded successfully',
+        'file_path': stored['path'],
+        'file_name': filename,
+        'file_id': os.path.basename(stored['path']),
+        'file_type': file_type,
+        'file_hash': stored['digest'],
+        'file_size': stored['size'],
+        'duplicate': stored['duplicate'],
+        'preflight': inspection
+    }
+
+@app.route('/upload/chunked', methods=['POST'])
+def start_chunked_upload():
+    """
+    Open a resumable upload: {filename, size, chunk_size?, sha256?}
+    
+    Chunks are then sent with PUT /upload/chunked/<upload_id>/<index> (raw
+    body, optional X-Chunk-SHA256 header) and assembled with
+    POST /upload/chunked/<upload_id>/complete.
+    """
+    filename = secure_filename(request.json.get('filename', ''))
+    if not allowed_file(filename):
+        return jsonify({'success': False, 'error': 'Tipo de arquivo não suportado'}), 400
+    
+    try:
+        info = chunked_uploads.start(
+            filename,
+            int(request.json.get('size', -1)),
+            int(request.json.get('chunk_size') or DEFAULT_CHUNK_SIZE),
+            request.json.get('sha256')
+        )
+    except (UploadError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    info['success'] = True
+    info['status_url'] = url_for('chunked_upload_status', upload_id=info['upload_id'])
+    return jsonify(info), 201
+
+@app.route('/upload/chunked/<upload_id>')
+def chunked_upload_status(upload_id):
+    try:
+        info = chunked_uploads.status(upload_id)
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    
+    info['success'] = True
+    return jsonify(info)
+
+@app.route('/upload/chunked/<upload_id>/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    try:
+        # The body is read as a stream, so chunks are never held in memory
+        size = chunked_uploads.write_chunk(upload_id, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({'success': True, 'index': index, 'size': size})
+
+@app.route('/upload/chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    try:
+        with timed(g.request_stats, 'store'):
+            stored = chunked_uploads.complete(upload_id)
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    metrics.UPLOAD_BYTES.inc(stored['size'], duplicate=str(stored['duplicate']).lower())
+    
+    return jsonify(upload_response(stored, stored['filename']))
+
+@app.route('/upload/chunked/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    try:
+        chunked_uploads.abort(upload_id)
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    
+    return jsonify({'success': True})
+
+def run_text_job(stats, text_content, output_filename, text_file=None, **options):
+    """
+    Background job: create a PDF from text
+    
+    With text_file, the text is read from that file as it is laid out
+    instead of being passed in text_content.
+    """
+    if text_file:
+        stats['bytes_in'] = os.path.getsize(text_file)
+        with open(text_file, encoding='utf-8', errors='replace') as f:
+            success = dp.create_pdf_from_text(f, output_filename, stats=stats, **options)
+    else:
+        stats['bytes_in'] = len(text_content.encode('utf-8'))
+        success = dp.create_pdf_from_text(text_content, output_filename, stats=stats, **options)
+    if not success:
+        raise RuntimeError('Falha ao processar o texto')
+    
+    return {'output_path': output_filename}
+
+def processing_params(processing_type, margins, orientation, engine, raster_options, imposition=None, optimize=False):
+    """
+    Normalize the parameters that determine a processed document (for cache keys)
+    """
+    params = {
+        'processing_type': processing_type if processing_type in ('resize', 'booklet') else 'split',
+        'margins': {side: round(value, 3) for side, value in margins.items()},
+        'orientation': orientation,
+        'engine': engine
+    }
+    
+    # Raster settings only matter for the raster engine
+    if engine == dp.ENGINE_RASTER:
+        options = dict(dp.DEFAULT_RASTER_OPTIONS)
+        options.update({key: value for key, value in raster_options.items() if value is not None})
+        params['dpi'] = int(options['dpi']) if options['dpi'] else None
+        params['target_dpi'] = int(options['target_dpi'])
+        params['vector_pages'] = str(options['vector_pages']).lower() not in ('false', '0')
+        params['image_format'] = options['image_format']
+        if options['image_format'] == dp.IMAGE_FORMAT_JPEG:
+            params['jpeg_quality'] = int(options['jpeg_quality'])
+    
+    if processing_type == 'booklet':
+        params['imposition'] = imposition
+    
+    # Only set when on, so outputs cached before the optimizer keep their keys
+    if optimize:
+        params['optimize'] = True
+    
+    return params
+
+def read_processing_options(values):
+    """
+    Read the document processing options from request values (JSON or form)
+    """
+    processing_type = values.get('processing_type', 'resize')  # 'resize', 'split' or 'booklet'
+    margins = {
+        'top': float(values.get('margin_top', 0.5)),
+        'right': float(values.get('margin_right', 0.5)),
+        'bottom': float(values.get('margin_bottom', 0.5)),
+        'left': float(values.get('margin_left', 0.5))
+    }
+    orientation = values.get('orientation', 'portrait')
+    engine = values.get('engine', dp.ENGINE_VECTOR)  # 'vector' or 'raster'
+    raster_options = {
+        'dpi': values.get('dpi'),  # fixed resolution; adaptive per page if not given
+        'target_dpi': values.get('target_dpi'),
+        'vector_pages': values.get('vector_pages'),
+        'image_format': values.get('image_format'),  # 'flate' or 'jpeg'
+        'jpeg_quality': values.get('jpeg_quality'),
+        'streaming': values.get('streaming')
+    }
+    
+    # Booklets are always imposed with the vector engine
+    if processing_type == 'booklet':
+        engine = dp.ENGINE_VECTOR
+    
+    return processing_type, margins, orientation, engine, raster_options
+
+def read_optimize_option(values):
+    """
+    Read whether the output is optimized from request values (JSON or form)
+    """
+    optimize = values.get('optimize')
+    if optimize is None:
+        return OPTIMIZE_OUTPUT
+    return str(optimize).lower() not in ('false', '0')
+
+def read_imposition_options(values):
+    """
+    Read the booklet options from request values (JSON or form)
+    """
+    signature_size = values.get('signature_size')
+    return {
+        'mode': values.get('imposition', dp.IMPOSITION_2UP),  # '2up' or '4up'
+        'booklet': str(values.get('booklet', True)).lower() not in ('false', '0'),
+        'signature_size': int(signature_size) if signature_size else None
+    }
+
+def processor(processing_type):
+    """
+    Return the document_processor function for resize or split
+    """
+    if processing_type == 'resize':
+        return dp.resize_pdf_to_a5
+    return dp.split_pdf_to_a5
+
+def run_document_job(stats, file_path, file_type, processing_type, output_filename, margins, orientation, engine, raster_options, cache_key, imposition=None, optimize=False, progressive=False):
+    """
+    Background job: resize, split or impose a PDF or Word document
+
+    The output is stored in the result cache under cache_key. The raster
+    engine also writes the preview thumbnails of the output pages and keeps
+    its rendered pages in the page cache. With
+    optimize the output goes through the optimizer stage. With progressive
+    the thumbnails of the first pages are written before the document is
+    processed; they can be fetched from /jobs/<job_id>/page/<page>.webp
+    as stats['pages_ready'] grows.
+    """
+    output_name = os.path.basename(result_cache.path(cache_key))
+    thumbnails = thumbnail_cache.template(output_name)
+    if engine == dp.ENGINE_RASTER:
+        raster_options = dict(raster_options, thumbnails=thumbnails, page_cache=page_cache.folder if page_cache.max_bytes else None)
+    # Booklet sheets mix pages from both ends, so they have no preview
+    preview = thumbnails if progressive and processing_type != 'booklet' else None
+    if preview:
+        stats['preview_name'] = output_name
+    
+    def process(input_file):
+        # Booklets are imposed with the vector engine on A4 sheets, so
+        # orientation and the raster options do not apply
+        if processing_type == 'booklet':
+            return dp.impose_pdf(input_file, output_filename, margins, stats, optimize=optimize, **(imposition or {}))
+        return processor(processing_type)(input_file, output_filename, margins, orientation, engine, stats, raster_options,
+                                          optimize=optimize, preview=preview)
+    
+    stats['bytes_in'] = os.path.getsize(file_path)
+    
+    # Process the document based on file type
+    if file_type == 'pdf':
+        success = process(file_path)
+    elif file_type in ['doc', 'docx']:
+        # Convert word to PDF first
+        temp_pdf = os.path.join(PROCESSED_FOLDER, f"{uuid.uuid4()}_converted.pdf")
+        with timed(stats, 'convert'):
+            conversion_success = dp.convert_word_to_pdf(file_path, temp_pdf)
+        
+        if not conversion_success:
+            raise RuntimeError('Falha ao converter documento Word para PDF')
+        
+        # Then process the PDF
+        success = process(temp_pdf)
+        
+        # Clean up temp file
+        if os.path.exists(temp_pdf):
+            os.remove(temp_pdf)
+    else:
+        raise RuntimeError('Tipo de arquivo não suportado')
+    
+    if not success:
+        raise RuntimeError('Falha ao processar o documento')
+    
+    if engine == dp.ENGINE_RASTER or preview:
+        thumbnail_cache.trim()
+    if engine == dp.ENGINE_RASTER and page_cache.max_bytes:
+        page_cache.record(stats)
+        page_cache.trim()
+    
+    return {'output_path': result_cache.put(cache_key, output_filename)}
+
+def run_metered_job(stats, operation, func, *args, **kwargs):
+    """
+    Run a job function and record its metrics (see metrics.record_job)
+    
+    Job functions may report the size of their input as stats['bytes_in'];
+    the output size is read from the result's output_path.
+    """
+    start = time.perf_counter()
+    success = False
+    bytes_out = None
+    try:
+        result = func(stats, *args, **kwargs)
+        success = True
+        if result and os.path.exists(result.get('output_path', '')):
+            bytes_out = os.path.getsize(result['output_path'])
+        return result
+    finally:
+        metrics.record_job(operation, stats, time.perf_counter() - start, success, stats.get('bytes_in'), bytes_out)
+
+def enqueue_job(operation, func, *args, cost=None, **kwargs):
+    """
+    Queue a job and return the JSON response pointing to its status
+    
+    operation names the job in the metrics (resize, split, booklet, text
+    or batch). cost is its estimated run time in seconds (None if unknown),
+    by which it is admitted and scheduled; quotas are per client address.
+    """
+    try:
+        job = job_queue.submit(run_metered_job, operation, func, *args, cost=cost, owner=request.remote_addr, **kwargs)
+    except JobTooLargeError:
+        metrics.JOBS_REJECTED.inc(operation=operation, reason='too_large')
+        return jsonify({
+            'success': False,
+            'error': 'Documento grande demais para este processamento. Tente o motor vetorial ou divida o documento.',
+            'estimated_cost': cost
+        }), 413
+    except QuotaExceededError:
+        metrics.JOBS_REJECTED.inc(operation=operation, reason='quota')
+        return jsonify({'success': False, 'error': 'Você já tem processamentos em andamento. Aguarde a conclusão e tente novamente.'}), 429
+    except QueueFullError:
+        metrics.JOBS_REJECTED.inc(operation=operation, reason='queue_full')
+        return jsonify({'success': False, 'error': 'Servidor ocupado. Tente novamente em alguns instantes.'}), 429
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'estimated_cost': job.cost
+    }), 202
+
+def document_cost(file_path, file_type, engine):
+    """
+    Estimated seconds to process a stored document with an engine, or None
+    """
+    costs = document_preflight(file_path, file_type).get('estimated_cost')
+    return costs.get(engine) if costs else None
+
 @app.route('/process-text', methods=['POST'])
 def process_text():
     try:
-        # Get parameters from request
-        text_content = request.json.get('text')
-        title = request.json.get('title', '')
-        text_style = request.json.get('text_style', 'normal')
-        text_layout = request.json.get('text_layout', 'single')  # 'single' ou 'double'
-        font_size = int(request.json.get('font_size', 12))
-        processing_type = request.json.get('processing_type', 'resize')  # Ignored for text, but kept for API consistency
+        # Get parameters from request: JSON with the text, or a form with
+        # the text as an uploaded .txt file (`text_file`) for large texts
+        values = request.json if request.is_json else request.form
+        text_content = values.get('text')
+        title = values.get('title', '')
+        text_style = values.get('text_style', 'normal')
+        text_layout = values.get('text_layout', 'single')  # 'single' ou 'double'
+        balance_columns = str(values.get('balance_columns', True)).lower() not in ('false', '0')
+        font_size = int(values.get('font_size', 12))
+        processing_type = values.get('processing_type', 'resize')  # Ignored for text, but kept for API consistency
         margins = {
-            'top': float(request.json.get('margin_top', 0.5)),
-            'right': float(request.json.get('margin_right', 0.5)),
-            'bottom': float(request.json.get('margin_bottom', 0.5)),
-            'left': float(request.json.get('margin_left', 0.5))
+            'top': float(values.get('margin_top', 0.5)),
+            'right': float(values.get('margin_right', 0.5)),
+            'bottom': float(values.get('margin_bottom', 0.5)),
+            'left': float(values.get('margin_left', 0.5))
         }
-        orientation = request.json.get('orientation', 'portrait')
+        orientation = values.get('orientation', 'portrait')
+        optimize = read_optimize_option(values)
+        
+        # Store an uploaded text file without reading it into memory
+        text_file = None
+        if 'text_file' in request.files and request.files['text_file'].filename:
+            upload = request.files['text_file']
+            text_file = store_upload(upload.stream, secure_filename(upload.filename) or 'texto.txt')['path']
         
         # Validate inputs
-        if not text_content:
+        if not text_content and not text_file:
             return jsonify({'success': False, 'error': 'Texto não fornecido'})
         
         # Generate output filename
         output_filename = os.path.join(PROCESSED_FOLDER, 
                                       f"{uuid.uuid4()}_text_document.pdf")
         
-        # Create PDF from text
-        success = dp.create_pdf_from_text(
+        # Create PDF from text in the background
+        text_size = os.path.getsize(text_file) if text_file else len(text_content.encode('utf-8'))
+        return enqueue_job(
+            'text',
+            run_text_job,
             text_content, 
             output_filename, 
+            text_file=text_file,
             title=title,
             font_size=font_size,
             text_style=text_style,
             text_layout=text_layout,
+            balance_columns=balance_columns,
             margins=margins,
-            orientation=orientation
+            orientation=orientation,
+            optimize=optimize,
+            cost=preflight.estimate_text_cost(text_size)
         )
-        
-        if success:
-            # Return preview URL
-            return jsonify({
-                'success': True,
-                'output_path': output_filename,
-                'preview_url': url_for('get_preview', filename=os.path.basename(output_filename))
-            })
-        else:
-            return jsonify({'success': False, 'error': 'Falha ao processar o texto'})
             
     except Exception as e:
         logging.error(f"Error processing text: {str(e)}")
@@ -118,68 +614,248 @@ def process_document():
         # Get parameters from request
         file_path = request.json.get('file_path')
         file_type = request.json.get('file_type')
-        processing_type = request.json.get('processing_type', 'resize')  # 'resize' or 'split'
-        margins = {
-            'top': float(request.json.get('margin_top', 0.5)),
-            'right': float(request.json.get('margin_right', 0.5)),
-            'bottom': float(request.json.get('margin_bottom', 0.5)),
-            'left': float(request.json.get('margin_left', 0.5))
-        }
-        orientation = request.json.get('orientation', 'portrait')
+        processing_type, margins, orientation, engine, raster_options = read_processing_options(request.json)
+        imposition = read_imposition_options(request.json)
+        optimize = read_optimize_option(request.json)
+        # Show the first pages while the document is processed
+        progressive = str(request.json.get('progressive', False)).lower() not in ('false', '0')
         
         # Validate inputs
         if not file_path or not os.path.exists(file_path):
             return jsonify({'success': False, 'error': 'Arquivo não encontrado'})
         
+        # Return the cached output if this document was already processed
+        # with the same parameters
+        params = processing_params(processing_type, margins, orientation, engine, raster_options, imposition, optimize)
+        with timed(g.request_stats, 'hash'):
+            content_digest = upload_store.digest(file_path) or file_digest(file_path)
+        with timed(g.request_stats, 'cache'):
+            cache_key = result_cache.key(content_digest, params)
+            cached_path = result_cache.get(cache_key)
+        if cached_path:
+            return jsonify({
+                'success': True,
+                'cached': True,
+                'output_path': cached_path,
+                'preview_url': url_for('get_preview', filename=os.path.basename(cached_path))
+            })
+        
         # Generate output filename
         output_filename = os.path.join(PROCESSED_FOLDER, 
                                       f"{uuid.uuid4()}_processed.pdf")
         
-        # Process the document based on file type and processing type
-        if file_type == 'pdf':
-            if processing_type == 'resize':
-                success = dp.resize_pdf_to_a5(file_path, output_filename, margins, orientation)
-            else:  # split
-                success = dp.split_pdf_to_a5(file_path, output_filename, margins, orientation)
-        elif file_type in ['doc', 'docx']:
-            # Convert word to PDF first
-            temp_pdf = os.path.join(PROCESSED_FOLDER, f"{uuid.uuid4()}_converted.pdf")
-            conversion_success = dp.convert_word_to_pdf(file_path, temp_pdf)
-            
-            if not conversion_success:
-                return jsonify({'success': False, 'error': 'Falha ao converter documento Word para PDF'})
-            
-            # Then process the PDF
-            if processing_type == 'resize':
-                success = dp.resize_pdf_to_a5(temp_pdf, output_filename, margins, orientation)
-            else:  # split
-                success = dp.split_pdf_to_a5(temp_pdf, output_filename, margins, orientation)
-            
-            # Clean up temp file
-            if os.path.exists(temp_pdf):
-                os.remove(temp_pdf)
-        
-        if success:
-            # Return preview URL
-            return jsonify({
-                'success': True,
-                'output_path': output_filename,
-                'preview_url': url_for('get_preview', filename=os.path.basename(output_filename))
-            })
-        else:
-            return jsonify({'success': False, 'error': 'Falha ao processar o documento'})
+        # Process the document in the background
+        return enqueue_job(
+            params['processing_type'],
+            run_document_job,
+            file_path,
+            file_type,
+            processing_type,
+            output_filename,
+            margins,
+            orientation,
+            engine,
+            raster_options,
+            cache_key,
+            imposition=imposition,
+            optimize=optimize,
+            progressive=progressive,
+            cost=document_cost(file_path, file_type, engine)
+        )
             
     except Exception as e:
         logging.error(f"Error processing document: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+def run_batch_job(stats, documents, archives, output_zip, options):
+    """
+    Background job: process many documents into one ZIP
+    """
+    work_dir = tempfile.mkdtemp(prefix='batch_inputs_')
+    try:
+        # Documents inside the uploaded ZIP archives join the batch
+        documents = documents + batch.collect_inputs([path for _, path in archives], work_dir)
+        stats['bytes_in'] = sum(os.path.getsize(path) for _, path in documents)
+        if not documents:
+            raise RuntimeError('Nenhum documento PDF, DOC ou DOCX encontrado')
+        
+        report = batch.process_batch(documents, output_zip, options, stats=stats)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    return {'output_path': output_zip, 'report': report}
+
+@app.route('/process-batch', methods=['POST'])
+def process_batch():
+    """
+    Process many documents with the same options in one background job
+    
+    Accepts multipart files as `documents` (PDF, DOC, DOCX) and/or ZIP
+    archives as `archive`, plus the /process options as form fields. The
+    job result is a ZIP with every output and a per-file report.
+    """
+    try:
+        processing_type, margins, orientation, engine, _ = read_processing_options(request.form)
+        options = {
+            'processing_type': processing_type,
+            'margins': margins,
+            'orientation': orientation,
+            'engine': engine,
+            'raster_options': {'dpi': request.form.get('dpi', type=int), 'image_format': request.form.get('image_format')},
+            'imposition': read_imposition_options(request.form),
+            'optimize': read_optimize_option(request.form)
+        }
+        
+        # Store every upload; documents keep their original names in the ZIP
+        documents = []
+        archives = []
+        for file in request.files.getlist('documents') + request.files.getlist('archive'):
+            filename = secure_filename(file.filename or '')
+            if file.filename and file.filename.lower().endswith('.zip'):
+                archives.append((filename, store_upload(file.stream, filename)['path']))
+            elif allowed_file(filename):
+                documents.append((filename, store_upload(file.stream, filename)['path']))
+        
+        if not documents and not archives:
+            return jsonify({'success': False, 'error': 'Nenhum arquivo fornecido'}), 400
+        
+        # Documents run in parallel; unknown ones (and archives) count as
+        # the default cost
+        costs = [
+            document_cost(path, filename.rsplit('.', 1)[1].lower(), engine) or job_queue.default_cost
+            for filename, path in documents
+        ] + [job_queue.default_cost] * len(archives)
+        cost = sum(costs) / max(1, min(batch.BATCH_WORKERS, len(costs)))
+        
+        output_zip = os.path.join(PROCESSED_FOLDER, f"{uuid.uuid4()}_batch.zip")
+        return enqueue_job('batch', run_batch_job, documents, archives, output_zip, options, cost=cost)
+    
+    except Exception as e:
+        logging.error(f"Error processing batch: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Tarefa não encontrada'}), 404
+    
+    response = job.to_dict()
+    response['success'] = True
+    response['stats'] = job.stats
+    
+    # The job's stages, for Server-Timing
+    metrics.merge_timings(g.request_stats, {f"job_{stage}": seconds for stage, seconds in job.stats.get('timings', {}).items()})
+    
+    if job.status == JOB_DONE and 'report' in job.result:
+        # Batch: the ZIP of all outputs and the per-file report
+        response['download_url'] = url_for('download_batch', filename=os.path.basename(job.result['output_path']))
+        response['report'] = job.result['report']
+    elif job.status == JOB_DONE:
+        # Return preview URL
+        output_filename = job.result['output_path']
+        response['output_path'] = output_filename
+        response['preview_url'] = url_for('get_preview', filename=os.path.basename(output_filename))
+    elif job.status == JOB_FAILED:
+        response['error'] = job.error
+    
+    return jsonify(response)
+
+@app.route('/jobs/<job_id>/page/<int:page>.webp')
+def get_job_page(job_id, page):
+    """
+    Thumbnail of an output page (1-based) of a progressive job, once it is ready
+    
+    Pages up to stats['pages_ready'] can be fetched while the job runs;
+    the same thumbnails serve the preview of the finished output.
+    """
+    job = job_queue.get(job_id)
+    name = job.stats.get('preview_name') if job else None
+    if not name or not 1 <= page <= job.stats.get('pages_ready', 0):
+        abort(404)
+    
+    path = thumbnail_cache.get(thumbnail_cache.page_key(name, page))
+    if path is None:
+        abort(404)
+    
+    # The raster engine may replace a page rendered ahead of processing
+    return send_file(path, mimetype='image/webp', conditional=True, max_age=0)
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+def processed_path(filename):
+    """
+    Return the path of a processed file, or abort with 404
+    """
+    path = os.path.join(PROCESSED_FOLDER, filename)
+    if '/' in filename or not os.path.isfile(path):
+        abort(404)
+    return path
+
+def send_processed_file(filename, **kwargs):
+    """
+    Send a processed PDF with support for Range and conditional requests
+    
+    Responses carry an ETag and Accept-Ranges, so clients can revalidate
+    with If-None-Match (304) and fetch parts with Range (206). Cached
+    outputs are named after their content key and never change, so their
+    ETag is the key itself.
+    """
+    path = processed_path(filename)
+    etag = filename[:-len(CACHE_SUFFIX)] if filename.endswith(CACHE_SUFFIX) else True
+    response = send_file(path, mimetype='application/pdf', conditional=True, etag=etag, max_age=0, **kwargs)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
 @app.route('/preview/<filename>')
 def get_preview(filename):
-    return send_file(os.path.join(PROCESSED_FOLDER, filename), mimetype='application/pdf')
+    return send_processed_file(filename)
+
+@app.route('/preview/<filename>/pages')
+def get_preview_pages(filename):
+    """
+    Page count and first page size of a processed file, for the viewer
+    """
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(processed_path(filename))
+    box = reader.pages[0].mediabox if reader.pages else None
+    return jsonify({
+        'success': True,
+        'pages': len(reader.pages),
+        'width': float(box.width) if box else None,
+        'height': float(box.height) if box else None,
+        'thumbnail_widths': THUMBNAIL_WIDTHS
+    })
+
+@app.route('/preview/<filename>/page/<int:page>.webp')
+def get_page_thumbnail(filename, page):
+    """
+    Low-resolution thumbnail of one page (1-based), rendered on first request
+    """
+    width = request.args.get('width', THUMBNAIL_WIDTH, type=int)
+    if width not in THUMBNAIL_WIDTHS or page < 1:
+        abort(404)
+    
+    with timed(g.request_stats, 'thumbnail'):
+        path = thumbnail_cache.get_or_render(processed_path(filename), page, width)
+    if path is None:
+        abort(404)
+    
+    # Processed files never change under the same name
+    return send_file(path, mimetype='image/webp', conditional=True, max_age=86400)
+
+@app.route('/download-batch/<filename>')
+def download_batch(filename):
+    path = os.path.join(PROCESSED_FOLDER, filename)
+    if '/' in filename or not filename.endswith('_batch.zip') or not os.path.isfile(path):
+        abort(404)
+    return send_file(path, mimetype='application/zip', as_attachment=True, download_name='documentos_a5.zip')
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    return send_file(os.path.join(PROCESSED_FOLDER, filename),
-                     mimetype='application/pdf',
-                     as_attachment=True,
-                     download_name='documento_formatado_a5.pdf')
+    return send_processed_file(filename,
+                               as_attachment=True,
+                               download_name='documento_formatado_a5.pdf')
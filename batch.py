@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import zipfile
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import document_processor as dp
+from metrics import merge_timings, timed
+
+# Document types a batch accepts (ZIP archives are unpacked into these)
+BATCH_EXTENSIONS = {'pdf', 'doc', 'docx'}
+# Those converted to PDF before they are processed
+WORD_EXTENSIONS = {'doc', 'docx'}
+
+# Worker processes per batch
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', str(os.cpu_count() or 1)))
+
+# Name of the per-file report stored in the output ZIP
+REPORT_NAME = 'relatorio.json'
+
+def default_options():
+    """
+    Processing options of a batch; every document gets the same ones
+    """
+    return {
+        'processing_type': 'resize',  # 'resize' or 'split'
+        'margins': {'top': 0.5, 'right': 0.5, 'bottom': 0.5, 'left': 0.5},
+        'orientation': 'portrait',
+        'engine': dp.ENGINE_VECTOR,
+        'raster_options': None,
+        'imposition': None,  # impose_pdf options for 'booklet'
+        'optimize': False  # True or pdf_optimizer options
+    }
+
+def collect_inputs(paths, work_dir):
+    """
+    Expand files, folders and ZIP archives into a list of (name, path) documents
+
+    ZIP members are extracted into work_dir under numbered names, so
+    member paths cannot escape it. Names are unique within the batch and
+    become the entry names in the output ZIP.
+    """
+    documents = []
+    names = set()
+
+    def add(name, path):
+        documents.append((_unique_name(name, names), path))
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for filename in sorted(files):
+                    if _extension(filename) in BATCH_EXTENSIONS:
+                        add(os.path.relpath(os.path.join(root, filename), path), os.path.join(root, filename))
+        elif _extension(path) == 'zip':
+            with zipfile.ZipFile(path) as archive:
+                for index, member in enumerate(archive.infolist()):
+                    if member.is_dir() or _extension(member.filename) not in BATCH_EXTENSIONS:
+                        continue
+                    target = os.path.join(work_dir, f"{index}_{os.path.basename(member.filename)}")
+                    with archive.open(member) as source, open(target, 'wb') as f:
+                        shutil.copyfileobj(source, f)
+                    add(member.filename, target)
+        elif _extension(path) in BATCH_EXTENSIONS:
+            add(os.path.basename(path), path)
+
+    return documents
+
+def _unique_name(name, names):
+    # Number repeated names (report.pdf, report_2.pdf, ...) and remember them
+    base, extension = os.path.splitext(name)
+    unique, counter = name, 1
+    while unique in names:
+        counter += 1
+        unique = f"{base}_{counter}{extension}"
+    names.add(unique)
+    return unique
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def _process_document(task):
+    """
+    Process worker: process one PDF document and report how it went
+
+    Word documents reach it already converted (see process_batch).
+    """
+    name, pdf_file, output_file, options = task
+
+    start = time.perf_counter()
+    stats = {}
+    result = {'name': name, 'success': False, 'error': None}
+    try:
+        if options['processing_type'] == 'booklet':
+            success = dp.impose_pdf(pdf_file, output_file, options['margins'], stats,
+                                    optimize=options['optimize'], **(options['imposition'] or {}))
+        else:
+            process = dp.resize_pdf_to_a5 if options['processing_type'] == 'resize' else dp.split_pdf_to_a5
+            success = process(pdf_file, output_file, options['margins'], options['orientation'],
+                              options['engine'], stats, options['raster_options'], optimize=options['optimize'])
+        if not success:
+            raise RuntimeError('Falha ao processar o documento')
+        result['success'] = True
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['time'] = round(time.perf_counter() - start, 4)
+    result['pages_in'] = stats.get('pages_in')
+    result['pages_out'] = stats.get('pages_out')
+    result['timings'] = stats.get('timings')
+    if 'optimizer' in stats:
+        result['optimizer'] = stats['optimizer']
+    return result
+
+def _pool_context():
+    # Worker processes start from a fresh interpreter rather than a fork
+    # of this one: the server forking from a job thread would hand them
+    # its LibreOffice pool and locks held by other threads. forkserver
+    # forks them from a clean server process that has already loaded
+    # document_processor.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['document_processor'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+def process_batch(documents, output_zip, options=None, workers=None, stats=None):
+    """
+    Process (name, path) documents in a process pool into one output ZIP
+
+    Word documents are first converted to PDF in this process, in batches
+    over the warm LibreOffice workers; only the PDF processing is spread
+    over the pool. Each result is added to the ZIP as soon as it is ready,
+    as <name>_a5.pdf. A failed document is recorded in the report and does
+    not stop the others. The report (one entry per document with its
+    timing and error; conversions are timed for the whole batch, as
+    'convert') is stored in the ZIP as REPORT_NAME and returned. If a stats
+    dict is given, documents_total, documents_done, failures and the
+    report so far can be read from it while the batch runs.
+    """
+    options = dict(default_options(), **(options or {}))
+    workers = max(1, min(workers or BATCH_WORKERS, len(documents) or 1))
+    if stats is None:
+        stats = {}
+    stats.update({'documents_total': len(documents), 'documents_done': 0, 'failures': 0, 'files': [], 'workers': workers})
+
+    start = time.perf_counter()
+    work_dir = tempfile.mkdtemp(prefix='batch_')
+    try:
+        # (name, pdf_file, output_file, conversion error) per document
+        tasks = [
+            (name, path, os.path.join(work_dir, f"{index}.pdf"), None)
+            for index, (name, path) in enumerate(documents)
+        ]
+        words = [index for index, (_, path, _, _) in enumerate(tasks) if _extension(path) in WORD_EXTENSIONS]
+        if words:
+            pairs = [(tasks[index][1], tasks[index][2] + '.converted.pdf') for index in words]
+            with timed(stats, 'convert'):
+                errors = dp.convert_words_to_pdf(pairs)
+            for index, (_, pdf_file), error in zip(words, pairs, errors):
+                tasks[index] = (tasks[index][0], pdf_file, tasks[index][2], error)
+        entries = set()
+
+        def add_result(result, output_file):
+            if result['success']:
+                entry = _unique_name(os.path.splitext(result['name'])[0] + '_a5.pdf', entries)
+                archive.write(output_file, entry)
+                os.remove(output_file)
+                result['output'] = entry
+            else:
+                stats['failures'] += 1
+                logging.error(f"Error processing {result['name']} in batch: {result['error']}")
+
+            merge_timings(stats, result.get('timings'))
+            stats['files'].append(result)
+            stats['documents_done'] += 1
+
+        # PDFs are already compressed, so entries are stored as-is
+        with zipfile.ZipFile(output_zip, 'w', zipfile.ZIP_STORED) as archive:
+            for name, _, output_file, error in tasks:
+                if error is not None:
+                    add_result({'name': name, 'success': False, 'error': error}, output_file)
+
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+                futures = {
+                    pool.submit(_process_document, (name, pdf_file, output_file, options)): (name, pdf_file, output_file)
+                    for name, pdf_file, output_file, error in tasks if error is None
+                }
+                for future in as_completed(futures):
+                    name, pdf_file, output_file = futures[future]
+                    if pdf_file.startswith(work_dir + os.sep):
+                        # Converted Word document, no longer needed
+                        os.remove(pdf_file)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # The worker process itself failed
+                        result = {'name': name, 'success': False, 'error': str(e)}
+                    add_result(result, output_file)
+
+            stats['wall_time'] = round(time.perf_counter() - start, 4)
+            stats['pages_in'] = sum(result.get('pages_in') or 0 for result in stats['files'])
+            stats['pages_out'] = sum(result.get('pages_out') or 0 for result in stats['files'])
+            archive.writestr(REPORT_NAME, json.dumps({
+                'documents': stats['documents_total'],
+                'failures': stats['failures'],
+                'wall_time': stats['wall_time'],
+                'files': stats['files']
+            }, indent=2, ensure_ascii=False))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return stats['files']
+
+if __name__ == '__main__':
+    # Usage: python batch.py -o saida.zip [--split | --booklet 2up] [--engine raster] [--optimize] entrada.pdf pasta/ arquivos.zip ...
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert many documents to A5 into one ZIP')
+    parser.add_argument('inputs', nargs='+', help='PDF/DOC/DOCX files, folders or ZIP archives')
+    parser.add_argument('-o', '--output', required=True, help='output ZIP file')
+    parser.add_argument('--split', action='store_true', help='split each A4 page into two A5 pages')
+    parser.add_argument('--booklet', choices=dp.IMPOSITION_MODES, help='impose as a saddle-stitch booklet on A4 sheets')
+    parser.add_argument('--signature', type=int, help='booklet signature size in pages (multiple of 4)')
+    parser.add_argument('--engine', choices=dp.ENGINES, default=dp.ENGINE_VECTOR)
+    parser.add_argument('--orientation', choices=('portrait', 'landscape'), default='portrait', help='A5 page orientation (not used by --booklet)')
+    parser.add_argument('--margin', type=float, default=0.5, help='margin on every side, in inches')
+    parser.add_argument('--dpi', type=int, help='raster engine resolution (adaptive per page if not given)')
+    parser.add_argument('--target-dpi', type=int, help='resolution of rendered pages on the A5 page')
+    parser.add_argument('--optimize', action='store_true', help='deduplicate, recompress and downsample the outputs')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    args = parser.parse_args()
+    if args.booklet and args.engine != dp.ENGINE_VECTOR:
+        parser.error('--booklet only supports the vector engine')
+
+    logging.basicConfig(level=logging.INFO)
+    work_dir = tempfile.mkdtemp(prefix='batch_inputs_')
+    try:
+        documents = collect_inputs(args.inputs, work_dir)
+        if not documents:
+            sys.exit('No PDF, DOC or DOCX documents found')
+
+        if args.booklet:
+            processing_type = 'booklet'
+        else:
+            processing_type = 'split' if args.split else 'resize'
+
+        report = process_batch(documents, args.output, {
+            'processing_type': processing_type,
+            'margins': {side: args.margin for side in ('top', 'right', 'bottom', 'left')},
+            'orientation': args.orientation,
+            'engine': args.engine,
+            'raster_options': {'dpi': args.dpi, 'target_dpi': args.target_dpi},
+            'imposition': {'mode': args.booklet, 'signature_size': args.signature} if args.booklet else None,
+            'optimize': args.optimize
+        }, workers=args.workers)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    failures = [result for result in report if not result['success']]
+    for result in failures:
+        print(f"FAILED {result['name']}: {result['error']}", file=sys.stderr)
+    print(f"{len(report) - len(failures)}/{len(report)} documents converted into {args.output}")
+    sys.exit(1 if failures else 0)
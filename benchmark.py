@@ -0,0 +1,482 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import platform
+import tempfile
+import subprocess
+from PIL import Image, ImageDraw
+from reportlab.lib.pagesizes import A3, A4, A5, letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+# Synthetic fixtures: kind of content and page counts
+FIXTURE_KINDS = ('text', 'image', 'mixed')
+FIXTURE_PAGES = (1, 50, 500)
+FIXTURE_FOLDER = os.environ.get('BENCHMARK_FIXTURES', '/tmp/benchmark_fixtures')
+FIXTURE_SEED = 1234
+
+# Raster engine resolutions measured
+BENCHMARK_DPIS = (100, 200)
+
+# A case is a regression when a metric grows by more than this fraction
+# over the baseline
+REGRESSION_THRESHOLD = 0.10
+# Wall time changes smaller than this (seconds) are noise, whatever the ratio
+MIN_TIME_DELTA = 0.05
+COMPARED_METRICS = ('wall_time', 'peak_rss_kb', 'output_size', 'subprocesses')
+
+# Page sizes cycled through by the mixed fixture
+MIXED_PAGE_SIZES = (A4, letter, (A4[1], A4[0]), A5, A3)
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+    'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip'
+).split()
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def _paragraphs(rng, count):
+    return [' '.join(_sentence(rng, rng.randint(6, 18)) for _ in range(rng.randint(1, 8))) for _ in range(count)]
+
+def _photo(rng, size=(800, 1100)):
+    # Smooth gradient with blobs and noise: compresses like a scan or photo
+    width, height = size
+    gradient = Image.linear_gradient('L').resize(size)
+    img = Image.merge('RGB', (gradient, gradient.rotate(90).resize(size), Image.new('L', size, rng.randint(60, 200))))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y, radius = rng.randint(0, width), rng.randint(0, height), rng.randint(40, 220)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    noise = Image.effect_noise(size, 24).convert('RGB')
+    return Image.blend(img, noise, 0.15)
+
+def _jpeg(img, quality=75):
+    # JPEG data is embedded as-is, like the images of scanned documents
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    buffer.seek(0)
+    return ImageReader(buffer)
+
+def _draw_text_page(pdf, rng, page_size, top=None):
+    width, height = page_size
+    text = pdf.beginText(40, (top or height) - 50)
+    text.setFont('Helvetica', 10)
+    line = ''
+    while text.getY() > 50:
+        word = rng.choice(WORDS)
+        if pdf.stringWidth(f"{line} {word}", 'Helvetica', 10) > width - 80:
+            text.textLine(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    pdf.drawText(text)
+
+def make_fixture(path, kind, pages, seed=FIXTURE_SEED):
+    """
+    Write a synthetic PDF of `pages` pages
+
+    kind options:
+    - 'text': A4 pages filled with lines of text (vector content only)
+    - 'image': A4 pages each holding a distinct full-page photo-like image
+    - 'mixed': text and a smaller image on pages of varying size and orientation
+
+    The same arguments always produce the same content.
+    """
+    rng = random.Random(f"{kind}-{pages}-{seed}")
+    pdf = canvas.Canvas(path, pagesize=A4)
+    photos = [_photo(rng) for _ in range(4)] if kind != 'text' else []
+
+    for page in range(pages):
+        page_size = MIXED_PAGE_SIZES[page % len(MIXED_PAGE_SIZES)] if kind == 'mixed' else A4
+        pdf.setPageSize(page_size)
+        width, height = page_size
+
+        if kind == 'text':
+            _draw_text_page(pdf, rng, page_size)
+        else:
+            # Stamp the page number so every page has its own image
+            img = photos[page % len(photos)].copy()
+            ImageDraw.Draw(img).rectangle((20, 20, 120 + page % 300, 60), fill=(page % 256, 40, 90))
+            if kind == 'image':
+                pdf.drawImage(_jpeg(img), 0, 0, width, height)
+            else:
+                pdf.drawImage(_jpeg(img.resize((400, 550))), 40, height / 2, width / 2 - 40, height / 2 - 40)
+                _draw_text_page(pdf, rng, page_size, top=height / 2)
+        pdf.showPage()
+
+    pdf.save()
+
+def make_text_fixture(path, paragraphs, seed=FIXTURE_SEED):
+    """
+    Write a plain text file of `paragraphs` paragraphs separated by blank lines
+    """
+    rng = random.Random(f"text-{paragraphs}-{seed}")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(_paragraphs(rng, paragraphs)))
+
+def make_docx_fixture(path, paragraphs, seed=FIXTURE_SEED):
+    """
+    Write a minimal Word document of `paragraphs` paragraphs
+    """
+    rng = random.Random(f"docx-{paragraphs}-{seed}")
+    body = ''.join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in _paragraphs(rng, paragraphs))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        docx.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/>'
+            '</Relationships>'
+        ))
+        docx.writestr('word/document.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f"<w:body>{body}</w:body></w:document>"
+        ))
+
+def fixture_path(kind, pages, folder=FIXTURE_FOLDER):
+    """
+    Return the path of a fixture, creating it on first use
+
+    kind is one of FIXTURE_KINDS (a PDF), 'txt' or 'docx'; for the last two
+    `pages` is scaled to a number of paragraphs filling about that many
+    A5 pages.
+    """
+    os.makedirs(folder, exist_ok=True)
+    extension = kind if kind in ('txt', 'docx') else 'pdf'
+    path = os.path.join(folder, f"{kind}_{pages}_{FIXTURE_SEED}.{extension}")
+    if not os.path.exists(path):
+        temp_path = f"{path}.part"
+        if kind == 'txt':
+            make_text_fixture(temp_path, pages * 3)
+        elif kind == 'docx':
+            make_docx_fixture(temp_path, pages * 3)
+        else:
+            make_fixture(temp_path, kind, pages)
+        os.replace(temp_path, path)
+    return path
+
+def default_cases(pages=FIXTURE_PAGES, dpis=BENCHMARK_DPIS):
+    """
+    Return the benchmark cases: every processing path on every fixture
+
+    Each case is a dict with a unique name, the document_processor
+    operation, its fixture (kind, pages) and the keyword options of the
+    call.
+    """
+    import document_processor as dp
+
+    cases = []
+    for kind in FIXTURE_KINDS:
+        for count in pages:
+            for operation in ('resize', 'split'):
+                cases.append({
+                    'name': f"{operation}/{kind}/{count}/vector", 'operation': operation,
+                    'fixture': [kind, count], 'options': {'engine': dp.ENGINE_VECTOR}
+                })
+                cases.append({
+                    'name': f"{operation}/{kind}/{count}/vector-optimized", 'operation': operation,
+                    'fixture': [kind, count], 'options': {'engine': dp.ENGINE_VECTOR, 'optimize': True}
+                })
+                cases.append({
+                    'name': f"{operation}/{kind}/{count}/raster-auto", 'operation': operation,
+                    'fixture': [kind, count], 'options': {'engine': dp.ENGINE_RASTER}
+                })
+                # Margins changed after a first run: only the compose stage is left
+                cases.append({
+                    'name': f"{operation}/{kind}/{count}/raster-relayout", 'operation': operation,
+                    'fixture': [kind, count], 'options': {'engine': dp.ENGINE_RASTER}, 'relayout': True
+                })
+                # Fixed resolutions render every page, as the baseline of the adaptive plan
+                for dpi in dpis:
+                    cases.append({
+                        'name': f"{operation}/{kind}/{count}/raster-{dpi}", 'operation': operation,
+                        'fixture': [kind, count],
+                        'options': {'engine': dp.ENGINE_RASTER, 'raster_options': {'dpi': dpi, 'vector_pages': False}}
+                    })
+            cases.append({
+                'name': f"booklet/{kind}/{count}/vector", 'operation': 'booklet',
+                'fixture': [kind, count], 'options': {'mode': dp.IMPOSITION_2UP}
+            })
+
+    for count in pages:
+        for layout in ('single', 'double'):
+            cases.append({
+                'name': f"text/{count}/{layout}", 'operation': 'text',
+                'fixture': ['txt', count], 'options': {'text_layout': layout}
+            })
+        cases.append({'name': f"word/{count}", 'operation': 'word', 'fixture': ['docx', count], 'options': {}})
+    return cases
+
+def run_case(case, output_file):
+    """
+    Run one case in this process and return its measurements
+
+    Subprocesses (poppler, LibreOffice) are counted as they are started.
+    """
+    import document_processor as dp
+    import word_converter
+
+    spawned = [0]
+    execute_child = subprocess.Popen._execute_child
+
+    def counting_execute_child(*args, **kwargs):
+        spawned[0] += 1
+        return execute_child(*args, **kwargs)
+
+    subprocess.Popen._execute_child = counting_execute_child
+
+    operation, options = case['operation'], dict(case['options'])
+    input_file = fixture_path(*case['fixture'])
+    margins = {'top': 0.5, 'right': 0.5, 'bottom': 0.5, 'left': 0.5}
+    stats = {}
+
+    if case.get('relayout'):
+        # Fill a page cache with a first, unmeasured run with other margins
+        cache_folder = tempfile.mkdtemp(prefix='page_cache_')
+        options['raster_options'] = dict(options.get('raster_options') or {}, page_cache=cache_folder)
+        process = dp.resize_pdf_to_a5 if operation == 'resize' else dp.split_pdf_to_a5
+        process(input_file, output_file, dict(margins, top=0.75, left=0.25), stats={}, **options)
+        spawned[0] = 0
+
+    start = time.perf_counter()
+    if operation == 'resize':
+        success = dp.resize_pdf_to_a5(input_file, output_file, margins, stats=stats, **options)
+    elif operation == 'split':
+        success = dp.split_pdf_to_a5(input_file, output_file, margins, stats=stats, **options)
+    elif operation == 'booklet':
+        success = dp.impose_pdf(input_file, output_file, margins, stats=stats, **options)
+    elif operation == 'text':
+        with open(input_file, encoding='utf-8') as f:
+            success = dp.create_pdf_from_text(f, output_file, margins=margins, stats=stats, **options)
+    elif operation == 'word':
+        if not word_converter.is_available() and sys.platform not in ('win32', 'darwin'):
+            return {'skipped': 'LibreOffice (soffice) was not found'}
+        success = dp.convert_word_to_pdf(input_file, output_file)
+    else:
+        raise ValueError(f"Unknown operation: {operation}")
+    wall_time = time.perf_counter() - start
+
+    if case.get('relayout'):
+        shutil.rmtree(cache_folder, ignore_errors=True)
+
+    return {
+        'success': bool(success),
+        'wall_time': round(wall_time, 4),
+        'peak_rss_kb': _peak_rss_kb(),
+        'output_size': os.path.getsize(output_file) if success and os.path.exists(output_file) else None,
+        'subprocesses': spawned[0],
+        'optimizer': stats.get('optimizer'),
+        'stats': {key: value for key, value in stats.items() if isinstance(value, (int, float, str, bool))}
+    }
+
+def _peak_rss_kb():
+    # Peak RSS of this process and of the subprocesses it waited for. The
+    # rusage of a process also carries the peak of the parent it was
+    # forked from, so this process's own peak is read from VmHWM, which
+    # starts over at exec; a subprocess started from here inherits at most
+    # this process's peak, so taking the max stays correct.
+    import resource
+
+    own = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    own = int(line.split()[1])
+    except OSError:
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max(own or 0, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def measure(case, work_dir, repeat=1):
+    """
+    Run a case `repeat` times, each in a fresh process, and keep the fastest run
+
+    Each run gets its own interpreter, so its peak RSS belongs to that
+    case alone.
+    """
+    runs = []
+    for index in range(repeat):
+        output_file = os.path.join(work_dir, f"{index}.pdf")
+        log_file = os.path.join(work_dir, f"{index}.log")
+        with open(log_file, 'w+b') as log:
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case), '--output-file', output_file],
+                stdout=log, stderr=subprocess.STDOUT, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            process.wait()
+            log.seek(0)
+            lines = log.read().decode(errors='replace').strip().splitlines()
+
+        try:
+            result = json.loads(lines[-1])
+        except (ValueError, IndexError):
+            result = {'success': False, 'error': '\n'.join(lines[-5:]) or f"exit status {process.returncode}"}
+        if not result.get('success') and not result.get('error') and 'skipped' not in result:
+            # The processors log their errors instead of raising them
+            result['error'] = '\n'.join(lines[-6:-1]) or 'failed'
+        for path in (output_file, log_file):
+            if os.path.exists(path):
+                os.remove(path)
+        runs.append(result)
+
+    measured = [run for run in runs if run.get('success')]
+    best = min(measured, key=lambda run: run['wall_time']) if measured else runs[0]
+    best['name'] = case['name']
+    best['runs'] = len(runs)
+    return best
+
+def run_benchmarks(cases, repeat=1, progress=None):
+    """
+    Measure every case and return the results document
+
+    The document holds the environment (Python, platform, CPU count,
+    git commit) and one result per case with wall_time (seconds),
+    peak_rss_kb, output_size (bytes), subprocesses and the processor
+    stats.
+    """
+    # Create the fixtures up front, so they do not count in the measurements
+    for case in cases:
+        fixture_path(*case['fixture'])
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    results = []
+    try:
+        for case in cases:
+            result = measure(case, work_dir, repeat)
+            results.append(result)
+            if progress:
+                progress(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {'environment': _environment(), 'results': results}
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare results with a baseline results document
+
+    Returns one entry per case found in both, with the ratio (new / old)
+    of each metric and the metrics that regressed by more than threshold
+    (and, for wall time, by at least MIN_TIME_DELTA).
+    """
+    previous = {result['name']: result for result in baseline['results']}
+    comparison = []
+    for result in results['results']:
+        old = previous.get(result['name'])
+        if not old or not result.get('success') or not old.get('success'):
+            continue
+        ratios = {}
+        for metric in COMPARED_METRICS:
+            if old.get(metric) and result.get(metric) is not None:
+                ratios[metric] = round(result[metric] / old[metric], 3)
+        regressions = [metric for metric, ratio in ratios.items() if ratio > 1 + threshold]
+        if old.get('subprocesses') == 0 and result.get('subprocesses'):
+            regressions.append('subprocesses')
+        if 'wall_time' in regressions and result['wall_time'] - old['wall_time'] < MIN_TIME_DELTA:
+            regressions.remove('wall_time')
+        comparison.append({'name': result['name'], 'ratios': ratios, 'regressions': regressions})
+    return comparison
+
+if __name__ == '__main__':
+    # Usage: python benchmark.py [--pages 1 50] [--filter resize/] [--repeat 3]
+    #            [--output resultados.json] [--baseline base.json] [--save-baseline base.json]
+    #
+    # No baseline is committed: timings and memory only compare on the
+    # same machine. Record one from the commit to compare against, e.g.
+    #   git checkout <reference> && python benchmark.py --repeat 3 --save-baseline /tmp/base.json
+    #   git checkout - && python benchmark.py --repeat 3 --baseline /tmp/base.json
+    # The second run exits with status 1 when a case regressed.
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the document processing paths on synthetic fixtures',
+        epilog='Baselines are machine specific and not kept in the repository: write one with '
+               '--save-baseline on the reference commit, then compare later runs on the same '
+               'machine with --baseline (exit status 1 on a regression).'
+    )
+    parser.add_argument('--pages', type=int, nargs='+', default=list(FIXTURE_PAGES), help='fixture page counts')
+    parser.add_argument('--dpi', type=int, nargs='+', default=list(BENCHMARK_DPIS), help='raster engine resolutions')
+    parser.add_argument('--filter', action='append', help='only run cases whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case (the fastest is kept)')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results file of an earlier run on this machine to compare with')
+    parser.add_argument('--save-baseline', help='also write the results to this file, to use later as --baseline')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--output-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        # Child process of measure(): run a single case and print its result
+        try:
+            result = run_case(json.loads(args.run_case), args.output_file)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        print(json.dumps(result))
+        sys.exit(0)
+
+    cases = default_cases(args.pages, args.dpi)
+    if args.filter:
+        cases = [case for case in cases if any(text in case['name'] for text in args.filter)]
+
+    def report(result):
+        if 'skipped' in result:
+            print(f"{result['name']:<32} skipped: {result['skipped']}")
+        elif not result.get('success'):
+            print(f"{result['name']:<32} FAILED: {result.get('error') or result.get('stats')}")
+        else:
+            print(
+                f"{result['name']:<32} {result['wall_time']:>9.3f}s {result.get('peak_rss_kb') or 0:>9} KB"
+                f" {result['output_size'] or 0:>11} B {result['subprocesses']:>4} proc"
+            )
+
+    results = run_benchmarks(cases, args.repeat, report)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    regressions = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for entry in compare(results, baseline, args.threshold):
+            changes = ' '.join(f"{metric}={ratio:.2f}x" for metric, ratio in entry['ratios'].items())
+            marker = 'REGRESSION' if entry['regressions'] else 'ok'
+            print(f"{entry['name']:<32} {marker:<10} {changes}")
+            regressions += bool(entry['regressions'])
+    sys.exit(1 if regressions else 0)
@@ -1,471 +1,1087 @@
 import os
+import io
+import math
+import time
 import logging
-import tempfile
-from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2 import PageObject, PdfReader, PdfWriter, Transformation
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject, RectangleObject
 from reportlab.lib.pagesizes import A4, A5
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
-from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
-from reportlab.lib.units import inch
-import subprocess
-from pdf2image import convert_from_path
-from docx2pdf import convert
-import io
+import word_converter
+from concurrent.futures import ProcessPoolExecutor
+from pdf_output import IMAGE_FORMAT_FLATE, IMAGE_FORMAT_JPEG, IMAGE_FORMATS, encode_image, open_output
+from thumbnails import THUMBNAIL_WIDTH, compose_thumbnail, save_thumbnail
+from page_cache import PageCache
+from result_cache import file_digest
+from metrics import merge_timings, timed
+from page_analysis import CONTENT_EMPTY, CONTENT_IMAGES, CONTENT_TEXT, ENGINE_RASTER, ENGINE_VECTOR, ENGINES, analyze_page, visible_size
 
 # Constants for page sizes (in points)
 A4_WIDTH, A4_HEIGHT = A4  # 595.276, 841.89 points
 A5_WIDTH, A5_HEIGHT = A5  # 419.528, 595.276 points
 
+# Raster engine settings
+# Adaptive resolution: pages are rendered at the lowest DPI that gives
+# RASTER_TARGET_DPI on the output page, within these bounds. Scanned pages
+# are not rendered finer than their own images.
+RASTER_TARGET_DPI = 300
+RASTER_MIN_DPI = 75
+RASTER_MAX_DPI = 600
+# Adaptive resolutions are rounded up to a multiple of this, so pages of
+# similar sizes share a resolution and are rendered by the same poppler call
+RASTER_DPI_STEP = 25
+# Pages rendered per poppler call; bounds memory to one chunk of page images
+RASTER_CHUNK_SIZE = 8
+# With a page cache, a page is not rendered again for a new layout when it
+# is cached at a resolution up to this many times finer than planned
+PAGE_CACHE_REUSE_RATIO = 1.5
+
+# Output pages whose thumbnails are rendered from the input before a
+# document is processed, when a preview is asked for (see _write_preview)
+PREVIEW_PAGES = int(os.environ.get('PREVIEW_PAGES', '4'))
+
+# Raster outputs with at least this many pages are streamed to disk page
+# by page instead of being built on a single canvas in memory
+STREAMING_PAGE_THRESHOLD = 200
+
+# Default raster options, overridable per call with a raster_options dict
+DEFAULT_RASTER_OPTIONS = {
+    'dpi': None,  # None picks the resolution of each page (see plan_raster_pages)
+    'target_dpi': RASTER_TARGET_DPI,
+    'vector_pages': True,  # place pages without images as vectors instead of rendering them
+    'chunk_size': RASTER_CHUNK_SIZE,
+    'image_format': IMAGE_FORMAT_FLATE,
+    'jpeg_quality': 85,
+    'streaming': None,  # None picks streaming from the page count
+    'thumbnails': None,  # path with a {page} field to also save page thumbnails
+    'page_cache': None  # folder of a PageCache keeping rendered pages between runs
+}
+
+# Each convert_from_path call runs pdfinfo, a pdftoppm version probe and pdftoppm
+_SUBPROCESSES_PER_RENDER = 3
+
+# Imposition modes, both on A4 sheets printed on both sides
+# - '2up': two A5 pages side by side on a landscape sheet
+# - '4up': four A6 pages in a 2x2 grid on a portrait sheet
+IMPOSITION_2UP = '2up'
+IMPOSITION_4UP = '4up'
+IMPOSITION_MODES = (IMPOSITION_2UP, IMPOSITION_4UP)
+
+# Page-parallel processing of the raster engine: number of worker
+# processes per document (1 to disable) and minimum document size worth
+# the pool start-up. The vector engine always runs serially: its page
+# transforms cost less than merging the parts of a pool back together.
+DEFAULT_WORKERS = int(os.environ.get('PDF_WORKERS', '1'))
+PARALLEL_MIN_PAGES = 50
+
 def convert_word_to_pdf(input_file, output_file):
     """
     Convert Word document to PDF
+
+    Uses the pool of warm LibreOffice workers when LibreOffice is
+    installed, otherwise docx2pdf (which needs Microsoft Word).
     """
+    if word_converter.is_available():
+        try:
+            word_converter.get_pool().convert(input_file, output_file)
+            return True
+        except Exception as e:
+            logging.error(f"Error converting Word to PDF with LibreOffice: {str(e)}")
+            return False
+
     try:
         # Try using docx2pdf converter
+        from docx2pdf import convert
         convert(input_file, output_file)
         return True
     except Exception as e:
         logging.error(f"Error converting Word to PDF with docx2pdf: {str(e)}")
-        try:
-            # Fallback: try using LibreOffice if available (uncomment if needed)
-            # cmd = ['libreoffice', '--headless', '--convert-to', 'pdf', 
-            #       '--outdir', os.path.dirname(output_file), input_file]
-            # subprocess.run(cmd, check=True)
-            # 
-            # # Rename the output file to match the expected output_file path
-            # original_name = os.path.splitext(os.path.basename(input_file))[0] + '.pdf'
-            # original_path = os.path.join(os.path.dirname(output_file), original_name)
-            # if os.path.exists(original_path):
-            #     os.rename(original_path, output_file)
-            #     return True
-            
-            # If both methods fail, return False
-            return False
-        except Exception as e2:
-            logging.error(f"Error during fallback Word to PDF conversion: {str(e2)}")
-            return False
+        return False
 
-def resize_pdf_to_a5(input_file, output_file, margins, orientation='portrait'):
+def convert_words_to_pdf(pairs):
     """
-    Resize a PDF from any size to A5 format
+    Convert many (input_file, output_file) Word documents to PDF
+
+    Returns the errors in order (None on success). With LibreOffice the
+    documents are spread in batches over the warm workers of this process
+    (see OfficeConverterPool.convert_many); otherwise each one goes through
+    convert_word_to_pdf.
     """
+    if not word_converter.is_available():
+        return [None if convert_word_to_pdf(input_file, output_file) else 'Falha ao converter documento Word para PDF'
+                for input_file, output_file in pairs]
+
     try:
-        # Determine target dimensions based on orientation
-        if orientation == 'portrait':
-            target_width, target_height = A5_WIDTH, A5_HEIGHT
-        else:  # landscape
-            target_width, target_height = A5_HEIGHT, A5_WIDTH
-        
-        # Apply margins (convert inches to points)
-        margin_left = margins['left'] * 72
-        margin_right = margins['right'] * 72
-        margin_top = margins['top'] * 72
-        margin_bottom = margins['bottom'] * 72
-        
+        errors = word_converter.get_pool().convert_many(pairs)
+    except Exception as e:
+        errors = [str(e)] * len(pairs)
+    for (input_file, _), error in zip(pairs, errors):
+        if error is not None:
+            logging.error(f"Error converting {input_file} to PDF with LibreOffice: {error}")
+    return ['Falha ao converter documento Word para PDF' if error is not None else None for error in errors]
+
+def _page_layout(margins, orientation):
+    """
+    Compute the target page size and the content area inside the margins
+    """
+    # Determine target dimensions based on orientation
+    if orientation == 'portrait':
+        target_width, target_height = A5_WIDTH, A5_HEIGHT
+    else:  # landscape
+        target_width, target_height = A5_HEIGHT, A5_WIDTH
+
+    # Apply margins (convert inches to points)
+    margin_left = margins['left'] * 72
+    margin_right = margins['right'] * 72
+    margin_top = margins['top'] * 72
+    margin_bottom = margins['bottom'] * 72
+
+    return {
+        'target_width': target_width,
+        'target_height': target_height,
+        'margin_left': margin_left,
+        'margin_bottom': margin_bottom,
         # Adjusted dimensions
-        content_width = target_width - margin_left - margin_right
-        content_height = target_height - margin_top - margin_bottom
-        
-        # Create a new PDF with the target size
-        reader = PdfReader(input_file)
-        writer = PdfWriter()
-        
-        # Process each page
-        for page_num in range(len(reader.pages)):
-            # Create a new PDF page with A5 size
-            packet = io.BytesIO()
-            can = canvas.Canvas(packet, pagesize=(target_width, target_height))
-            
-            # Get the original page
-            original_page = reader.pages[page_num]
-            
-            # Extract the page as an image to maintain all content
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=True) as temp_pdf:
-                # Create a temporary PDF with just this page
-                temp_writer = PdfWriter()
-                temp_writer.add_page(original_page)
-                temp_writer.write(temp_pdf)
-                temp_pdf.flush()
-                
-                # Convert page to image
-                images = convert_from_path(temp_pdf.name, dpi=200)
-                if images:
-                    # Get first image from the page
-                    img = images[0]
-                    
-                    # Calculate scaling to fit within the content area
-                    img_width, img_height = img.size
-                    scale_x = content_width / img_width
-                    scale_y = content_height / img_height
-                    
-                    # Use the smaller scaling factor to ensure everything fits
-                    scale = min(scale_x, scale_y)
-                    
-                    # Calculate scaled dimensions
-                    scaled_width = img_width * scale
-                    scaled_height = img_height * scale
-                    
-                    # Calculate position to center the content
-                    x_pos = margin_left + (content_width - scaled_width) / 2
-                    y_pos = margin_bottom + (content_height - scaled_height) / 2
-                    
-                    # Save image to a temporary file
-                    with tempfile.NamedTemporaryFile(suffix='.png', delete=True) as temp_img:
-                        img.save(temp_img.name, format='PNG')
-                        temp_img.flush()
-                        
-                        # Draw the image on the canvas
-                        can.drawImage(temp_img.name, x_pos, y_pos, width=scaled_width, height=scaled_height)
-            
-            # Save the canvas
-            can.save()
-            
-            # Move to the beginning of the buffer
-            packet.seek(0)
-            
-            # Create a new PDF from the canvas
-            new_pdf = PdfReader(packet)
-            
-            # Add the page to our output
-            writer.add_page(new_pdf.pages[0])
-        
-        # Write the output file
-        with open(output_file, 'wb') as f:
-            writer.write(f)
-        
+        'content_width': target_width - margin_left - margin_right,
+        'content_height': target_height - margin_top - margin_bottom
+    }
+
+def _fit_box(width, height, layout):
+    """
+    Scale a box to fit the content area and center it
+
+    Returns (scale, x_pos, y_pos) in target page coordinates
+    """
+    # Use the smaller scaling factor to ensure everything fits
+    scale = min(layout['content_width'] / width, layout['content_height'] / height)
+
+    # Calculate position to center the content
+    x_pos = layout['margin_left'] + (layout['content_width'] - width * scale) / 2
+    y_pos = layout['margin_bottom'] + (layout['content_height'] - height * scale) / 2
+
+    return scale, x_pos, y_pos
+
+def _content_matrix(page, region, layout):
+    """
+    Compute how a region of a page is scaled and centered onto the target
+
+    region is (x, y, width, height) in displayed page coordinates, relative
+    to the lower-left corner of the visible area. Returns (ctm, scale,
+    x_pos, y_pos): the transformation from page space to target space and
+    the placement of the region on the target.
+    """
+    box = page.cropbox
+    left, bottom = float(box.left), float(box.bottom)
+    width, height = float(box.width), float(box.height)
+    rotation = page.rotation % 360
+
+    # Move the visible area to the origin and undo /Rotate, so the content
+    # is laid out the way a viewer would display it
+    ctm = Transformation().translate(-left, -bottom)
+    if rotation == 90:
+        ctm = ctm.rotate(-90).translate(0, width)
+    elif rotation == 180:
+        ctm = ctm.rotate(180).translate(width, height)
+    elif rotation == 270:
+        ctm = ctm.rotate(90).translate(height, 0)
+
+    # Then move the region to the origin, scale it and center it
+    region_x, region_y, region_width, region_height = region
+    scale, x_pos, y_pos = _fit_box(region_width, region_height, layout)
+    ctm = ctm.translate(-region_x, -region_y).scale(scale, scale).translate(x_pos, y_pos)
+
+    return ctm, scale, x_pos, y_pos
+
+def _place_page_vector(writer, page, region, layout):
+    """
+    Scale and center a region of a writer page onto the target page, in place
+
+    region is as for _content_matrix. The original content streams are not
+    touched: a prefix stream sets a clipping rectangle and the
+    transformation matrix, and a suffix stream restores the graphics state,
+    so text and vector content stay byte-identical.
+    """
+    ctm, scale, x_pos, y_pos = _content_matrix(page, region, layout)
+    region_width, region_height = region[2], region[3]
+
+    # Clip to the placed region so nothing outside of it shows on the page
+    prefix = DecodedStreamObject()
+    prefix.set_data(
+        ("q %f %f %f %f re W n %f %f %f %f %f %f cm\n" % (
+            (x_pos, y_pos, region_width * scale, region_height * scale) + tuple(ctm.ctm)
+        )).encode('ascii')
+    )
+    suffix = DecodedStreamObject()
+    suffix.set_data(b"\nQ\n")
+
+    streams = []
+    if '/Contents' in page:
+        contents = page.raw_get('/Contents')
+        if isinstance(contents.get_object(), ArrayObject):
+            streams = list(contents.get_object())
+        else:
+            streams = [contents]
+    # Streams must be indirect objects of the output document
+    page[NameObject('/Contents')] = ArrayObject(
+        [writer._add_object(prefix)] + streams + [writer._add_object(suffix)]
+    )
+
+    # The page now has the target size and no rotation
+    page[NameObject('/MediaBox')] = RectangleObject([0, 0, layout['target_width'], layout['target_height']])
+    page[NameObject('/CropBox')] = RectangleObject([0, 0, layout['target_width'], layout['target_height']])
+    page[NameObject('/Rotate')] = NumberObject(0)
+    for key in ('/BleedBox', '/TrimBox', '/ArtBox'):
+        if key in page:
+            del page[key]
+
+    # Annotations keep their original coordinates, which no longer match
+    # the content (the raster engine drops them as well)
+    if '/Annots' in page:
+        del page['/Annots']
+
+def _split_regions(page_width, page_height, orientation):
+    """
+    Return the two halves of a page as (x, y, width, height) regions, in reading order
+    """
+    if orientation == 'portrait':
+        # Split horizontally (left and right halves)
+        return [
+            (0, 0, page_width / 2, page_height),
+            (page_width / 2, 0, page_width / 2, page_height)
+        ]
+    # Split vertically (top and bottom halves)
+    return [
+        (0, page_height / 2, page_width, page_height / 2),
+        (0, 0, page_width, page_height / 2)
+    ]
+
+def _raster_options(raster_options):
+    """
+    Merge raster options with the defaults and validate them
+    """
+    options = dict(DEFAULT_RASTER_OPTIONS)
+    if raster_options:
+        options.update({key: value for key, value in raster_options.items() if value is not None})
+
+    options['dpi'] = int(options['dpi']) if options['dpi'] else None
+    options['target_dpi'] = int(options['target_dpi'])
+    if isinstance(options['vector_pages'], str):
+        options['vector_pages'] = options['vector_pages'].lower() not in ('false', '0')
+    options['chunk_size'] = max(1, int(options['chunk_size']))
+    options['jpeg_quality'] = min(95, max(1, int(options['jpeg_quality'])))
+    if options['image_format'] not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {options['image_format']}")
+
+    return options
+
+def plan_raster_pages(reader, layout, orientation, split, options):
+    """
+    Decide, page by page, how the raster engine produces a document
+
+    Returns one (mode, dpi, content) per page. Pages without images are
+    placed as vectors ('vector', None) when options['vector_pages'] is set:
+    rendering them only loses quality. Other pages are rendered ('raster')
+    at options['dpi'] if given, otherwise at the lowest resolution giving
+    options['target_dpi'] once scaled onto the target page; scanned pages
+    are not rendered finer than their images. Pages that cannot be analyzed
+    are always rendered, at the target resolution.
+    """
+    plan = []
+    for page in reader.pages:
+        analysis = analyze_page(page)
+        content = analysis['content']
+        if options['vector_pages'] and content in (CONTENT_EMPTY, CONTENT_TEXT):
+            plan.append(('vector', None, content))
+            continue
+
+        if options['dpi']:
+            plan.append(('raster', options['dpi'], content))
+            continue
+
+        # A page inch shrinks to `scale` inches on the target, so rendering
+        # at target_dpi * scale gives target_dpi on the output page
+        page_width, page_height = visible_size(page)
+        region = _split_regions(page_width, page_height, orientation)[0] if split else (0, 0, page_width, page_height)
+        scale = _fit_box(region[2], region[3], layout)[0]
+        dpi = options['target_dpi'] * scale
+        if content == CONTENT_IMAGES and analysis['image_ppi']:
+            dpi = min(dpi, analysis['image_ppi'])
+        dpi = RASTER_DPI_STEP * math.ceil(dpi / RASTER_DPI_STEP)
+        plan.append(('raster', min(RASTER_MAX_DPI, max(RASTER_MIN_DPI, dpi)), content))
+
+    return plan
+
+def _plan_summary(plan):
+    """
+    Group a page plan into runs of consecutive pages with the same decision
+    """
+    runs = []
+    for page_num, (mode, dpi, content) in enumerate(plan, 1):
+        if runs and runs[-1]['last_page'] == page_num - 1 and (runs[-1]['mode'], runs[-1]['dpi'], runs[-1]['content']) == (mode, dpi, content):
+            runs[-1]['last_page'] = page_num
+        else:
+            runs.append({'first_page': page_num, 'last_page': page_num, 'mode': mode, 'dpi': dpi, 'content': content})
+    return runs
+
+def _reuse_cached_pages(plan, cached_dpis):
+    """
+    Raise the planned resolutions to those the pages are already cached at
+
+    A new layout usually plans slightly different resolutions; a page
+    cached at up to PAGE_CACHE_REUSE_RATIO times the planned resolution is
+    used as it is instead of being rendered again. cached_dpis is
+    {page_num: [dpi]} (see PageCache.cached_dpis).
+    """
+    reused = []
+    for page_num, (mode, dpi, content) in enumerate(plan):
+        if mode == 'raster':
+            dpi = next((cached for cached in cached_dpis.get(page_num, []) if dpi <= cached <= dpi * PAGE_CACHE_REUSE_RATIO), dpi)
+        reused.append((mode, dpi, content))
+    return reused
+
+def _render_chunks(pages, chunk_size):
+    # Split (page_num, dpi) pages into runs of consecutive pages with the
+    # same resolution, of at most chunk_size pages: one poppler call each
+    chunk = []
+    for page_num, dpi in pages:
+        if chunk and (len(chunk) == chunk_size or page_num != chunk[-1][0] + 1 or dpi != chunk[-1][1]):
+            yield chunk
+            chunk = []
+        chunk.append((page_num, dpi))
+    if chunk:
+        yield chunk
+
+def _render_pages(input_file, pages, stats, chunk_size=RASTER_CHUNK_SIZE):
+    """
+    Rasterize pages in chunks, yielding (page_num, image) in order
+
+    pages is a list of (page_num, dpi), with 0-based page numbers in
+    increasing order. The input file is rendered directly, so no per-page
+    temporary PDFs are written, and only one chunk of page images is held in
+    memory at a time. Render calls, poppler subprocesses and render time are
+    added to stats.
+    """
+    from pdf2image import convert_from_path
+
+    stats.setdefault('raster_calls', 0)
+    stats.setdefault('raster_subprocesses', 0)
+    stats.setdefault('raster_time', 0.0)
+
+    for chunk in _render_chunks(pages, chunk_size):
+        (chunk_first, dpi), chunk_last = chunk[0], chunk[-1][0]
+
+        start = time.perf_counter()
+        with timed(stats, 'render'):
+            images = convert_from_path(input_file, dpi=dpi, first_page=chunk_first + 1, last_page=chunk_last + 1)
+        stats['raster_time'] = round(stats['raster_time'] + time.perf_counter() - start, 4)
+        stats['raster_calls'] += 1
+        stats['raster_subprocesses'] += _SUBPROCESSES_PER_RENDER
+
+        for offset, img in enumerate(images):
+            yield chunk_first + offset, img
+
+def _raster_parts(img, orientation, split):
+    """
+    Return the images to place on output pages for one rendered page
+    """
+    if not split:
+        return [img]
+
+    img_width, img_height = img.size
+    if orientation == 'portrait':
+        # Split horizontally (left and right halves)
+        return [
+            img.crop((0, 0, img_width // 2, img_height)),
+            img.crop((img_width // 2, 0, img_width, img_height))
+        ]
+    # Split vertically (top and bottom halves)
+    return [
+        img.crop((0, 0, img_width, img_height // 2)),
+        img.crop((0, img_height // 2, img_width, img_height))
+    ]
+
+def _parts_name(orientation, split):
+    # How a page is cut into parts: whole, left and right or top and bottom halves
+    if not split:
+        return 'page'
+    return 'lr' if orientation == 'portrait' else 'tb'
+
+def _raster_extracts(input_file, pages, orientation, split, options, stats, cache=None):
+    """
+    Page extract stage of the raster engine, yielding (page_num, parts) in order
+
+    pages is a list of (page_num, dpi). parts holds the (width, height,
+    encoded, image) of each image to place on an output page. Without a
+    cache the pages are rendered and encoded is None: the output builder
+    encodes the image. With a cache, the (folder, content digest) of a
+    PageCache, the parts are encoded here and kept in the cache, and pages
+    found there are neither rendered nor encoded again; image is then a
+    preview at thumbnail resolution. Cache hits and misses are counted in
+    stats per page.
+    """
+    if cache is None:
+        for page_num, img in _render_pages(input_file, pages, stats, options['chunk_size']):
+            yield page_num, [(part.width, part.height, None, part) for part in _raster_parts(img, orientation, split)]
+        return
+
+    folder, digest = cache
+    page_cache = PageCache(folder)
+    parts_name = _parts_name(orientation, split)
+    stats.setdefault('page_cache_hits', 0)
+    stats.setdefault('page_cache_misses', 0)
+
+    def page_key(page_num, dpi):
+        return page_cache.page_key(digest, page_num, dpi, parts_name, options['image_format'], options['jpeg_quality'])
+
+    # Pages not in the cache are rendered in chunks as before
+    with timed(stats, 'cache'):
+        missing = [(page_num, dpi) for page_num, dpi in pages if not page_cache.has(page_key(page_num, dpi))]
+    rendered = _render_pages(input_file, missing, stats, options['chunk_size'])
+    missing = set(missing)
+
+    for page_num, dpi in pages:
+        if (page_num, dpi) in missing:
+            _, img = next(rendered)
+        else:
+            with timed(stats, 'cache'):
+                parts = page_cache.get_parts(page_key(page_num, dpi))
+            if parts is not None:
+                stats['page_cache_hits'] += 1
+                yield page_num, parts
+                continue
+            # Evicted since the pages were looked up
+            _, img = next(_render_pages(input_file, [(page_num, dpi)], stats))
+
+        stats['page_cache_misses'] += 1
+        parts = []
+        for part in _raster_parts(img, orientation, split):
+            with timed(stats, 'encode'):
+                parts.append((part.width, part.height, encode_image(part, options['image_format'], options['jpeg_quality']), part))
+        with timed(stats, 'cache'):
+            try:
+                page_cache.put_parts(page_key(page_num, dpi), parts)
+            except OSError as e:
+                # The page is only not cached (e.g. on a full disk)
+                logging.error(f"Error caching page {page_num + 1}: {str(e)}")
+        yield page_num, parts
+
+def _save_page_thumbnail(img, layout, box, path):
+    """
+    Save the thumbnail of an output page from the image drawn on it
+
+    A failed thumbnail is only logged (returns False); it is rendered again
+    on request.
+    """
+    try:
+        save_thumbnail(compose_thumbnail(img, (layout['target_width'], layout['target_height']), box), path)
         return True
     except Exception as e:
-        logging.error(f"Error resizing PDF: {str(e)}")
+        logging.error(f"Error saving thumbnail {path}: {str(e)}")
         return False
 
-def create_pdf_from_text(text, output_file, title="", font_size=12, text_style="normal", text_layout="single", margins=None, orientation='portrait'):
+def _mark_ready(stats, output_page):
+    # Advance stats['pages_ready'], the number of leading output pages
+    # whose thumbnails are written
+    if output_page == stats.get('pages_ready', 0) + 1:
+        stats['pages_ready'] = output_page
+
+def _write_preview(input_file, reader, layout, orientation, split, stats, template):
     """
-    Create a PDF document from plain text
-    
-    text_layout options:
-    - 'single': Normal single column layout
-    - 'double': Two-column layout
+    Save the thumbnails of the first PREVIEW_PAGES output pages ahead of processing
+
+    The first input pages are rendered at thumbnail resolution (in one
+    poppler call for pages of similar sizes) and placed like the engines
+    place them, so a client can show the start of a long document while
+    the rest is processed. The thumbnails remain those of the finished
+    output. A failure is only logged.
     """
+    parts = 2 if split else 1
+    pages = []
+    for page_num in range(min(len(reader.pages), -(-PREVIEW_PAGES // parts))):
+        # Resolution at which the page fills its box on the thumbnail
+        width, height = visible_size(reader.pages[page_num])
+        region = _split_regions(width, height, orientation)[0] if split else (0, 0, width, height)
+        dpi = 72 * THUMBNAIL_WIDTH / layout['target_width'] * _fit_box(region[2], region[3], layout)[0]
+        pages.append((page_num, RASTER_DPI_STEP * math.ceil(dpi / RASTER_DPI_STEP)))
+
     try:
-        # Set default margins if not provided
-        if margins is None:
-            margins = {'top': 0.5, 'right': 0.5, 'bottom': 0.5, 'left': 0.5}
-        
-        # In two-column layout, we use A4 instead of A5 to accommodate two A5 columns side by side
-        if text_layout == "double":
-            # Use A4 for two-column layout
-            if orientation == 'portrait':
-                page_size = A4
-            else:  # landscape
-                page_size = (A4[1], A4[0])  # Swap width and height for landscape
-        else:
-            # For single column, use A5 as before
-            if orientation == 'portrait':
-                page_size = A5
-            else:  # landscape
-                page_size = (A5_HEIGHT, A5_WIDTH)  # Swap width and height
-        
-        # Adjust margins for two-column layout if needed
-        if text_layout == "double":
-            # Smaller margins for columns
-            column_margins = {
-                'top': margins['top'],
-                'right': max(0.2, margins['right'] / 2),
-                'bottom': margins['bottom'],
-                'left': max(0.2, margins['left'] / 2)
-            }
+        with timed(stats, 'preview'):
+            # Render stats are kept apart: the preview is not the raster engine's work
+            for page_num, img in _render_pages(input_file, pages, {}, len(pages)):
+                for index, part in enumerate(_raster_parts(img, orientation, split)):
+                    scale, x_pos, y_pos = _fit_box(part.width, part.height, layout)
+                    output_page = page_num * parts + index + 1
+                    box = (x_pos, y_pos, part.width * scale, part.height * scale)
+                    if _save_page_thumbnail(part, layout, box, template.format(page=output_page)):
+                        _mark_ready(stats, output_page)
+    except Exception as e:
+        logging.error(f"Error rendering preview pages: {str(e)}")
+
+def _add_vector_pages(reader, writer, page_numbers, layout, orientation, split, stats=None):
+    """
+    Add the given reader pages to writer, placed onto the target page
+
+    stats['pages_done'] is advanced per source page when stats is given.
+    """
+    for page_num in page_numbers:
+        original_page = reader.pages[page_num]
+        page_width, page_height = visible_size(original_page)
+
+        if split:
+            regions = _split_regions(page_width, page_height, orientation)
         else:
-            column_margins = margins
-            
-        # Create a PDF document
-        doc = SimpleDocTemplate(
-            output_file,
-            pagesize=page_size,
-            leftMargin=margins['left'] * inch,
-            rightMargin=margins['right'] * inch,
-            topMargin=margins['top'] * inch,
-            bottomMargin=margins['bottom'] * inch
-        )
-        
-        # Set styles
-        styles = getSampleStyleSheet()
-        
-        # Create a custom paragraph style based on the text style
-        if text_style == "justified":
-            alignment = TA_JUSTIFY
-        elif text_style == "centered":
-            alignment = TA_CENTER
-        else:  # normal
-            alignment = TA_LEFT
-            
-        text_style = ParagraphStyle(
-            'CustomStyle',
-            parent=styles['Normal'],
-            fontSize=font_size,
-            alignment=alignment,
-            leading=font_size * 1.2  # Line height
-        )
-        
-        # Create the title style
-        title_style = ParagraphStyle(
-            'Title',
-            parent=styles['Heading1'],
-            fontSize=font_size + 4,
-            alignment=TA_CENTER,
-            spaceAfter=font_size * 2
-        )
-        
-        # Split text into paragraphs
-        paragraphs = text.split('\n\n')
-        
-        # Process differently based on layout
-        if text_layout == "double":
-            # Two-column layout
-            from reportlab.platypus import FrameBreak, Frame
-            from reportlab.platypus.doctemplate import PageTemplate, BaseDocTemplate
-            
-            # Create a custom document template with two columns
-            class TwoColumnDocTemplate(BaseDocTemplate):
-                def __init__(self, filename, **kwargs):
-                    BaseDocTemplate.__init__(self, filename, **kwargs)
-                    
-                    # Define page width and height
-                    page_width, page_height = page_size
-                    
-                    # Calculate column width (this is approximately A5 width)
-                    column_width = (page_width - (margins['left'] + margins['right']) * inch - 20) / 2
-                    column_height = page_height - (margins['top'] + margins['bottom']) * inch
-                    
-                    # Define the frames (columns)
-                    frame1 = Frame(
-                        margins['left'] * inch, 
-                        margins['bottom'] * inch, 
-                        column_width, 
-                        column_height, 
-                        leftPadding=3, 
-                        rightPadding=3, 
-                        bottomPadding=3, 
-                        topPadding=3
-                    )
-                    
-                    frame2 = Frame(
-                        margins['left'] * inch + column_width + 20, 
-                        margins['bottom'] * inch, 
-                        column_width, 
-                        column_height, 
-                        leftPadding=3, 
-                        rightPadding=3, 
-                        bottomPadding=3, 
-                        topPadding=3
-                    )
-                    
-                    # Create the page template
-                    template = PageTemplate(
-                        'two_columns', 
-                        [frame1, frame2], 
-                        onPage=self.add_page_number
-                    )
-                    
-                    self.addPageTemplates(template)
-                
-                def add_page_number(self, canvas, doc):
-                    # Optional: Add page number at the bottom
-                    page_num = canvas.getPageNumber()
-                    canvas.drawCentredString(
-                        page_size[0] / 2, 
-                        margins['bottom'] * inch / 3,
-                        str(page_num)
-                    )
-            
-            # Create the document with two columns
-            doc = TwoColumnDocTemplate(
-                output_file,
-                pagesize=page_size,
-                leftMargin=margins['left'] * inch,
-                rightMargin=margins['right'] * inch,
-                topMargin=margins['top'] * inch,
-                bottomMargin=margins['bottom'] * inch
-            )
-            
-            # Create the content
-            story = []
-            
-            # Add title if provided (spanning both columns)
-            if title:
-                story.append(Paragraph(title, title_style))
-                story.append(Spacer(1, font_size * 1.5))
-            
-            # Process paragraphs
-            for i, para in enumerate(paragraphs):
-                if para.strip():
-                    p = Paragraph(para.replace('\n', '<br/>'), text_style)
-                    story.append(p)
-                    
-                    # Add space between paragraphs
-                    if i < len(paragraphs) - 1:
-                        story.append(Spacer(1, font_size * 0.5))
-                    
-                    # Every few paragraphs, add a frame break to balance columns
-                    # Adjust this logic based on testing
-                    if (i + 1) % 3 == 0 and i < len(paragraphs) - 1:
-                        story.append(FrameBreak())
-            
+            regions = [(0, 0, page_width, page_height)]
+
+        # Each region gets its own copy of the page; the content streams
+        # and resources are shared between the copies
+        for region in regions:
+            page = writer.add_page(original_page)
+            _place_page_vector(writer, page, region, layout)
+
+        if stats is not None:
+            stats['pages_done'] += 1
+
+def _vector_pdf(reader, output_file, layout, orientation, split, stats):
+    """
+    Resize or split a PDF by transforming the page content
+    """
+    writer = PdfWriter()
+
+    with timed(stats, 'place'):
+        _add_vector_pages(reader, writer, range(len(reader.pages)), layout, orientation, split, stats)
+
+    stats['pages_in'] = len(reader.pages)
+    stats['pages_out'] = len(writer.pages)
+
+    # Write the output file
+    with timed(stats, 'write'), open(output_file, 'wb') as f:
+        writer.write(f)
+
+def _open_raster_output(output_file, layout, page_count, options, stats, encoded=False):
+    """
+    Create the single output builder the raster engine draws every page on
+
+    With encoded, images are drawn already encoded, which only the
+    streaming builder can do.
+    """
+    streaming = True if encoded else options['streaming']
+    if streaming is None:
+        streaming = page_count >= STREAMING_PAGE_THRESHOLD
+    stats['output_mode'] = 'streaming' if streaming else 'canvas'
+
+    return open_output(
+        output_file,
+        (layout['target_width'], layout['target_height']),
+        streaming=streaming,
+        image_format=options['image_format'],
+        jpeg_quality=options['jpeg_quality']
+    )
+
+def _raster_pdf(input_file, output_file, layout, orientation, split, stats, options, pages, cache=None):
+    """
+    Resize or split a PDF by rasterizing the given (page_num, dpi) pages
+
+    Thumbnails are numbered by the output page of the whole document, as
+    if every page had been rendered. With a cache (see _raster_extracts),
+    pages extracted by an earlier run are only composed onto the target
+    page.
+    """
+    output = _open_raster_output(output_file, layout, len(pages) * (2 if split else 1), options, stats, encoded=cache is not None)
+
+    try:
+        # Render the input once, chunk by chunk, and draw each page image
+        for page_num, parts in _raster_extracts(input_file, pages, orientation, split, options, stats, cache):
+            for index, (part_width, part_height, encoded, part) in enumerate(parts):
+                # Calculate scaling and position to fit within the content area
+                scale, x_pos, y_pos = _fit_box(part_width, part_height, layout)
+
+                # Draw the image on a new A5 page (encoding it if needed)
+                box = (x_pos, y_pos, part_width * scale, part_height * scale)
+                if encoded is None:
+                    with timed(stats, 'encode'):
+                        output.draw_image(part, *box)
+                        output.show_page()
+                else:
+                    with timed(stats, 'compose'):
+                        output.draw_encoded_image(encoded, *box)
+                        output.show_page()
+
+                # The page image is at hand, so its thumbnail is nearly free
+                if options['thumbnails']:
+                    output_page = page_num * len(parts) + index + 1
+                    with timed(stats, 'thumbnails'):
+                        if _save_page_thumbnail(part, layout, box, options['thumbnails'].format(page=output_page)):
+                            _mark_ready(stats, output_page)
+
+            stats['pages_done'] += 1
+    finally:
+        with timed(stats, 'write'):
+            output.close()
+
+    stats['pages_out'] = output.page_count
+
+def _raster_chunk(task):
+    """
+    Process worker: render and encode a list of (page_num, dpi) pages
+
+    Returns the encoded images with their placement on the target page,
+    plus the render stats of the worker (with the output pages whose
+    thumbnails it wrote).
+    """
+    input_file, render_pages, layout, orientation, split, options, cache = task
+
+    stats = {'thumbnail_pages': []}
+    pages = []
+    for page_num, parts in _raster_extracts(input_file, render_pages, orientation, split, options, stats, cache):
+        for index, (part_width, part_height, encoded, part) in enumerate(parts):
+            scale, x_pos, y_pos = _fit_box(part_width, part_height, layout)
+            if encoded is None:
+                with timed(stats, 'encode'):
+                    encoded = encode_image(part, options['image_format'], options['jpeg_quality'])
+            pages.append((encoded, x_pos, y_pos, part_width * scale, part_height * scale))
+
+            if options['thumbnails']:
+                output_page = page_num * len(parts) + index + 1
+                with timed(stats, 'thumbnails'):
+                    if _save_page_thumbnail(part, layout, pages[-1][1:], options['thumbnails'].format(page=output_page)):
+                        stats['thumbnail_pages'].append(output_page)
+
+    return pages, stats
+
+def _raster_pdf_parallel(input_file, output_file, layout, orientation, split, stats, options, pages, workers, chunk_size, cache=None):
+    """
+    Resize or split a PDF by rendering and encoding (page_num, dpi) pages in a process pool
+
+    Workers do the CPU-heavy rendering and image encoding of chunk_size
+    pages each; the parent streams the encoded pages to the output in page
+    order.
+    """
+    tasks = [
+        (input_file, pages[start:start + chunk_size], layout, orientation, split, options, cache)
+        for start in range(0, len(pages), chunk_size)
+    ]
+
+    # Encoded images can only be written by the streaming builder
+    output = open_output(
+        output_file,
+        (layout['target_width'], layout['target_height']),
+        streaming=True,
+        image_format=options['image_format'],
+        jpeg_quality=options['jpeg_quality']
+    )
+    stats['output_mode'] = 'streaming'
+    stats.update({'raster_calls': 0, 'raster_subprocesses': 0, 'raster_time': 0.0})
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map() returns the results in task order
+            for task, (encoded_pages, chunk_stats) in zip(tasks, pool.map(_raster_chunk, tasks)):
+                with timed(stats, 'write'):
+                    for encoded, x_pos, y_pos, width, height in encoded_pages:
+                        output.draw_encoded_image(encoded, x_pos, y_pos, width, height)
+                        output.show_page()
+
+                stats['pages_done'] += len(task[1])
+                for output_page in chunk_stats.get('thumbnail_pages', []):
+                    _mark_ready(stats, output_page)
+
+                # Render time and stage timings are summed over all workers
+                merge_timings(stats, chunk_stats.get('timings'))
+                stats['raster_calls'] += chunk_stats.get('raster_calls', 0)
+                stats['raster_subprocesses'] += chunk_stats.get('raster_subprocesses', 0)
+                stats['raster_time'] = round(stats['raster_time'] + chunk_stats.get('raster_time', 0.0), 4)
+                for key in ('page_cache_hits', 'page_cache_misses'):
+                    if key in chunk_stats:
+                        stats[key] = stats.get(key, 0) + chunk_stats[key]
+    finally:
+        with timed(stats, 'write'):
+            output.close()
+
+    stats['pages_out'] = output.page_count
+
+def _compose_pdf(reader, raster_file, output_file, plan, layout, orientation, split, stats):
+    """
+    Write the output of a document with both vector and rendered pages
+
+    Pages planned as vectors are placed from the input; the others are
+    taken in order from raster_file, which holds the rendered pages.
+    """
+    rendered = iter(PdfReader(raster_file).pages)
+    parts = 2 if split else 1
+    writer = PdfWriter()
+
+    with timed(stats, 'place'):
+        for page_num, (mode, _, _) in enumerate(plan):
+            if mode == 'vector':
+                _add_vector_pages(reader, writer, [page_num], layout, orientation, split, stats)
+            else:
+                for _ in range(parts):
+                    writer.add_page(next(rendered))
+
+    stats['pages_out'] = len(writer.pages)
+
+    with timed(stats, 'write'), open(output_file, 'wb') as f:
+        writer.write(f)
+
+def _process_pdf(input_file, output_file, margins, orientation, split, engine, stats, raster_options, workers, chunk_size, optimize, preview):
+    """
+    Run the resize (split=False) or split (split=True) pipeline with the chosen engine
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    stats['engine'] = engine
+    start = time.perf_counter()
+
+    layout = _page_layout(margins, orientation)
+    with timed(stats, 'parse'):
+        reader = PdfReader(input_file)
+        page_count = len(reader.pages)
+
+    # Progress, readable while the document is being processed
+    stats['pages_total'] = page_count
+    stats['pages_done'] = 0
+    stats['pages_out_total'] = page_count * (2 if split else 1)
+
+    if preview:
+        _write_preview(input_file, reader, layout, orientation, split, stats, preview)
+
+    # Only spread rendering over processes when there is enough of it
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    parallel = engine == ENGINE_RASTER and workers > 1 and page_count >= PARALLEL_MIN_PAGES
+    stats['workers'] = workers if parallel else 1
+
+    if engine == ENGINE_VECTOR:
+        _vector_pdf(reader, output_file, layout, orientation, split, stats)
+    else:
+        options = _raster_options(raster_options)
+        stats['image_format'] = options['image_format']
+
+        # Rendered pages are cached by input content (see PageCache)
+        cache = None
+        if options['page_cache']:
+            with timed(stats, 'hash'):
+                cache = (options['page_cache'], file_digest(input_file))
+
+        # Decide per page whether to render it, and at which resolution
+        with timed(stats, 'analyze'):
+            plan = plan_raster_pages(reader, layout, orientation, split, options)
+            if cache and not options['dpi']:
+                plan = _reuse_cached_pages(plan, PageCache(cache[0]).cached_dpis(cache[1]))
+        pages = [(page_num, dpi) for page_num, (mode, dpi, _) in enumerate(plan) if mode == 'raster']
+        stats['page_plan'] = _plan_summary(plan)
+        stats['raster_pages'] = len(pages)
+        stats['vector_pages'] = page_count - len(pages)
+        stats['raster_dpi'] = max((dpi for _, dpi in pages), default=None)
+
+        if not pages:
+            # Nothing needs rendering
+            _vector_pdf(reader, output_file, layout, orientation, split, stats)
         else:
-            # Single column layout (original implementation)
-            story = []
-            
-            # Add title if provided
-            if title:
-                story.append(Paragraph(title, title_style))
-                story.append(Spacer(1, font_size * 0.5))
-            
-            # Process paragraphs
-            for i, para in enumerate(paragraphs):
-                if para.strip():
-                    p = Paragraph(para.replace('\n', '<br/>'), text_style)
-                    story.append(p)
-                    
-                    # Add space between paragraphs
-                    if i < len(paragraphs) - 1:
-                        story.append(Spacer(1, font_size * 0.5))
-        
-        # Build the document
-        doc.build(story)
-        
+            # With vector pages, the rendered ones are merged in afterwards
+            raster_file = output_file if len(pages) == page_count else f"{output_file}.raster.pdf"
+            try:
+                if parallel:
+                    chunk_size = max(1, int(chunk_size or options['chunk_size']))
+                    _raster_pdf_parallel(input_file, raster_file, layout, orientation, split, stats, options, pages, workers, chunk_size, cache)
+                else:
+                    _raster_pdf(input_file, raster_file, layout, orientation, split, stats, options, pages, cache)
+                if raster_file != output_file:
+                    _compose_pdf(reader, raster_file, output_file, plan, layout, orientation, split, stats)
+            finally:
+                if raster_file != output_file and os.path.exists(raster_file):
+                    os.remove(raster_file)
+        stats['pages_in'] = page_count
+
+    if optimize:
+        from pdf_optimizer import optimize_output
+        optimize_output(output_file, optimize, stats)
+
+    stats['wall_time'] = round(time.perf_counter() - start, 4)
+
+def resize_pdf_to_a5(input_file, output_file, margins, orientation='portrait', engine=ENGINE_VECTOR, stats=None, raster_options=None, workers=None, chunk_size=None, optimize=None, preview=None):
+    """
+    Resize a PDF from any size to A5 format
+
+    engine options:
+    - 'vector': Scale the original page content onto A5 (default)
+    - 'raster': Render each page as an image and draw it onto A5
+
+    raster_options may override DEFAULT_RASTER_OPTIONS for the raster engine
+    (dpi, target_dpi, vector_pages, chunk_size, image_format, jpeg_quality,
+    streaming, thumbnails and page_cache). By default the raster engine
+    places pages without images as vectors and renders the others at an
+    adaptive resolution; the decisions are in stats['page_plan']. With a
+    page_cache folder, rendered and encoded pages are kept there (see
+    page_cache.PageCache), so running again with other margins only
+    places them; stats counts page_cache_hits and page_cache_misses.
+    With more than one worker, the raster engine renders documents of
+    PARALLEL_MIN_PAGES pages or more in chunks of chunk_size pages in a
+    process pool; the vector engine ignores both. If a stats
+    dict is given it is filled with the engine, page counts and timings of
+    the run. With optimize (True, or a dict overriding
+    pdf_optimizer.DEFAULT_OPTIMIZE_OPTIONS) the output goes through the
+    optimizer stage, which reports its savings in stats['optimizer'].
+    preview is a path with a {page} field: the thumbnails of the first
+    PREVIEW_PAGES output pages are written there before the document is
+    processed (and by the raster engine, those of every page it renders).
+    stats['pages_ready'] counts the leading output pages whose thumbnails
+    are written, out of stats['pages_out_total'].
+    """
+    try:
+        if stats is None:
+            stats = {}
+        _process_pdf(input_file, output_file, margins, orientation, False, engine, stats, raster_options, workers, chunk_size, optimize, preview)
         return True
-    
     except Exception as e:
-        logging.error(f"Error creating PDF from text: {str(e)}")
+        logging.error(f"Error resizing PDF: {str(e)}")
         return False
 
-def split_pdf_to_a5(input_file, output_file, margins, orientation='portrait'):
+def create_pdf_from_text(text, output_file, **options):
+    """
+    Create a PDF document from plain text (see text_pdf.create_pdf_from_text)
+
+    The reportlab layout stack is only loaded by the first text rendering.
+    """
+    import text_pdf
+    return text_pdf.create_pdf_from_text(text, output_file, **options)
+
+def warm_up():
+    """
+    Load every processing backend ahead of the first job
+
+    Imports the raster renderer and output builder, lays out a short text
+    in each text layout (loading the reportlab stack, fonts and default
+    styles) and imports docx2pdf when LibreOffice is not installed. Meant
+    for the master process of a preforking server (see gunicorn.conf.py),
+    so workers share the loaded modules instead of each loading them on
+    their first job.
+    """
+    import pdf2image
+    import PIL.Image
+    import text_pdf
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    for text_layout in ('single', 'double'):
+        text_pdf.create_pdf_from_text('A5', io.BytesIO(), text_layout=text_layout)
+    if not word_converter.is_available():
+        import docx2pdf
+
+def split_pdf_to_a5(input_file, output_file, margins, orientation='portrait', engine=ENGINE_VECTOR, stats=None, raster_options=None, workers=None, chunk_size=None, optimize=None, preview=None):
     """
     Split an A4 PDF into two A5 pages side by side
+
+    engine options:
+    - 'vector': Crop and scale each half of the original page content (default)
+    - 'raster': Render each page as an image and draw each half onto A5
+
+    The other options are the same as for resize_pdf_to_a5.
     """
     try:
-        # Determine target dimensions based on orientation
-        if orientation == 'portrait':
-            target_width, target_height = A5_WIDTH, A5_HEIGHT
-        else:  # landscape
-            target_width, target_height = A5_HEIGHT, A5_WIDTH
-        
-        # Apply margins (convert inches to points)
-        margin_left = margins['left'] * 72
-        margin_right = margins['right'] * 72
-        margin_top = margins['top'] * 72
-        margin_bottom = margins['bottom'] * 72
-        
-        # Adjusted dimensions
-        content_width = target_width - margin_left - margin_right
-        content_height = target_height - margin_top - margin_bottom
-        
-        # Create a new PDF with the target size
-        reader = PdfReader(input_file)
-        writer = PdfWriter()
-        
-        # Process each page and split it into two
-        for page_num in range(len(reader.pages)):
-            original_page = reader.pages[page_num]
-            page_width = float(original_page.mediabox.width)
-            page_height = float(original_page.mediabox.height)
-            
-            # Extract the page as an image to maintain all content
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=True) as temp_pdf:
-                # Create a temporary PDF with just this page
-                temp_writer = PdfWriter()
-                temp_writer.add_page(original_page)
-                temp_writer.write(temp_pdf)
-                temp_pdf.flush()
-                
-                # Convert page to image
-                images = convert_from_path(temp_pdf.name, dpi=200)
-                if not images:
-                    continue
-                
-                # Get first image from the page
-                img = images[0]
-                img_width, img_height = img.size
-                
-                # Split the image into two halves
-                if orientation == 'portrait':
-                    # Split horizontally (left and right halves)
-                    left_half = img.crop((0, 0, img_width // 2, img_height))
-                    right_half = img.crop((img_width // 2, 0, img_width, img_height))
-                else:
-                    # Split vertically (top and bottom halves)
-                    left_half = img.crop((0, 0, img_width, img_height // 2))
-                    right_half = img.crop((0, img_height // 2, img_width, img_height))
-                
-                # Process first half (left or top)
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=True) as temp_img1:
-                    left_half.save(temp_img1.name, format='PNG')
-                    temp_img1.flush()
-                    
-                    # Create new A5 page for the first half
-                    packet1 = io.BytesIO()
-                    can1 = canvas.Canvas(packet1, pagesize=(target_width, target_height))
-                    
-                    # Calculate scaling to fit within the content area
-                    half_width, half_height = left_half.size
-                    scale_x = content_width / half_width
-                    scale_y = content_height / half_height
-                    scale = min(scale_x, scale_y)
-                    
-                    # Calculate scaled dimensions
-                    scaled_width = half_width * scale
-                    scaled_height = half_height * scale
-                    
-                    # Calculate position to center the content
-                    x_pos = margin_left + (content_width - scaled_width) / 2
-                    y_pos = margin_bottom + (content_height - scaled_height) / 2
-                    
-                    # Draw the first half
-                    can1.drawImage(temp_img1.name, x_pos, y_pos, width=scaled_width, height=scaled_height)
-                    can1.save()
-                    
-                    # Add the first half to the output
-                    packet1.seek(0)
-                    new_pdf1 = PdfReader(packet1)
-                    writer.add_page(new_pdf1.pages[0])
-                
-                # Process second half (right or bottom)
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=True) as temp_img2:
-                    right_half.save(temp_img2.name, format='PNG')
-                    temp_img2.flush()
-                    
-                    # Create new A5 page for the second half
-                    packet2 = io.BytesIO()
-                    can2 = canvas.Canvas(packet2, pagesize=(target_width, target_height))
-                    
-                    # Calculate scaling to fit within the content area
-                    half_width, half_height = right_half.size
-                    scale_x = content_width / half_width
-                    scale_y = content_height / half_height
-                    scale = min(scale_x, scale_y)
-                    
-                    # Calculate scaled dimensions
-                    scaled_width = half_width * scale
-                    scaled_height = half_height * scale
-                    
-                    # Calculate position to center the content
-                    x_pos = margin_left + (content_width - scaled_width) / 2
-                    y_pos = margin_bottom + (content_height - scaled_height) / 2
-                    
-                    # Draw the second half
-                    can2.drawImage(temp_img2.name, x_pos, y_pos, width=scaled_width, height=scaled_height)
-                    can2.save()
-                    
-                    # Add the second half to the output
-                    packet2.seek(0)
-                    new_pdf2 = PdfReader(packet2)
-                    writer.add_page(new_pdf2.pages[0])
-        
-        # Write the output file
-        with open(output_file, 'wb') as f:
-            writer.write(f)
-        
+        if stats is None:
+            stats = {}
+        _process_pdf(input_file, output_file, margins, orientation, True, engine, stats, raster_options, workers, chunk_size, optimize, preview)
         return True
     except Exception as e:
         logging.error(f"Error splitting PDF: {str(e)}")
         return False
+
+def imposition_order(page_count, mode=IMPOSITION_2UP, booklet=True, signature_size=None):
+    """
+    Return the pages on each sheet side, in print order
+
+    Each side is a list of 0-based page indexes (None for a blank cell),
+    left to right and then top to bottom. Without booklet, pages simply
+    follow each other. Booklets use saddle-stitch order: the pages are
+    padded to a multiple of 4 and grouped into signatures of
+    signature_size pages (by default a single signature), each folded and
+    nested on its own. Sides are meant to be printed flipping on the
+    vertical axis (short edge for 2-up, long edge for 4-up).
+
+    In 4-up mode the top halves of the sheets carry the first half of the
+    booklet sheets and the bottom halves the second half: the printed stack
+    is cut in half and the top pile is placed on the bottom pile.
+    """
+    if mode not in IMPOSITION_MODES:
+        raise ValueError(f"Unknown imposition mode: {mode}")
+
+    if not booklet:
+        cells = 2 if mode == IMPOSITION_2UP else 4
+        return [
+            [index if index < page_count else None for index in range(first, first + cells)]
+            for first in range(0, page_count, cells)
+        ]
+
+    if signature_size is not None and (signature_size < 4 or signature_size % 4):
+        raise ValueError("Signature size must be a multiple of 4")
+
+    padded = max(4, -(-page_count // 4) * 4)
+    signature_size = signature_size or padded
+
+    def page(index):
+        return index if index < page_count else None
+
+    # (front, back) of every folded booklet sheet, outermost first
+    spreads = []
+    for first in range(0, padded, signature_size):
+        last = min(first + signature_size, padded) - 1
+        for sheet in range((last - first + 1) // 4):
+            front = [page(last - 2 * sheet), page(first + 2 * sheet)]
+            back = [page(first + 2 * sheet + 1), page(last - 2 * sheet - 1)]
+            spreads.append((front, back))
+
+    if mode == IMPOSITION_2UP:
+        return [side for spread in spreads for side in spread]
+
+    # Cut and stack: sheet n carries booklet sheets n and n + half
+    half = -(-len(spreads) // 2)
+    blank = ([None, None], [None, None])
+    sides = []
+    for sheet in range(half):
+        top = spreads[sheet]
+        bottom = spreads[sheet + half] if sheet + half < len(spreads) else blank
+        sides.append(top[0] + bottom[0])
+        sides.append(top[1] + bottom[1])
+    return sides
+
+def _imposition_cells(mode, margins):
+    """
+    Return the sheet size and the layout of each cell on the sheet
+
+    Cell layouts have the keys of _page_layout(), offset to the position
+    of the cell, so _fit_box() places content directly in sheet space.
+    """
+    if mode == IMPOSITION_2UP:
+        sheet_width, sheet_height, columns, rows = A4_HEIGHT, A4_WIDTH, 2, 1
+    else:
+        sheet_width, sheet_height, columns, rows = A4_WIDTH, A4_HEIGHT, 2, 2
+
+    cell_width, cell_height = sheet_width / columns, sheet_height / rows
+    cells = []
+    for row in range(rows):
+        for column in range(columns):
+            margin_left = column * cell_width + margins['left'] * 72
+            margin_bottom = (rows - 1 - row) * cell_height + margins['bottom'] * 72
+            cells.append({
+                'target_width': cell_width,
+                'target_height': cell_height,
+                'margin_left': margin_left,
+                'margin_bottom': margin_bottom,
+                'content_width': cell_width - (margins['left'] + margins['right']) * 72,
+                'content_height': cell_height - (margins['top'] + margins['bottom']) * 72
+            })
+    return (sheet_width, sheet_height), cells
+
+def _page_form(writer, page):
+    """
+    Wrap the content of a reader page in a Form XObject of writer
+
+    The content streams are concatenated without being parsed, and the
+    page resources (fonts, images) are copied once and shared by every
+    form that uses them.
+    """
+    data = []
+    if '/Contents' in page:
+        contents = page['/Contents'].get_object()
+        streams = contents if isinstance(contents, ArrayObject) else [contents]
+        data = [stream.get_object().get_data() for stream in streams]
+
+    form = DecodedStreamObject()
+    form.set_data(b"\n".join(data))
+    # flate_encode() returns a new stream with only the /Filter entry
+    form = form.flate_encode()
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): RectangleObject(page.cropbox),
+        NameObject('/Resources'): page['/Resources'].clone(writer) if '/Resources' in page else DictionaryObject()
+    })
+    return writer._add_object(form)
+
+def _impose_vector(reader, output_file, mode, sides, margins, stats):
+    """
+    Place the source pages on sheet sides as Form XObjects
+
+    Every source page becomes one form, drawn in its cell with a clipping
+    rectangle; nothing is rasterized.
+    """
+    writer = PdfWriter()
+    (sheet_width, sheet_height), cells = _imposition_cells(mode, margins)
+
+    with timed(stats, 'place'):
+        for side in sides:
+            operations = []
+            xobjects = DictionaryObject()
+            for cell, index in zip(cells, side):
+                if index is None:
+                    continue
+
+                page = reader.pages[index]
+                width, height = visible_size(page)
+                ctm, scale, x_pos, y_pos = _content_matrix(page, (0, 0, width, height), cell)
+
+                name = NameObject(f"/P{index}")
+                xobjects[name] = _page_form(writer, page)
+                operations.append(
+                    "q %f %f %f %f re W n %f %f %f %f %f %f cm %s Do Q" % (
+                        (x_pos, y_pos, width * scale, height * scale) + tuple(ctm.ctm) + (name,)
+                    )
+                )
+                stats['pages_done'] += 1
+
+            # add_page() returns the copy that belongs to the writer
+            sheet = writer.add_page(PageObject.create_blank_page(writer, sheet_width, sheet_height))
+            content = DecodedStreamObject()
+            content.set_data("\n".join(operations).encode('ascii'))
+            sheet[NameObject('/Contents')] = writer._add_object(content.flate_encode())
+            sheet[NameObject('/Resources')] = DictionaryObject({NameObject('/XObject'): xobjects})
+
+    stats['pages_in'] = len(reader.pages)
+    stats['pages_out'] = len(writer.pages)
+    stats['sheets'] = -(-len(writer.pages) // 2)
+
+    # Write the output file
+    with timed(stats, 'write'), open(output_file, 'wb') as f:
+        writer.write(f)
+
+def impose_pdf(input_file, output_file, margins=None, stats=None, mode=IMPOSITION_2UP, booklet=True, signature_size=None, optimize=None):
+    """
+    Impose a PDF on A4 sheets for double-sided printing
+
+    mode options:
+    - '2up': two A5 pages per sheet side (A5 booklets) (default)
+    - '4up': four A6 pages per sheet side
+
+    With booklet (default) the pages are in saddle-stitch order, grouped
+    in signatures of signature_size pages (see imposition_order);
+    otherwise they follow each other. Margins (in inches) apply inside
+    each cell and default to none. Imposition always uses the vector
+    engine, and sheets have a fixed orientation; there is no progressive
+    preview, as sheets mix pages from both ends of the document. stats and
+    optimize are the same as for resize_pdf_to_a5.
+    """
+    try:
+        if stats is None:
+            stats = {}
+        if margins is None:
+            margins = {'top': 0, 'right': 0, 'bottom': 0, 'left': 0}
+
+        start = time.perf_counter()
+        with timed(stats, 'parse'):
+            reader = PdfReader(input_file)
+            sides = imposition_order(len(reader.pages), mode, booklet, signature_size)
+
+        stats.update({'engine': ENGINE_VECTOR, 'imposition': mode, 'booklet': booklet, 'workers': 1})
+        stats['pages_total'] = len(reader.pages)
+        stats['pages_done'] = 0
+
+        _impose_vector(reader, output_file, mode, sides, margins, stats)
+        if optimize:
+            from pdf_optimizer import optimize_output
+            optimize_output(output_file, optimize, stats)
+        stats['wall_time'] = round(time.perf_counter() - start, 4)
+        return True
+    except Exception as e:
+        logging.error(f"Error imposing PDF: {str(e)}")
+        return False
@@ -0,0 +1,24 @@
+import os
+
+# gunicorn reads this file from the working directory on start.
+#
+# With GUNICORN_PRELOAD=1 the app is imported once in the master process
+# and the processing backends are warmed up there (see
+# document_processor.warm_up), before the workers are forked: workers
+# start serving at once and share the loaded modules, fonts and styles
+# copy-on-write instead of each loading them on its first job. The
+# janitor thread then runs in the master process only.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+
+def when_ready(server):
+    if not preload_app:
+        return
+
+    import gc
+    import document_processor
+
+    document_processor.warm_up()
+    # Keep the garbage collector from writing to the shared objects (and
+    # so copying their pages) in every worker
+    gc.freeze()
+    server.log.info("Processing backends warmed up")
@@ -0,0 +1,238 @@
+import os
+import time
+import uuid
+import logging
+import threading
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the queue is at capacity
+    """
+
+class QuotaExceededError(QueueFullError):
+    """
+    Raised when the owner of a job already has its share of queued work
+    """
+
+class JobTooLargeError(Exception):
+    """
+    Raised when the estimated cost of a job is above what one job may take
+    """
+
+class Job:
+    """
+    A unit of background work and its status
+
+    stats is handed to the job function, which fills it while it runs
+    (document_processor reports pages_total and pages_done there, batches
+    documents_total and documents_done), so progress can be read while the
+    job is still running. cost is the estimated run time in seconds used
+    for scheduling, and owner the client that submitted the job.
+    """
+
+    def __init__(self, cost, owner=None):
+        self.id = uuid.uuid4().hex
+        self.status = JOB_QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cost = cost
+        self.owner = owner
+        self.stats = {}
+        self.result = None
+        self.error = None
+
+    @property
+    def progress(self):
+        # Fraction of pages done, or None while it is unknown
+        if self.status == JOB_DONE:
+            return 1.0
+        unit = 'documents' if 'documents_total' in self.stats else 'pages'
+        total = self.stats.get(f"{unit}_total")
+        if not total:
+            return None
+        return round(min(1.0, self.stats.get(f"{unit}_done", 0) / total), 3)
+
+    def response_ratio(self, now):
+        # (waiting time + run time) / run time: grows faster for short jobs
+        return (now - self.created + self.cost) / self.cost
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'estimated_cost': round(self.cost, 3),
+            'queued_for': round((self.started or time.time()) - self.created, 3),
+            'running_for': round((self.finished or time.time()) - self.started, 3) if self.started else None
+        }
+
+class JobQueue:
+    """
+    Bounded in-process job queue, scheduled by estimated cost
+
+    Jobs run on `workers` threads. Submissions are refused (QueueFullError)
+    when `max_pending` jobs or `max_pending_cost` seconds of work are
+    already waiting; a single job above `max_job_cost` is refused outright
+    (JobTooLargeError), and an owner with `owner_quota` seconds of work
+    queued or running must wait for it (QuotaExceededError). Jobs without
+    an estimate count as `default_cost`.
+
+    Waiting jobs run shortest first, with aging so long jobs are not
+    starved: the next job is the one with the highest response ratio
+    (waiting time plus cost, over cost). At most workers - 1 jobs of
+    `large_job_cost` seconds or more run at once, so one worker always
+    stays available to short jobs.
+
+    Finished jobs are kept for `ttl` seconds so their status can be polled.
+    The queue lives in the memory of one server process; its threads are
+    started by the first submission in that process.
+    """
+
+    def __init__(self, workers=2, max_pending=16, ttl=3600, max_pending_cost=None, max_job_cost=None,
+                 owner_quota=None, large_job_cost=None, default_cost=1.0):
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+        self.ttl = ttl
+        self.max_pending_cost = max_pending_cost
+        self.max_job_cost = max_job_cost
+        self.owner_quota = owner_quota
+        self.large_job_cost = large_job_cost
+        self.default_cost = default_cost
+        self._jobs = {}
+        self._pending = []
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pid = None
+
+    def submit(self, func, *args, cost=None, owner=None, **kwargs):
+        """
+        Queue func(stats, *args, **kwargs) and return its Job
+
+        cost (estimated seconds, None if unknown) and owner are used for
+        admission and scheduling and are not passed to func. The value
+        returned by func becomes job.result; an exception marks the job as
+        failed with its message as job.error.
+        """
+        cost = max(0.001, self.default_cost if cost is None else cost)
+        with self._lock:
+            self._purge()
+            self._admit(cost, owner)
+
+            job = Job(cost, owner)
+            self._jobs[job.id] = job
+            self._calls[job.id] = (func, args, kwargs)
+            self._pending.append(job)
+            self._start_workers()
+            self._wakeup.notify()
+
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def depth(self):
+        """
+        Return the number of jobs waiting for a worker
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def running(self):
+        """
+        Return the number of jobs being run
+        """
+        with self._lock:
+            return self._running_count()
+
+    def pending_cost(self):
+        """
+        Return the estimated seconds of work waiting for a worker
+        """
+        with self._lock:
+            return round(sum(job.cost for job in self._pending), 3)
+
+    def _admit(self, cost, owner):
+        # Refuse a job that does not fit (called with the lock held)
+        if self.max_job_cost is not None and cost > self.max_job_cost:
+            raise JobTooLargeError(f"Estimated cost {cost:.0f}s is above the limit of {self.max_job_cost:.0f}s")
+        if len(self._pending) + self._running_count() >= self.workers + self.max_pending:
+            raise QueueFullError("Job queue is full")
+        # An empty queue takes any job the limit allows, so large jobs are
+        # delayed rather than refused forever
+        if self.max_pending_cost is not None and self._pending:
+            if sum(job.cost for job in self._pending) + cost > self.max_pending_cost:
+                raise QueueFullError("Job queue is full")
+        if self.owner_quota is not None and owner is not None:
+            owned = [job for job in self._jobs.values() if job.owner == owner and job.status in (JOB_QUEUED, JOB_RUNNING)]
+            if owned and sum(job.cost for job in owned) + cost > self.owner_quota:
+                raise QuotaExceededError(f"Too much work queued for {owner}")
+
+    def _start_workers(self):
+        # Worker threads of this process; a forked process starts its own
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name=f"job_{index}", daemon=True).start()
+
+    def _next_job(self):
+        # Pick the job to run next, or None if none may run now
+        now = time.time()
+        candidates = self._pending
+        if self.large_job_cost is not None and self.workers > 1:
+            running_large = sum(
+                1 for job in self._jobs.values() if job.status == JOB_RUNNING and job.cost >= self.large_job_cost
+            )
+            if running_large >= self.workers - 1:
+                candidates = [job for job in candidates if job.cost < self.large_job_cost]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda job: job.response_ratio(now))
+
+    def _work(self):
+        while True:
+            with self._lock:
+                job = self._next_job()
+                while job is None:
+                    self._wakeup.wait()
+                    job = self._next_job()
+                self._pending.remove(job)
+                func, args, kwargs = self._calls.pop(job.id)
+                job.started = time.time()
+                job.status = JOB_RUNNING
+
+            self._run(job, func, args, kwargs)
+
+            # A finished large job may let a waiting one run
+            with self._lock:
+                self._wakeup.notify_all()
+
+    def _run(self, job, func, args, kwargs):
+        try:
+            job.result = func(job.stats, *args, **kwargs)
+            job.status = JOB_DONE
+        except Exception as e:
+            logging.error(f"Error running job {job.id}: {str(e)}")
+            job.error = str(e)
+            job.status = JOB_FAILED
+        finally:
+            job.finished = time.time()
+
+    def _running_count(self):
+        return sum(1 for job in self._jobs.values() if job.status == JOB_RUNNING)
+
+    def _purge(self):
+        # Forget finished jobs older than the ttl
+        limit = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < limit]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,211 @@
+import time
+import threading
+import contextlib
+
+# Upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Upper bounds of the throughput histogram buckets, in pages per second
+THROUGHPUT_BUCKETS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+@contextlib.contextmanager
+def timed(stats, stage):
+    """
+    Add the seconds spent in the block to stats['timings'][stage]
+
+    Stages that run several times (e.g. once per chunk) add up.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = stats.setdefault('timings', {})
+        timings[stage] = round(timings.get(stage, 0.0) + time.perf_counter() - start, 4)
+
+def merge_timings(stats, timings):
+    """
+    Add stage timings (e.g. reported by a worker process) to stats['timings']
+    """
+    merged = stats.setdefault('timings', {})
+    for stage, seconds in (timings or {}).items():
+        merged[stage] = round(merged.get(stage, 0.0) + seconds, 4)
+
+def server_timing(timings, **extra):
+    """
+    Format stage timings (seconds) as a Server-Timing header value
+    """
+    entries = dict(timings or {}, **extra)
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in entries.items())
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=(), function=None):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}")
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            samples = list(self._samples())
+        for suffix, values, extra, value in samples:
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, values, extra)} {_format_value(value)}")
+        return lines
+
+    def _samples(self):
+        # Values kept here, or read from the function at scrape time: a
+        # number, or a dict of label value tuples to numbers
+        if self.function is None:
+            values = self._values
+        else:
+            value = self.function()
+            values = value if isinstance(value, dict) else {(): value}
+        for label_values, value in sorted(values.items()):
+            yield '', label_values, (), value
+
+class Counter(_Metric):
+    """
+    Monotonic count, optionally per label values
+
+    A counter kept elsewhere (e.g. cache hits) can be read by a function
+    at scrape time instead.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, or is read from a function at scrape time
+    """
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        for values, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '_bucket', values, (('le', _format_value(bound)),), cumulative
+            yield '_sum', values, (), round(total, 6)
+            yield '_count', values, (), cumulative
+
+class Registry:
+    """
+    Set of metrics rendered together in the Prometheus text format
+
+    Metrics live in the memory of one process; with several server
+    processes each one exposes its own values.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labels=(), function=None):
+        return self.register(Counter(name, description, labels, function))
+
+    def gauge(self, name, description, labels=(), function=None):
+        return self.register(Gauge(name, description, labels, function))
+
+    def histogram(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# HTTP requests, per route
+REQUESTS = REGISTRY.counter('a5_http_requests_total', 'HTTP requests handled', ('endpoint', 'method', 'status'))
+REQUEST_DURATION = REGISTRY.histogram('a5_http_request_duration_seconds', 'HTTP request handling time', ('endpoint',))
+
+# Processing jobs, per operation (resize, split, booklet, text, batch)
+JOBS = REGISTRY.counter('a5_jobs_total', 'Processing jobs finished', ('operation', 'status'))
+JOBS_REJECTED = REGISTRY.counter('a5_jobs_rejected_total', 'Jobs refused at submission', ('operation', 'reason'))
+JOB_DURATION = REGISTRY.histogram('a5_job_duration_seconds', 'Processing job run time', ('operation',))
+STAGE_DURATION = REGISTRY.histogram('a5_stage_duration_seconds', 'Time spent per processing stage', ('operation', 'stage'))
+PAGES = REGISTRY.counter('a5_pages_total', 'Pages read (in) and written (out)', ('operation', 'direction'))
+BYTES = REGISTRY.counter('a5_bytes_total', 'Document bytes read (in) and written (out)', ('operation', 'direction'))
+THROUGHPUT = REGISTRY.histogram(
+    'a5_job_pages_per_second', 'Input pages processed per second of job run time', ('operation',), THROUGHPUT_BUCKETS
+)
+UPLOAD_BYTES = REGISTRY.counter('a5_upload_bytes_total', 'Bytes received in uploads', ('duplicate',))
+
+def record_job(operation, stats, seconds, success, bytes_in=None, bytes_out=None):
+    """
+    Record a finished job: its outcome, run time, stage timings and volumes
+    """
+    JOBS.inc(operation=operation, status='done' if success else 'failed')
+    JOB_DURATION.observe(seconds, operation=operation)
+    for stage, stage_seconds in stats.get('timings', {}).items():
+        STAGE_DURATION.observe(stage_seconds, operation=operation, stage=stage)
+
+    if not success:
+        return
+    pages_in = stats.get('pages_in')
+    for direction, pages in (('in', pages_in), ('out', stats.get('pages_out'))):
+        if pages:
+            PAGES.inc(pages, operation=operation, direction=direction)
+    for direction, size in (('in', bytes_in), ('out', bytes_out)):
+        if size:
+            BYTES.inc(size, operation=operation, direction=direction)
+    if pages_in and seconds > 0:
+        THROUGHPUT.observe(pages_in / seconds, operation=operation)
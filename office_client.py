@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import time
+import uno
+from com.sun.star.beans import PropertyValue
+
+# Client of a LibreOffice listener started by word_converter.OfficeWorker.
+# It needs the UNO bindings: the server imports it when its own Python has
+# them, and otherwise runs it as a script with the office's Python.
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+def connect(pipe_name, timeout=0):
+    """
+    Return the desktop of the listener on pipe_name, retrying for timeout seconds
+    """
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local_context)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            context = resolver.resolve(f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext")
+            return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+        except Exception:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.25)
+
+def convert(desktop, input_file, output_file):
+    """
+    Convert a document to PDF with the office behind desktop
+    """
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(os.path.abspath(input_file)), '_blank', 0, (_property('Hidden', True),)
+    )
+    try:
+        document.storeToURL(
+            uno.systemPathToFileUrl(os.path.abspath(output_file)), (_property('FilterName', 'writer_pdf_Export'),)
+        )
+    finally:
+        document.close(True)
+
+if __name__ == '__main__':
+    # Usage: <office python> office_client.py PIPE_NAME [CONNECT_TIMEOUT] < pairs.json
+    # Reads a JSON list of [input_file, output_file] pairs (an empty list
+    # only checks the connection) and prints the list of errors (null on
+    # success). Exits with status 2 when the listener cannot be reached.
+    pipe_name = sys.argv[1]
+    try:
+        desktop = connect(pipe_name, float(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    except Exception as e:
+        print(json.dumps(str(e)))
+        sys.exit(2)
+
+    errors = []
+    for input_file, output_file in json.load(sys.stdin):
+        try:
+            convert(desktop, input_file, output_file)
+            errors.append(None)
+        except Exception as e:
+            errors.append(str(e))
+    print(json.dumps(errors))
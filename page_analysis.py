@@ -0,0 +1,132 @@
+import math
+import logging
+from PyPDF2.generic import ContentStream, IndirectObject
+
+# Page geometry and content analysis, shared by document_processor, the
+# upload preflight and the optimizer. It only needs PyPDF2, so inspecting
+# an upload does not load the processing backend.
+
+# Processing engines for resize and split
+# - 'vector': transforms the original page content (no rasterization)
+# - 'raster': renders each page to an image and redraws it (fallback)
+ENGINE_VECTOR = 'vector'
+ENGINE_RASTER = 'raster'
+ENGINES = (ENGINE_VECTOR, ENGINE_RASTER)
+
+# Page content kinds found by analyze_page
+CONTENT_EMPTY = 'empty'
+CONTENT_TEXT = 'text'  # text and/or vector graphics, no images
+CONTENT_IMAGES = 'images'  # images only, like a scan
+CONTENT_MIXED = 'mixed'
+CONTENT_UNKNOWN = 'unknown'  # the content could not be read
+
+# Operators that show text, and that paint paths or shadings
+_TEXT_OPERATORS = {b'Tj', b'TJ', b"'", b'"'}
+_PAINT_OPERATORS = {b'S', b's', b'f', b'F', b'f*', b'B', b'B*', b'b', b'b*', b'sh'}
+# Nesting depth of form XObjects followed by analyze_page
+_MAX_FORM_DEPTH = 4
+
+def visible_size(page):
+    """
+    Return the (width, height) of a page as a viewer displays it
+
+    This is the cropbox, with width and height swapped for pages
+    rotated by 90 or 270 degrees.
+    """
+    width, height = float(page.cropbox.width), float(page.cropbox.height)
+    if page.rotation % 180 == 90:
+        return height, width
+    return width, height
+
+def _multiply(m, n):
+    # Product of two PDF matrices (a, b, c, d, e, f): m applied first, then n
+    return (
+        m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5]
+    )
+
+def _scan_content(content, resources, pdf, found, ctm=(1, 0, 0, 1, 0, 0), depth=0):
+    """
+    Walk the operators of a content stream (and of the forms it draws) into found
+    """
+    resources = resources.get_object() if resources else {}
+    xobjects = resources['/XObject'] if '/XObject' in resources else {}
+    stack = []
+    for operands, operator in ContentStream(content, pdf).operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q':
+            ctm = stack.pop() if stack else ctm
+        elif operator == b'cm':
+            ctm = _multiply(tuple(float(value) for value in operands), ctm)
+        elif operator in _TEXT_OPERATORS:
+            found['text'] = True
+        elif operator in _PAINT_OPERATORS:
+            found['paths'] = True
+        elif operator == b'INLINE IMAGE':
+            # Inline images are small (icons, rules); their resolution is not tracked
+            found['images'] += 1
+            found['ppi_known'] = False
+        elif operator == b'Do' and operands[0] in xobjects:
+            xobject = xobjects[operands[0]].get_object()
+            if xobject.get('/Subtype') == '/Image':
+                found['images'] += 1
+                # The image fills the unit square mapped by the CTM
+                width, height = math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])
+                if width > 0 and height > 0:
+                    ppi = min(xobject['/Width'] * 72 / width, xobject['/Height'] * 72 / height)
+                    found['image_ppi'] = max(found['image_ppi'], ppi)
+                    # Largest size each image object is drawn at
+                    reference = xobjects.raw_get(operands[0])
+                    if isinstance(reference, IndirectObject):
+                        drawn = found['placements'].get(reference.idnum, (0, 0))
+                        found['placements'][reference.idnum] = (max(drawn[0], width), max(drawn[1], height))
+                else:
+                    found['ppi_known'] = False
+            elif xobject.get('/Subtype') == '/Form' and depth < _MAX_FORM_DEPTH:
+                matrix = tuple(float(value) for value in xobject['/Matrix']) if '/Matrix' in xobject else (1, 0, 0, 1, 0, 0)
+                form_resources = xobject['/Resources'] if '/Resources' in xobject else resources
+                _scan_content(xobject, form_resources, pdf, found, _multiply(matrix, ctm), depth + 1)
+            else:
+                found['paths'] = True
+
+def _find_content(page):
+    # Walk the content of a page into a new dict of findings
+    found = {'text': False, 'paths': False, 'images': 0, 'image_ppi': 0.0, 'ppi_known': True, 'placements': {}}
+    if '/Contents' in page:
+        _scan_content(page['/Contents'].get_object(), page['/Resources'] if '/Resources' in page else None, page.pdf, found)
+    return found
+
+def image_placements(page):
+    """
+    Return the largest size each image XObject of a page is drawn at
+
+    Returns {object number: (width, height)}, in points of page space, for
+    the images drawn by the page content and the forms it draws.
+    """
+    return _find_content(page)['placements']
+
+def analyze_page(page):
+    """
+    Find what a page draws: text, vector graphics and images
+
+    Returns a dict with the content kind (one of the CONTENT_* values), the
+    number of images drawn and image_ppi: the highest resolution of the
+    images on the page, in pixels per page inch (None if unknown). Pages
+    whose content cannot be read are CONTENT_UNKNOWN.
+    """
+    try:
+        found = _find_content(page)
+    except Exception as e:
+        logging.error(f"Error analyzing page content: {str(e)}")
+        return {'content': CONTENT_UNKNOWN, 'images': 0, 'image_ppi': None}
+
+    if found['images']:
+        content = CONTENT_MIXED if found['text'] or found['paths'] else CONTENT_IMAGES
+    elif found['text'] or found['paths']:
+        content = CONTENT_TEXT
+    else:
+        content = CONTENT_EMPTY
+    image_ppi = round(found['image_ppi'], 1) if found['images'] and found['ppi_known'] else None
+    return {'content': content, 'images': found['images'], 'image_ppi': image_ppi}
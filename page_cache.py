@@ -0,0 +1,127 @@
+import io
+import os
+import re
+import uuid
+from result_cache import ResultCache
+from thumbnails import THUMBNAIL_WIDTH
+
+# Suffix of the files of the page cache
+PAGE_CACHE_SUFFIX = '.page'
+# WebP quality of the part previews thumbnails are made from
+PREVIEW_QUALITY = 90
+
+class PageCache(ResultCache):
+    """
+    Disk cache of the pages rendered by the raster engine
+
+    The raster engine works in two stages: the page extract renders an input
+    page, cuts it into the parts placed on output pages and encodes their
+    images, and the compose stage places those images on the target page.
+    Only the compose stage depends on the margins, so extracts are cached
+    by input content hash, page, resolution, split and image format, each
+    part with a preview for its thumbnail. A document processed again with
+    other margins only runs the compose stage. The least recently used
+    pages are evicted beyond max_bytes.
+    """
+
+    def __init__(self, folder, max_bytes=2 * 1024 * 1024 * 1024):
+        os.makedirs(folder, exist_ok=True)
+        super().__init__(folder, max_bytes, suffix=PAGE_CACHE_SUFFIX)
+
+    def page_key(self, digest, page_num, dpi, parts, image_format, jpeg_quality):
+        quality = jpeg_quality if image_format == 'jpeg' else ''
+        return f"{digest}_p{page_num}_d{dpi}_{parts}_{image_format}{quality}"
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def cached_dpis(self, digest):
+        """
+        Return the resolutions each page of a document is cached at, as {page_num: [dpi]}
+        """
+        pattern = re.compile(re.escape(digest) + r"_p(\d+)_d(\d+)_.*" + re.escape(self.suffix) + "$")
+        found = {}
+        for entry in os.scandir(self.folder):
+            match = pattern.match(entry.name)
+            if match:
+                found.setdefault(int(match.group(1)), set()).add(int(match.group(2)))
+        return {page_num: sorted(dpis) for page_num, dpis in found.items()}
+
+    def get_parts(self, key):
+        """
+        Return the cached parts of a page as [(width, height, encoded, preview)], or None
+
+        encoded is the image as returned by pdf_output.encode_image() and
+        preview a PIL image of the part at thumbnail resolution.
+        """
+        from PIL import Image
+
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            parts = []
+            position = 0
+            while position < len(data):
+                end = data.index(b"\n", position)
+                width, height, body_size, stream_size, preview_size = map(int, data[position:end].split())
+                position = end + 1
+                body = data[position:position + body_size]
+                stream = data[position + body_size:position + body_size + stream_size]
+                position += body_size + stream_size
+                preview = Image.open(io.BytesIO(data[position:position + preview_size]))
+                preview.load()
+                position += preview_size
+                parts.append((width, height, (body, stream), preview))
+            return parts
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+    def put_parts(self, key, parts):
+        """
+        Store the parts of a page, given as [(width, height, encoded, image)]
+        """
+        chunks = []
+        for width, height, (body, stream), img in parts:
+            # A part never covers more than the width of the thumbnail
+            preview = img
+            if preview.width > THUMBNAIL_WIDTH:
+                size = (THUMBNAIL_WIDTH, max(1, round(img.height * THUMBNAIL_WIDTH / img.width)))
+                preview = img.resize(size, reducing_gap=2.0)
+            buffer = io.BytesIO()
+            preview.convert('RGB').save(buffer, format='WEBP', quality=PREVIEW_QUALITY)
+            chunks.append(b"%d %d %d %d %d\n" % (width, height, len(body), len(stream), len(buffer.getvalue())))
+            chunks.extend((body, stream, buffer.getvalue()))
+        self._write(key, b"".join(chunks))
+
+    def record(self, stats):
+        """
+        Count the page cache lookups reported in the stats of a job
+        """
+        with self._lock:
+            self.hits += stats.get('page_cache_hits', 0)
+            self.misses += stats.get('page_cache_misses', 0)
+
+    def trim(self):
+        """
+        Evict the least recently used pages until the cache fits
+
+        Temporary files left by failed writes are removed as well, once
+        older than result_cache.PART_GRACE.
+        """
+        self._evict()
+
+    def _write(self, key, data):
+        # Write under a temporary name and rename, so readers never see a
+        # partial entry (jobs of several processes share the cache)
+        path = self.path(key)
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
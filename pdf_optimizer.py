@@ -0,0 +1,401 @@
+import io
+import os
+import zlib
+import uuid
+import shutil
+import struct
+import hashlib
+import logging
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject
+from page_analysis import image_placements
+from pdf_output import encode_jpeg
+from metrics import timed
+
+# Optional post-processing of finished outputs:
+# - 'dedup': identical streams (images, fonts, forms), fonts and other
+#   shared objects are stored once
+# - 'compress': streams stored without a filter are Flate-compressed
+# - 'downsample_dpi': images finer than this on the output page (by more
+#   than downsample_threshold times) are resampled to it; None keeps them
+# - 'object_streams': objects other than streams are packed into
+#   compressed object streams, with a cross-reference stream (PDF 1.5)
+DEFAULT_OPTIMIZE_OPTIONS = {
+    'dedup': True,
+    'compress': True,
+    'downsample_dpi': 300,
+    'downsample_threshold': 1.5,
+    'jpeg_quality': 85,
+    'object_streams': True
+}
+
+# Objects per object stream
+OBJECT_STREAM_SIZE = 200
+
+# Merging identical objects can make more objects identical (two fonts
+# whose font files were merged); passes stop when nothing more merges
+_MAX_DEDUP_PASSES = 5
+
+# Dictionary types merged when identical; pages, annotations and the like
+# stay distinct objects even with equal content
+_MERGEABLE_TYPES = {'/Font', '/FontDescriptor', '/ExtGState', '/Encoding'}
+
+# Filters of images whose samples are decoded and encoded again with Flate
+# when they are downsampled (JPEG images stay JPEG)
+_LOSSLESS_FILTERS = {'/FlateDecode', '/LZWDecode', '/ASCII85Decode', '/ASCIIHexDecode', '/RunLengthDecode'}
+
+def _collect(reader):
+    """
+    Return {object number: object} of every object reachable from the trailer
+
+    Objects left over by earlier edits of the file are not reachable and so
+    are not written again.
+    """
+    objects = {}
+    pending = [reader.trailer.raw_get(key) for key in ('/Root', '/Info') if key in reader.trailer]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, IndirectObject):
+            if value.idnum in objects:
+                continue
+            objects[value.idnum] = value.get_object()
+            value = objects[value.idnum]
+        if isinstance(value, DictionaryObject):
+            pending.extend(value.values())
+        elif isinstance(value, ArrayObject):
+            pending.extend(value)
+    return objects
+
+def _serialize(value, ref):
+    """
+    Return the PDF syntax of a direct value, with references renumbered by ref()
+    """
+    if isinstance(value, IndirectObject):
+        return b"%d 0 R" % ref(value.idnum)
+    if isinstance(value, DictionaryObject):
+        return b"<<" + b"".join(
+            _serialize(key, ref) + b" " + _serialize(item, ref) for key, item in value.items()
+        ) + b">>"
+    if isinstance(value, ArrayObject):
+        return b"[" + b" ".join(_serialize(item, ref) for item in value) + b"]"
+    buffer = io.BytesIO()
+    value.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+def _stream_dictionary(stream, **entries):
+    # Dictionary of a stream without its /Length (written from the data),
+    # with entries replaced or removed (None)
+    dictionary = DictionaryObject({key: value for key, value in stream.items() if key != '/Length'})
+    for key, value in entries.items():
+        dictionary.pop(NameObject(f"/{key}"), None)
+        if value is not None:
+            dictionary[NameObject(f"/{key}")] = value
+    return dictionary
+
+def _filters(stream):
+    filters = stream.get('/Filter')
+    if filters is None:
+        return []
+    filters = filters.get_object()
+    return list(filters) if isinstance(filters, ArrayObject) else [filters]
+
+def _mergeable(obj):
+    if isinstance(obj, StreamObject):
+        return obj.get('/Type') not in ('/XRef', '/ObjStm')
+    if isinstance(obj, DictionaryObject):
+        return obj.get('/Type') in _MERGEABLE_TYPES
+    return isinstance(obj, ArrayObject)
+
+def _deduplicate(objects):
+    """
+    Find identical objects; returns {object number: number of the copy kept}
+    """
+    merged = {}
+
+    def ref(idnum):
+        while idnum in merged:
+            idnum = merged[idnum]
+        return idnum
+
+    # Stream data is hashed once; dictionaries are serialized again on
+    # every pass, as their references are merged
+    data_digests = {
+        idnum: hashlib.sha256(obj._data).digest()
+        for idnum, obj in objects.items() if isinstance(obj, StreamObject) and _mergeable(obj)
+    }
+    for _ in range(_MAX_DEDUP_PASSES):
+        seen = {}
+        count = len(merged)
+        for idnum, obj in objects.items():
+            if idnum in merged or not _mergeable(obj):
+                continue
+            key = hashlib.sha256(_serialize(obj, ref) + data_digests.get(idnum, b'')).digest()
+            if key in seen:
+                merged[idnum] = seen[key]
+            else:
+                seen[key] = idnum
+        if len(merged) == count:
+            break
+
+    return {idnum: ref(idnum) for idnum in merged}
+
+def _resample_image(stream, drawn, options):
+    """
+    Return (dictionary, data) of an image resampled to the target resolution
+
+    drawn is the largest (width, height) in points the image is drawn at.
+    Returns None for images already at or below the threshold, in a
+    format that cannot be resampled safely, or that would not shrink.
+    """
+    from PIL import Image
+
+    width, height = stream['/Width'], stream['/Height']
+    ppi = min(width * 72 / drawn[0], height * 72 / drawn[1])
+    if ppi <= options['downsample_dpi'] * options['downsample_threshold']:
+        return None
+
+    # Palette indices cannot be interpolated, nor colour-key masks kept
+    color_space = stream.get('/ColorSpace')
+    color_space = color_space.get_object() if color_space is not None else None
+    if isinstance(color_space, ArrayObject) and color_space[0] == '/Indexed':
+        return None
+    if stream.get('/ImageMask') or isinstance(stream.get('/Mask'), ArrayObject):
+        return None
+
+    filters = _filters(stream)
+    if filters == ['/DCTDecode']:
+        img = Image.open(io.BytesIO(stream._data))
+        image_format = 'jpeg'
+    elif set(filters) <= _LOSSLESS_FILTERS and stream.get('/BitsPerComponent') == 8:
+        samples = stream.get_data()
+        components = len(samples) // (width * height)
+        if components not in (1, 3) or len(samples) != width * height * components:
+            return None
+        img = Image.frombytes('L' if components == 1 else 'RGB', (width, height), samples)
+        image_format = 'flate'
+    else:
+        return None
+    if img.mode not in ('L', 'RGB'):
+        return None
+
+    scale = options['downsample_dpi'] / ppi
+    img = img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    if image_format == 'jpeg':
+        data, image_filter = encode_jpeg(img, options['jpeg_quality']), NameObject('/DCTDecode')
+    else:
+        data, image_filter = zlib.compress(img.tobytes()), NameObject('/FlateDecode')
+    if len(data) >= len(stream._data):
+        return None
+
+    dictionary = _stream_dictionary(
+        stream, Width=NumberObject(img.width), Height=NumberObject(img.height),
+        BitsPerComponent=NumberObject(8), Filter=image_filter, DecodeParms=None
+    )
+    return dictionary, data
+
+def _write_pdf(f, objects, bodies, ref, trailer, version, object_streams):
+    """
+    Write objects (numbered 1..n by ref) as a complete PDF file
+
+    bodies maps object numbers to (dictionary, data) replacing the content
+    of a stream. With object_streams, objects other than streams are packed
+    into compressed object streams and the cross-reference table is a
+    stream too.
+    """
+    f.write(b"%PDF-" + version.encode('ascii') + b"\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    packed = []
+
+    def write_stream(number, dictionary, data):
+        dictionary = DictionaryObject(dictionary)
+        dictionary[NameObject('/Length')] = NumberObject(len(data))
+        offsets[number] = f.tell()
+        f.write(b"%d 0 obj\n" % number + _serialize(dictionary, ref) + b"\nstream\n" + data + b"\nendstream\nendobj\n")
+
+    for idnum, obj in objects.items():
+        number = ref(idnum)
+        if idnum in bodies:
+            write_stream(number, *bodies[idnum])
+        elif isinstance(obj, StreamObject):
+            write_stream(number, _stream_dictionary(obj), obj._data)
+        elif object_streams:
+            packed.append((number, _serialize(obj, ref)))
+        else:
+            offsets[number] = f.tell()
+            f.write(b"%d 0 obj\n" % number + _serialize(obj, ref) + b"\nendobj\n")
+
+    # Object streams: a header of (number, offset) pairs, then the objects
+    next_number = len(objects) + 1
+    in_streams = {}
+    for start in range(0, len(packed), OBJECT_STREAM_SIZE):
+        chunk = packed[start:start + OBJECT_STREAM_SIZE]
+        header, body = [], b""
+        for index, (number, data) in enumerate(chunk):
+            header.append(b"%d %d" % (number, len(body)))
+            body += data + b"\n"
+            in_streams[number] = (next_number, index)
+        header = b" ".join(header) + b"\n"
+        write_stream(next_number, DictionaryObject({
+            NameObject('/Type'): NameObject('/ObjStm'),
+            NameObject('/N'): NumberObject(len(chunk)),
+            NameObject('/First'): NumberObject(len(header)),
+            NameObject('/Filter'): NameObject('/FlateDecode')
+        }), zlib.compress(header + body))
+        next_number += 1
+
+    trailer = DictionaryObject(trailer)
+    if not object_streams:
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % next_number)
+        for number in range(1, next_number):
+            f.write(b"%010d 00000 n \n" % offsets[number])
+        trailer[NameObject('/Size')] = NumberObject(next_number)
+        f.write(b"trailer\n" + _serialize(trailer, ref) + b"\nstartxref\n%d\n%%%%EOF\n" % xref)
+        return
+
+    # Cross-reference stream, which lists itself as the last object
+    xref_number = next_number
+    offsets[xref_number] = f.tell()
+    rows = [struct.pack('>BIH', 0, 0, 65535)]
+    for number in range(1, xref_number + 1):
+        if number in in_streams:
+            rows.append(struct.pack('>BIH', 2, *in_streams[number]))
+        else:
+            rows.append(struct.pack('>BIH', 1, offsets[number], 0))
+    data = zlib.compress(b"".join(rows))
+    trailer.update({
+        NameObject('/Type'): NameObject('/XRef'),
+        NameObject('/Size'): NumberObject(xref_number + 1),
+        NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)]),
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+        NameObject('/Length'): NumberObject(len(data))
+    })
+    f.write(b"%d 0 obj\n" % xref_number + _serialize(trailer, ref) + b"\nstream\n" + data + b"\nendstream\nendobj\n")
+    f.write(b"startxref\n%d\n%%%%EOF\n" % offsets[xref_number])
+
+def optimize_pdf(input_file, output_file, options=None):
+    """
+    Write an optimized copy of a PDF and return a report of the savings
+
+    options may override DEFAULT_OPTIMIZE_OPTIONS. output_file may be the
+    input file, which is then replaced. If the result is not smaller the
+    input is kept as it is. The whole document is held in memory while it
+    is optimized. The report has the sizes before and after, bytes_saved
+    and the number of objects merged, streams compressed and images
+    downsampled.
+    """
+    options = dict(DEFAULT_OPTIMIZE_OPTIONS, **(options or {}))
+    size_before = os.path.getsize(input_file)
+    report = {
+        'bytes_before': size_before, 'bytes_after': size_before, 'bytes_saved': 0,
+        'objects_merged': 0, 'streams_compressed': 0, 'images_downsampled': 0
+    }
+
+    reader = PdfReader(input_file)
+    if reader.is_encrypted:
+        return report
+    objects = _collect(reader)
+
+    merged = _deduplicate(objects) if options['dedup'] else {}
+    report['objects_merged'] = len(merged)
+    kept = {idnum: obj for idnum, obj in objects.items() if idnum not in merged}
+    bodies = {}
+
+    if options['downsample_dpi']:
+        # Largest size each (kept) image is drawn at on any page
+        drawn = {}
+        try:
+            for page in reader.pages:
+                for idnum, (width, height) in image_placements(page).items():
+                    idnum = merged.get(idnum, idnum)
+                    previous = drawn.get(idnum, (0, 0))
+                    drawn[idnum] = (max(previous[0], width), max(previous[1], height))
+        except Exception as e:
+            # Without every placement, an image could be resampled below
+            # the size of the page it is drawn largest on
+            logging.error(f"Error reading image placements, images are not downsampled: {str(e)}")
+            drawn = {}
+        for idnum, size in drawn.items():
+            if idnum in kept:
+                resampled = _resample_image(kept[idnum], size, options)
+                if resampled:
+                    bodies[idnum] = resampled
+                    report['images_downsampled'] += 1
+
+    if options['compress']:
+        for idnum, obj in kept.items():
+            if idnum in bodies or not isinstance(obj, StreamObject) or '/Filter' in obj or '/DecodeParms' in obj:
+                continue
+            # XML metadata is left readable, as the specification recommends
+            if obj.get('/Type') == '/Metadata':
+                continue
+            data = zlib.compress(obj._data)
+            if len(data) < len(obj._data):
+                bodies[idnum] = (_stream_dictionary(obj, Filter=NameObject('/FlateDecode')), data)
+                report['streams_compressed'] += 1
+
+    # Objects are renumbered densely in the order they were found
+    numbers = {idnum: number for number, idnum in enumerate(kept, 1)}
+
+    def ref(idnum):
+        return numbers[merged.get(idnum, idnum)]
+
+    trailer = {
+        NameObject(key): reader.trailer.raw_get(key) for key in ('/Root', '/Info', '/ID') if key in reader.trailer
+    }
+    version = reader.pdf_header[len('%PDF-'):] or '1.4'
+    if options['object_streams'] and version < '1.5':
+        version = '1.5'
+
+    temp_path = f"{output_file}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        with open(temp_path, 'wb') as f:
+            _write_pdf(f, kept, bodies, ref, trailer, version, options['object_streams'])
+        size_after = os.path.getsize(temp_path)
+        if size_after < size_before:
+            os.replace(temp_path, output_file)
+            report.update({'bytes_after': size_after, 'bytes_saved': size_before - size_after})
+        elif output_file != input_file:
+            shutil.copyfile(input_file, output_file)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return report
+
+def optimize_output(path, optimize, stats):
+    """
+    Optimizer stage of the processing functions: optimize path in place
+
+    optimize is True for the default options, or a dict overriding them.
+    The report is stored in stats['optimizer'] and the time spent in
+    stats['timings']['optimize']. A failure is only logged: the output is
+    valid as it was written.
+    """
+    try:
+        with timed(stats, 'optimize'):
+            stats['optimizer'] = optimize_pdf(path, path, optimize if isinstance(optimize, dict) else None)
+    except Exception as e:
+        logging.error(f"Error optimizing {path}: {str(e)}")
+
+if __name__ == '__main__':
+    # Usage: python pdf_optimizer.py entrada.pdf saida.pdf [--dpi 300] [--no-object-streams]
+    import json
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Deduplicate, recompress and downsample a PDF')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_OPTIMIZE_OPTIONS['downsample_dpi'],
+                        help='downsample images above this resolution on the page (0 keeps them)')
+    parser.add_argument('--no-object-streams', action='store_true', help='write a PDF 1.4 style file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = optimize_pdf(args.input, args.output, {
+        'downsample_dpi': args.dpi or None,
+        'object_streams': not args.no_object_streams
+    })
+    report['time'] = round(time.perf_counter() - start, 4)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,205 @@
+import io
+import zlib
+import struct
+
+# Image encodings for raster output
+# - 'flate': lossless, zlib-compressed samples (larger, no quality loss)
+# - 'jpeg': DCT-compressed at jpeg_quality (smaller, faster to write)
+IMAGE_FORMAT_FLATE = 'flate'
+IMAGE_FORMAT_JPEG = 'jpeg'
+IMAGE_FORMATS = (IMAGE_FORMAT_FLATE, IMAGE_FORMAT_JPEG)
+
+def encode_jpeg(img, quality):
+    """
+    Encode a PIL image as JPEG bytes
+    """
+    buffer = io.BytesIO()
+    img.convert('RGB').save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+def encode_image(img, image_format, jpeg_quality=85):
+    """
+    Encode a PIL image as a PDF image XObject
+
+    Returns (dictionary, stream data) as bytes. Flate images are
+    PNG-encoded by PIL: the IDAT payload of a PNG is a zlib stream of
+    predictor-filtered rows, which is exactly FlateDecode with /Predictor 15.
+    JPEG images are embedded as DCT streams.
+    """
+    width, height = img.size
+    if image_format == IMAGE_FORMAT_JPEG:
+        data = encode_jpeg(img, jpeg_quality)
+        return (
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d"
+            b" /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length %d >>"
+            % (width, height, len(data)),
+            data
+        )
+
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    colors, color_space = (1, b"/DeviceGray") if img.mode == 'L' else (3, b"/DeviceRGB")
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG', compress_level=6)
+    data = _png_idat(buffer.getvalue())
+    return (
+        b"<< /Type /XObject /Subtype /Image /Width %d /Height %d"
+        b" /ColorSpace %s /BitsPerComponent 8 /Filter /FlateDecode"
+        b" /DecodeParms << /Predictor 15 /Colors %d /BitsPerComponent 8 /Columns %d >> /Length %d >>"
+        % (width, height, color_space, colors, width, len(data)),
+        data
+    )
+
+class CanvasOutput:
+    """
+    Raster output builder drawing every page on a single reportlab canvas
+
+    Pages are added with draw_image() and show_page(), and the file is
+    written once by close(). reportlab keeps the compressed page data in
+    memory until then.
+    """
+
+    def __init__(self, output_file, page_size, image_format=IMAGE_FORMAT_FLATE, jpeg_quality=85):
+        # reportlab's canvas is only loaded by the raster engine
+        from reportlab.pdfgen import canvas
+
+        self.canvas = canvas.Canvas(output_file, pagesize=page_size)
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+        self.page_count = 0
+
+    def draw_image(self, img, x, y, width, height):
+        from reportlab.lib.utils import ImageReader
+
+        # JPEG is encoded once here and embedded by reportlab as-is;
+        # flate images are compressed by reportlab from the raw samples
+        if self.image_format == IMAGE_FORMAT_JPEG:
+            reader = ImageReader(io.BytesIO(encode_jpeg(img, self.jpeg_quality)))
+        else:
+            reader = ImageReader(img)
+        self.canvas.drawImage(reader, x, y, width=width, height=height)
+
+    def show_page(self):
+        self.canvas.showPage()
+        self.page_count += 1
+
+    def close(self):
+        self.canvas.save()
+
+class StreamingOutput:
+    """
+    Raster output builder writing each page to disk as soon as it is finished
+
+    Only the object offsets are kept in memory, so memory stays flat no
+    matter how many pages are written. Images can also be drawn already
+    encoded by encode_image(), e.g. by worker processes.
+    """
+
+    def __init__(self, output_file, page_size, image_format=IMAGE_FORMAT_FLATE, jpeg_quality=85):
+        self.file = open(output_file, 'wb')
+        self.page_width, self.page_height = page_size
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+        self.page_count = 0
+
+        # Objects 1 (catalog) and 2 (page tree) are written by close()
+        self.offsets = {}
+        self.page_refs = []
+        self.next_id = 3
+        self.images = []
+
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write_object(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(b"%d 0 obj\n" % obj_id)
+        self.file.write(body)
+        if stream is not None:
+            self.file.write(b"\nstream\n")
+            self.file.write(stream)
+            self.file.write(b"\nendstream")
+        self.file.write(b"\nendobj\n")
+
+    def _new_id(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def draw_image(self, img, x, y, width, height):
+        self.draw_encoded_image(encode_image(img, self.image_format, self.jpeg_quality), x, y, width, height)
+
+    def draw_encoded_image(self, encoded, x, y, width, height):
+        """
+        Draw an image already encoded by encode_image()
+        """
+        image_id = self._new_id()
+        body, data = encoded
+        self._write_object(image_id, body, data)
+        self.images.append((image_id, x, y, width, height))
+
+    def show_page(self):
+        # Content stream drawing the images of this page
+        operations = []
+        xobjects = []
+        for index, (image_id, x, y, width, height) in enumerate(self.images):
+            operations.append(b"q %.4f 0 0 %.4f %.4f %.4f cm /Im%d Do Q" % (width, height, x, y, index))
+            xobjects.append(b"/Im%d %d 0 R" % (index, image_id))
+        content = zlib.compress(b"\n".join(operations))
+        content_id = self._new_id()
+        self._write_object(content_id, b"<< /Filter /FlateDecode /Length %d >>" % len(content), content)
+
+        page_id = self._new_id()
+        self._write_object(
+            page_id,
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f]"
+            b" /Resources << /XObject << %s >> >> /Contents %d 0 R >>"
+            % (self.page_width, self.page_height, b" ".join(xobjects), content_id)
+        )
+        self.page_refs.append(page_id)
+        self.images = []
+        self.page_count += 1
+
+    def close(self):
+        try:
+            kids = b" ".join(b"%d 0 R" % page_id for page_id in self.page_refs)
+            self._write_object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_refs)))
+            self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+            # Cross-reference table and trailer
+            xref_offset = self.file.tell()
+            self.file.write(b"xref\n0 %d\n" % self.next_id)
+            self.file.write(b"0000000000 65535 f \n")
+            for obj_id in range(1, self.next_id):
+                self.file.write(b"%010d 00000 n \n" % self.offsets[obj_id])
+            self.file.write(
+                b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.next_id, xref_offset)
+            )
+        finally:
+            self.file.close()
+
+def _png_idat(png_data):
+    """
+    Return the concatenated IDAT chunk data of a PNG file
+    """
+    chunks = []
+    position = 8  # skip the PNG signature
+    while position < len(png_data):
+        length, chunk_type = struct.unpack('>I4s', png_data[position:position + 8])
+        if chunk_type == b'IDAT':
+            chunks.append(png_data[position + 8:position + 8 + length])
+        position += 12 + length
+    return b"".join(chunks)
+
+def open_output(output_file, page_size, streaming=False, image_format=IMAGE_FORMAT_FLATE, jpeg_quality=85):
+    """
+    Create a raster output builder for output_file
+
+    Streaming output writes pages to disk as they are added; the default
+    canvas output writes the whole file when it is closed.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
+
+    output_class = StreamingOutput if streaming else CanvasOutput
+    return output_class(output_file, page_size, image_format, jpeg_quality)
@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import zipfile
+from xml.etree import ElementTree
+from PyPDF2 import PageObject, PdfReader
+from page_analysis import CONTENT_IMAGES, CONTENT_MIXED, CONTENT_TEXT, ENGINE_RASTER, ENGINE_VECTOR, analyze_page, visible_size
+
+# Pages whose content is analyzed, spread evenly over the document
+PREFLIGHT_SAMPLE_PAGES = int(os.environ.get('PREFLIGHT_SAMPLE_PAGES', '10'))
+
+# Cost model, in estimated seconds of processing on one worker. Rendered
+# pages cost about the same whatever their size, since the raster engine
+# renders each one for the A5 page. Adjust to the host with the environment.
+COST_JOB = float(os.environ.get('COST_JOB', '0.05'))
+COST_VECTOR_PAGE = float(os.environ.get('COST_VECTOR_PAGE', '0.003'))
+COST_RASTER_PAGE = float(os.environ.get('COST_RASTER_PAGE', '0.6'))
+COST_WORD_CONVERSION = float(os.environ.get('COST_WORD_CONVERSION', '2.0'))
+COST_WORD_PAGE = float(os.environ.get('COST_WORD_PAGE', '0.05'))
+COST_TEXT_KB = float(os.environ.get('COST_TEXT_KB', '0.01'))
+
+# Attributes a page inherits from the page tree nodes above it
+_INHERITED = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+def _page_count(reader):
+    # Page count from the root of the page tree, without reading the tree
+    return int(reader.trailer['/Root']['/Pages']['/Count'])
+
+def _page_at(reader, index):
+    """
+    Return page `index` (0-based) by descending the page tree by its counts
+
+    Only the nodes on the way to the page are read, unlike reader.pages,
+    which reads every page of the document first. Inherited attributes are
+    copied onto the page, as PyPDF2 does.
+    """
+    node = reader.trailer['/Root']['/Pages']
+    inherited = {}
+    while node.get('/Type') == '/Pages':
+        inherited.update({key: node.raw_get(key) for key in _INHERITED if key in node})
+        kids = node['/Kids']
+        if int(node['/Count']) == len(kids):
+            # As many pages as kids (e.g. a flat tree): the kids are pages
+            kid = kids[index].get_object()
+            if kid.get('/Type') != '/Pages':
+                node = kid
+                continue
+        for reference in kids:
+            kid = reference.get_object()
+            count = int(kid['/Count']) if kid.get('/Type') == '/Pages' else 1
+            if index < count:
+                node = kid
+                break
+            index -= count
+        else:
+            raise IndexError("Page tree counts do not match its pages")
+
+    page = PageObject(reader, node.indirect_reference)
+    page.update(inherited)
+    page.update(node)
+    return page
+
+def inspect_pdf(path):
+    """
+    Read the shape of a PDF without processing it
+
+    Returns the page count, the sizes of a sample of pages (in points, with
+    how many sampled pages have each), the share of sampled pages with
+    images and with text only, and the estimated processing cost in
+    seconds per engine (see estimate_costs). Reads the cross-reference
+    table, the root of the page tree and the PREFLIGHT_SAMPLE_PAGES pages
+    of the sample.
+    """
+    start = time.perf_counter()
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        return {'pages': None, 'encrypted': True, 'estimated_cost': None}
+
+    try:
+        page_count = _page_count(reader)
+        lazy = True
+    except Exception:
+        # No usable count: let PyPDF2 read the whole page tree
+        page_count = len(reader.pages)
+        lazy = False
+
+    sample = sorted({round(i * (page_count - 1) / max(1, PREFLIGHT_SAMPLE_PAGES - 1)) for i in range(min(page_count, PREFLIGHT_SAMPLE_PAGES))})
+    sizes = {}
+    contents = {}
+    for index in sample:
+        page = _page_at(reader, index) if lazy else reader.pages[index]
+        size = tuple(round(value) for value in visible_size(page))
+        sizes[size] = sizes.get(size, 0) + 1
+        content = analyze_page(page)['content']
+        contents[content] = contents.get(content, 0) + 1
+
+    sampled = len(sample) or 1
+    info = {
+        'pages': page_count,
+        'page_sizes': [
+            {'width': width, 'height': height, 'sampled_pages': count}
+            for (width, height), count in sorted(sizes.items(), key=lambda item: -item[1])
+        ],
+        'sampled_pages': len(sample),
+        'image_ratio': round((contents.get(CONTENT_IMAGES, 0) + contents.get(CONTENT_MIXED, 0)) / sampled, 3),
+        'text_ratio': round(contents.get(CONTENT_TEXT, 0) / sampled, 3)
+    }
+    info['estimated_cost'] = estimate_costs(page_count, info['image_ratio'])
+    info['time'] = round(time.perf_counter() - start, 4)
+    return info
+
+def _docx_page_count(path):
+    # Page count saved by the word processor in the document properties
+    with zipfile.ZipFile(path) as archive:
+        properties = ElementTree.fromstring(archive.read('docProps/app.xml'))
+    for element in properties:
+        if element.tag.endswith('}Pages') and element.text:
+            return int(element.text)
+    return None
+
+def inspect_word(path):
+    """
+    Read the page count of a Word document, where the file records it
+
+    DOCX files saved by Word or LibreOffice carry it in their properties;
+    for others the pages and cost are unknown (None). The cost includes
+    the conversion to PDF, assuming every page is placed as text.
+    """
+    try:
+        pages = _docx_page_count(path)
+    except Exception:
+        pages = None
+    if pages is None:
+        return {'pages': None, 'estimated_cost': None}
+
+    conversion = COST_WORD_CONVERSION + pages * COST_WORD_PAGE
+    costs = estimate_costs(pages, 0.0)
+    return {'pages': pages, 'estimated_cost': {engine: round(cost + conversion, 3) for engine, cost in costs.items()}}
+
+def inspect_document(path, file_type):
+    """
+    Preflight of an uploaded document: inspect_pdf or inspect_word
+
+    Never raises; a document that cannot be read gets an 'error' and no
+    estimate, so it is still accepted and processing reports the problem.
+    """
+    try:
+        if file_type == 'pdf':
+            return inspect_pdf(path)
+        return inspect_word(path)
+    except Exception as e:
+        logging.error(f"Error inspecting {path}: {str(e)}")
+        return {'pages': None, 'estimated_cost': None, 'error': str(e)}
+
+def estimate_costs(pages, image_ratio):
+    """
+    Estimate the processing seconds of a document per engine
+
+    The raster engine renders the pages with images and places the others
+    as vectors (its default plan).
+    """
+    rendered = pages * image_ratio
+    return {
+        ENGINE_VECTOR: round(COST_JOB + pages * COST_VECTOR_PAGE, 3),
+        ENGINE_RASTER: round(COST_JOB + rendered * COST_RASTER_PAGE + (pages - rendered) * COST_VECTOR_PAGE, 3)
+    }
+
+def estimate_text_cost(size):
+    """
+    Estimate the seconds to lay out `size` bytes of text
+    """
+    return round(COST_JOB + size / 1024 * COST_TEXT_KB, 3)
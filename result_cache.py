@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+# Suffix of cached output files, which live next to the other processed files
+CACHE_SUFFIX = '_cached.pdf'
+
+# Entries are written as <entry>.<random>.part and renamed; temporary files
+# older than this (seconds) were left by a failed write and are removed
+PART_GRACE = 3600
+
+def file_digest(file_path):
+    """
+    Return the SHA-256 hex digest of a file's content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Content-addressed cache of processed documents
+
+    Entries are keyed by the hash of the input content plus the normalized
+    processing parameters, and stored as files in `folder`. When the total
+    size exceeds `max_bytes`, the least recently used entries are removed
+    (a hit refreshes the file's modification time). Only files ending with
+    `suffix` belong to the cache.
+    """
+
+    def __init__(self, folder, max_bytes=1024 * 1024 * 1024, suffix=CACHE_SUFFIX):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, content_digest, params):
+        """
+        Build the cache key for an input digest and its processing parameters
+        """
+        normalized = json.dumps(params, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{content_digest}:{normalized}".encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + self.suffix)
+
+    def get(self, key):
+        """
+        Return the path of the cached output for key, or None on a miss
+        """
+        path = self.path(key)
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key, file_path):
+        """
+        Move a freshly processed file into the cache and return its new path
+        """
+        path = self.path(key)
+        os.replace(file_path, path)
+        self._evict(keep=path)
+        return path
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes
+        }
+
+    def _entries(self):
+        # (mtime, size, path) of every cached file
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(self.suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _remove_stale_parts(self):
+        # Temporary files of entries whose write failed (e.g. a full disk)
+        limit = time.time() - PART_GRACE
+        for entry in os.scandir(self.folder):
+            name = entry.name
+            if not name.endswith('.part') or self.suffix + '.' not in name:
+                continue
+            try:
+                if entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Error removing temporary file {entry.path}: {str(e)}")
+
+    def _evict(self, keep=None):
+        # Remove the least recently used entries until the cache fits
+        self._remove_stale_parts()
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Error evicting cached file {path}: {str(e)}")
@@ -1,3 +1,7 @@
+// Arquivos acima deste tamanho são enviados em partes (bytes)
+const CHUNKED_UPLOAD_THRESHOLD = 16 * 1024 * 1024;
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+
 document.addEventListener('DOMContentLoaded', function() {
     // Elementos DOM
     const uploadForm = document.getElementById('upload-form');
@@ -5,6 +9,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const processingForm = document.getElementById('processing-form');
     const fileInput = document.getElementById('document-input');
     const textInput = document.getElementById('text-input');
+    const textFileInput = document.getElementById('text-file-input');
     const textTitle = document.getElementById('text-title');
     const fontSizeInput = document.getElementById('font-size');
     const fontSizeValue = document.getElementById('font-size-value');
@@ -27,6 +32,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     let currentText = {
         content: null,
+        file: null,
         title: null,
         style: 'normal',
         layout: 'single',
@@ -64,16 +70,10 @@ document.addEventListener('DOMContentLoaded', function() {
         // Mostrar progresso
         uploadProgress.classList.remove('d-none');
         
-        // Criar FormData
-        const formData = new FormData();
-        formData.append('document', file);
+        // Arquivos grandes são enviados em partes, que podem ser retomadas
+        const upload = file.size > CHUNKED_UPLOAD_THRESHOLD ? uploadInChunks(file) : uploadWhole(file);
         
-        // Enviar requisição de upload
-        fetch('/upload', {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => response.json())
+        upload
         .then(data => {
             uploadProgress.classList.add('d-none');
             
@@ -85,8 +85,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 currentFile.type = data.file_type;
                 inputType = 'file';
                 
-                // Atualizar UI
-                fileNameDisplay.textContent = data.file_name;
+                // Atualizar UI, com o número de páginas lido na inspeção do arquivo
+                const pages = data.preflight && data.preflight.pages;
+                fileNameDisplay.textContent = pages ? `${data.file_name} (${pages} páginas)` : data.file_name;
                 processingOptions.classList.remove('d-none');
                 showAlert('Arquivo enviado com sucesso!', 'success');
             } else {
@@ -99,18 +100,104 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
+    // Enviar o arquivo inteiro em uma única requisição
+    function uploadWhole(file) {
+        const formData = new FormData();
+        formData.append('document', file);
+        
+        return fetch('/upload', {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json());
+    }
+    
+    // Enviar o arquivo em partes numeradas; um envio interrompido é
+    // retomado a partir das partes que o servidor ainda não recebeu
+    function uploadInChunks(file) {
+        const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+        const savedId = localStorage.getItem(resumeKey);
+        const progressBar = uploadProgress.querySelector('.progress-bar');
+        
+        // Retomar o envio salvo, ou começar um novo
+        const session = savedId
+            ? fetch(`/upload/chunked/${savedId}`).then(response => response.json())
+            : Promise.resolve({ success: false });
+        
+        return session
+        .then(info => {
+            if (info.success) {
+                return info;
+            }
+            return fetch('/upload/chunked', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ filename: file.name, size: file.size, chunk_size: UPLOAD_CHUNK_SIZE })
+            })
+            .then(response => response.json())
+            .then(info => {
+                if (!info.success) {
+                    throw new Error(info.error);
+                }
+                info.received = [];
+                localStorage.setItem(resumeKey, info.upload_id);
+                return info;
+            });
+        })
+        .then(info => {
+            const received = new Set(info.received);
+            
+            // Enviar as partes que faltam, uma de cada vez
+            let chain = Promise.resolve();
+            for (let index = 0; index < info.chunks; index++) {
+                if (received.has(index)) {
+                    continue;
+                }
+                chain = chain.then(() => {
+                    const chunk = file.slice(index * info.chunk_size, (index + 1) * info.chunk_size);
+                    return fetch(`/upload/chunked/${info.upload_id}/${index}`, {
+                        method: 'PUT',
+                        body: chunk
+                    })
+                    .then(response => response.json())
+                    .then(result => {
+                        if (!result.success) {
+                            throw new Error(result.error);
+                        }
+                        received.add(index);
+                        progressBar.style.width = `${Math.round(received.size / info.chunks * 100)}%`;
+                    });
+                });
+            }
+            
+            return chain.then(() => fetch(`/upload/chunked/${info.upload_id}/complete`, { method: 'POST' }));
+        })
+        .then(response => response.json())
+        .then(data => {
+            progressBar.style.width = '100%';
+            if (data.success) {
+                localStorage.removeItem(resumeKey);
+            }
+            return data;
+        });
+    }
+    
     // Envio do formulário de texto
     textForm.addEventListener('submit', function(e) {
         e.preventDefault();
         
         const text = textInput.value.trim();
-        if (!text) {
+        const textFile = textFileInput.files[0] || null;
+        if (!text && !textFile) {
             showAlert('Por favor, insira algum texto', 'danger');
             return;
         }
         
         // Armazenar informações do texto
         currentText.content = text;
+        currentText.file = textFile;
         currentText.title = textTitle.value.trim();
         currentText.style = document.querySelector('input[name="text-style"]:checked').value;
         currentText.layout = document.querySelector('input[name="text-layout"]:checked').value;
@@ -118,7 +205,7 @@ document.addEventListener('DOMContentLoaded', function() {
         inputType = 'text';
         
         // Atualizar UI
-        const displayName = currentText.title || 'Documento de texto';
+        const displayName = currentText.title || (textFile ? textFile.name : 'Documento de texto');
         fileNameDisplay.textContent = displayName;
         processingOptions.classList.remove('d-none');
         showAlert('Texto preparado com sucesso!', 'success');
@@ -132,7 +219,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (inputType === 'file' && !currentFile.path) {
             showAlert('Por favor, envie um arquivo primeiro', 'warning');
             return;
-        } else if (inputType === 'text' && !currentText.content) {
+        } else if (inputType === 'text' && !currentText.content && !currentText.file) {
             showAlert('Por favor, insira algum texto primeiro', 'warning');
             return;
         }
@@ -144,6 +231,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const marginBottom = document.getElementById('margin-bottom').value;
         const marginLeft = document.getElementById('margin-left').value;
         const orientation = document.getElementById('orientation-switch').checked ? 'landscape' : 'portrait';
+        const engine = document.querySelector('input[name="engine"]:checked').value;
         
         // Mostrar progresso de processamento
         processingProgress.classList.remove('d-none');
@@ -155,11 +243,15 @@ document.addEventListener('DOMContentLoaded', function() {
                 file_path: currentFile.path,
                 file_type: currentFile.type,
                 processing_type: processingType,
+                engine: engine,
                 margin_top: marginTop,
                 margin_right: marginRight,
                 margin_bottom: marginBottom,
                 margin_left: marginLeft,
-                orientation: orientation
+                orientation: orientation,
+                imposition: document.getElementById('imposition-mode').value,
+                signature_size: document.getElementById('signature-size').value || null,
+                progressive: true
             };
             
             // Enviar requisição de processamento de arquivo
@@ -171,7 +263,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify(requestData)
             })
             .then(response => response.json())
-            .then(data => handleProcessingResponse(data))
+            .then(data => handleJobResponse(data))
             .catch(error => {
                 processingProgress.classList.add('d-none');
                 showAlert('Erro ao processar documento: ' + error.message, 'danger');
@@ -192,16 +284,31 @@ document.addEventListener('DOMContentLoaded', function() {
                 orientation: orientation
             };
             
+            // Um arquivo .txt é enviado como formulário e lido pelo servidor aos poucos
+            let request;
+            if (currentText.file) {
+                const formData = new FormData();
+                Object.entries(requestData).forEach(([key, value]) => {
+                    if (value !== null) {
+                        formData.append(key, value);
+                    }
+                });
+                formData.append('text_file', currentText.file);
+                request = { method: 'POST', body: formData };
+            } else {
+                request = {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify(requestData)
+                };
+            }
+            
             // Enviar requisição de processamento de texto
-            fetch('/process-text', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify(requestData)
-            })
+            fetch('/process-text', request)
             .then(response => response.json())
-            .then(data => handleProcessingResponse(data))
+            .then(data => handleJobResponse(data))
             .catch(error => {
                 processingProgress.classList.add('d-none');
                 showAlert('Erro ao processar texto: ' + error.message, 'danger');
@@ -209,6 +316,67 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
+    // Função para tratar a resposta do envio de uma tarefa de processamento
+    function handleJobResponse(data) {
+        if (data.success && data.status_url) {
+            // A tarefa foi enfileirada: acompanhar o status até terminar
+            pollJob(data.status_url);
+        } else {
+            handleProcessingResponse(data);
+        }
+    }
+    
+    // Consultar o status da tarefa periodicamente: mais rápido no início,
+    // para mostrar as primeiras páginas assim que ficam prontas
+    function pollJob(statusUrl, attempt = 0) {
+        const progressBar = processingProgress.querySelector('.progress-bar');
+        const progressText = processingProgress.querySelector('p');
+        
+        fetch(statusUrl)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                handleProcessingResponse(data);
+                return;
+            }
+            
+            if (data.status === 'done') {
+                resetProgress(progressBar, progressText);
+                handleProcessingResponse(data);
+            } else if (data.status === 'failed') {
+                resetProgress(progressBar, progressText);
+                handleProcessingResponse({ success: false, error: data.error });
+            } else {
+                // Atualizar progresso quando conhecido
+                if (data.status === 'queued') {
+                    progressText.textContent = 'Aguardando na fila...';
+                } else if (data.progress !== null) {
+                    const percent = Math.round(data.progress * 100);
+                    progressBar.style.width = `${percent}%`;
+                    progressText.textContent = `Processando seu documento... ${percent}%`;
+                }
+                
+                // Páginas já prontas de um documento ainda em processamento
+                if (data.stats.pages_ready) {
+                    previewContainer.classList.remove('d-none');
+                    updateProgressivePreview(statusUrl, data.stats);
+                }
+                setTimeout(() => pollJob(statusUrl, attempt + 1), attempt < 20 ? 250 : 1000);
+            }
+        })
+        .catch(error => {
+            resetProgress(progressBar, progressText);
+            processingProgress.classList.add('d-none');
+            showAlert('Erro ao consultar o processamento: ' + error.message, 'danger');
+        });
+    }
+    
+    // Restaurar a barra de progresso ao estado inicial
+    function resetProgress(progressBar, progressText) {
+        progressBar.style.width = '100%';
+        progressText.textContent = 'Processando seu documento...';
+    }
+    
     // Função para tratar a resposta do processamento
     function handleProcessingResponse(data) {
         processingProgress.classList.add('d-none');
@@ -231,6 +399,13 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    // Mostrar as opções de livreto apenas quando esse método for escolhido
+    document.querySelectorAll('input[name="processing-type"]').forEach(function(radio) {
+        radio.addEventListener('change', function() {
+            document.getElementById('booklet-options').classList.toggle('d-none', this.value !== 'booklet');
+        });
+    });
+    
     // Atualizar rótulo de orientação quando o switch mudar
     orientationSwitch.addEventListener('change', function() {
         orientationLabel.textContent = this.checked ? 'Paisagem' : 'Retrato';
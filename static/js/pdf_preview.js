@@ -1,9 +1,118 @@
-// Funcionalidade de pré-visualização de PDF usando PDF.js
+// Pré-visualização de PDF por miniaturas de página geradas no servidor;
+// só as páginas visíveis são baixadas
 function initPdfPreview(pdfUrl) {
     // Obter o elemento container
     const container = document.getElementById('pdf-preview');
     container.innerHTML = '';
     
+    fetch(`${pdfUrl}/pages`)
+    .then(response => {
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        return response.json();
+    })
+    .then(info => showThumbnails(pdfUrl, info, container))
+    .catch(function(error) {
+        // Sem miniaturas: renderizar o PDF no navegador
+        console.error('Erro ao carregar miniaturas:', error);
+        initPdfJsPreview(pdfUrl, container);
+    });
+}
+
+function showThumbnails(pdfUrl, info, container) {
+    // Adicionar indicador de contagem de páginas
+    const pageCount = document.createElement('div');
+    pageCount.className = 'text-center text-muted mb-2';
+    pageCount.textContent = `O documento tem ${info.pages} página(s)`;
+    container.appendChild(pageCount);
+    
+    // Criar container de pré-visualização
+    const previewPages = document.createElement('div');
+    previewPages.className = 'preview-pages';
+    container.appendChild(previewPages);
+    
+    // Carregar a imagem de uma página quando ela se aproxima da área visível
+    const observer = new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+            if (entry.isIntersecting) {
+                entry.target.src = entry.target.dataset.src;
+                observer.unobserve(entry.target);
+            }
+        });
+    }, { root: container, rootMargin: '400px 0px' });
+    
+    // Miniaturas maiores em telas de alta densidade
+    const width = window.devicePixelRatio > 1 ? info.thumbnail_widths[info.thumbnail_widths.length - 1] : info.thumbnail_widths[0];
+    
+    for (let i = 1; i <= info.pages; i++) {
+        // Criar um wrapper para esta página
+        const pageWrapper = document.createElement('div');
+        pageWrapper.className = 'pdf-page-wrapper mb-4';
+        
+        // Criar indicador de número de página
+        const pageNum = document.createElement('div');
+        pageNum.className = 'page-number badge bg-secondary';
+        pageNum.textContent = `Página ${i}`;
+        pageWrapper.appendChild(pageNum);
+        
+        // A imagem já ocupa o tamanho da página antes de carregar
+        const img = document.createElement('img');
+        img.className = 'pdf-page-thumbnail';
+        img.alt = `Página ${i}`;
+        img.width = info.thumbnail_widths[0];
+        img.height = Math.round(info.thumbnail_widths[0] * info.height / info.width);
+        img.dataset.src = `${pdfUrl}/page/${i}.webp?width=${width}`;
+        pageWrapper.appendChild(img);
+        previewPages.appendChild(pageWrapper);
+        
+        observer.observe(img);
+    }
+}
+
+// Pré-visualização progressiva: mostra as páginas de uma tarefa em
+// andamento à medida que ficam prontas; a pré-visualização do documento
+// final a substitui quando a tarefa termina
+function updateProgressivePreview(statusUrl, stats) {
+    const container = document.getElementById('pdf-preview');
+    let previewPages = container.querySelector('.preview-pages');
+    
+    // Começar uma nova pré-visualização para esta tarefa
+    if (!previewPages || previewPages.dataset.statusUrl !== statusUrl) {
+        container.innerHTML = '';
+        
+        const note = document.createElement('div');
+        note.className = 'text-center text-muted mb-2';
+        note.textContent = `Primeiras páginas de ${stats.pages_out_total}; o restante ainda está sendo processado...`;
+        container.appendChild(note);
+        
+        previewPages = document.createElement('div');
+        previewPages.className = 'preview-pages';
+        previewPages.dataset.statusUrl = statusUrl;
+        container.appendChild(previewPages);
+    }
+    
+    // Adicionar as páginas que ficaram prontas desde a última consulta
+    for (let i = previewPages.children.length + 1; i <= stats.pages_ready; i++) {
+        const pageWrapper = document.createElement('div');
+        pageWrapper.className = 'pdf-page-wrapper mb-4';
+        
+        const pageNum = document.createElement('div');
+        pageNum.className = 'page-number badge bg-secondary';
+        pageNum.textContent = `Página ${i}`;
+        pageWrapper.appendChild(pageNum);
+        
+        const img = document.createElement('img');
+        img.className = 'pdf-page-thumbnail';
+        img.alt = `Página ${i}`;
+        img.src = `${statusUrl}/page/${i}.webp`;
+        pageWrapper.appendChild(img);
+        previewPages.appendChild(pageWrapper);
+    }
+}
+
+// Funcionalidade de pré-visualização de PDF usando PDF.js
+function initPdfJsPreview(pdfUrl, container) {
     // Carregar o visualizador PDF.js dinamicamente
     const script = document.createElement('script');
     script.src = 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.4.120/pdf.min.js';
@@ -17,8 +126,14 @@ function initPdfPreview(pdfUrl) {
 }
 
 function loadPdf(pdfUrl, pdfjsLib, container) {
-    // Carregar o documento PDF
-    const loadingTask = pdfjsLib.getDocument(pdfUrl);
+    // Carregar o documento PDF por partes: o servidor aceita requisições
+    // Range, então só os bytes das páginas exibidas são baixados
+    const loadingTask = pdfjsLib.getDocument({
+        url: pdfUrl,
+        rangeChunkSize: 256 * 1024,
+        disableAutoFetch: true,
+        disableStream: true
+    });
     
     loadingTask.promise.then(function(pdf) {
         // Criar uma pré-visualização para as primeiras 5 páginas (ou menos se o documento tiver menos páginas)
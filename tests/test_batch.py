@@ -0,0 +1,58 @@
+import json
+import shutil
+import zipfile
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+import batch
+
+def write_pdf(path, pages=2):
+    c = canvas.Canvas(str(path), pagesize=A4)
+    for page_num in range(pages):
+        c.drawString(72, 720, f"Page {page_num + 1}")
+        c.showPage()
+    c.save()
+    return str(path)
+
+def test_word_documents_are_converted_before_the_pool(tmp_path, monkeypatch):
+    source = write_pdf(tmp_path / 'source.pdf')
+    documents = [('a.pdf', source), ('b.docx', str(tmp_path / 'b.docx')), ('bad.doc', str(tmp_path / 'bad.doc'))]
+    calls = []
+
+    # Patched in this process only: worker processes never convert
+    def convert_words_to_pdf(pairs):
+        calls.append([input_file for input_file, _ in pairs])
+        errors = []
+        for input_file, output_file in pairs:
+            if 'bad' in input_file:
+                errors.append('Falha ao converter documento Word para PDF')
+            else:
+                shutil.copyfile(source, output_file)
+                errors.append(None)
+        return errors
+
+    monkeypatch.setattr(batch.dp, 'convert_words_to_pdf', convert_words_to_pdf)
+    output = str(tmp_path / 'out.zip')
+    stats = {}
+    report = batch.process_batch(documents, output, workers=2, stats=stats)
+
+    # One call converts every Word document of the batch
+    assert calls == [[documents[1][1], documents[2][1]]]
+    results = {result['name']: result for result in report}
+    assert results['a.pdf']['success'] and results['b.docx']['success']
+    assert results['bad.doc']['error'] == 'Falha ao converter documento Word para PDF'
+    assert (stats['documents_done'], stats['failures']) == (3, 1)
+    assert 'convert' in stats['timings']
+
+    with zipfile.ZipFile(output) as archive:
+        assert sorted(archive.namelist()) == ['a_a5.pdf', 'b_a5.pdf', batch.REPORT_NAME]
+        assert json.loads(archive.read(batch.REPORT_NAME))['failures'] == 1
+
+def test_booklet_batch(tmp_path):
+    source = write_pdf(tmp_path / 'source.pdf', pages=6)
+    output = str(tmp_path / 'out.zip')
+    [result] = batch.process_batch([('source.pdf', source)], output, {
+        'processing_type': 'booklet',
+        'imposition': {'mode': batch.dp.IMPOSITION_2UP, 'booklet': True}
+    }, workers=1)
+    # Six pages fill two sheets printed on both sides
+    assert result['success'] and result['pages_out'] == 4
@@ -0,0 +1,151 @@
+import io
+import time
+import threading
+import pytest
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from jobs import Job, JobQueue, JobTooLargeError, QueueFullError, QuotaExceededError, JOB_DONE, JOB_FAILED, JOB_RUNNING
+
+def wait_for(job, timeout=5):
+    deadline = time.time() + timeout
+    while job.status not in (JOB_DONE, JOB_FAILED):
+        assert time.time() < deadline, f"job {job.id} did not finish"
+        time.sleep(0.01)
+
+def wait_running(job, timeout=5):
+    deadline = time.time() + timeout
+    while job.status != JOB_RUNNING:
+        assert time.time() < deadline, f"job {job.id} did not start"
+        time.sleep(0.01)
+
+@pytest.fixture
+def gate():
+    # Event a blocking job waits on; always released so no worker is left waiting
+    event = threading.Event()
+    yield event
+    event.set()
+
+def block(stats, event):
+    event.wait(5)
+
+def record(stats, order, name):
+    order.append(name)
+
+def test_short_jobs_run_first(gate):
+    queue = JobQueue(workers=1)
+    blocker = queue.submit(block, gate, cost=1)
+    wait_running(blocker)
+    order = []
+    jobs = [queue.submit(record, order, name, cost=cost) for name, cost in (('long', 100), ('medium', 10), ('short', 1))]
+    assert queue.depth() == 3
+
+    gate.set()
+    for job in jobs:
+        wait_for(job)
+    assert order == ['short', 'medium', 'long']
+
+def test_waiting_ages_long_jobs():
+    # A long job waiting for long enough overtakes a short new one
+    queue = JobQueue(workers=1)
+    old, new = Job(cost=100), Job(cost=1)
+    old.created -= 1000
+    queue._pending = [new, old]
+    assert queue._next_job() is old
+
+def test_admission_limits(gate):
+    queue = JobQueue(workers=1, max_pending=2, max_pending_cost=10, max_job_cost=20, owner_quota=8)
+    with pytest.raises(JobTooLargeError):
+        queue.submit(block, gate, cost=21)
+    queue.submit(block, gate, cost=1)
+
+    # Owner quota counts queued and running work of the same owner only
+    queue.submit(block, gate, cost=6, owner='a')
+    with pytest.raises(QuotaExceededError):
+        queue.submit(block, gate, cost=3, owner='a')
+    # Waiting cost above max_pending_cost
+    with pytest.raises(QueueFullError):
+        queue.submit(block, gate, cost=5, owner='b')
+    queue.submit(block, gate, cost=3, owner='b')
+    # Number of jobs above workers + max_pending
+    with pytest.raises(QueueFullError):
+        queue.submit(block, gate, cost=0.1, owner='c')
+
+def test_large_jobs_leave_a_worker_free(gate):
+    queue = JobQueue(workers=2, large_job_cost=60)
+    large = [queue.submit(block, gate, cost=100) for _ in range(2)]
+    small = queue.submit(record, [], 'small', cost=1)
+    # The second large job waits while the small one runs on the free worker
+    wait_for(small)
+    assert sorted(job.status for job in large) == ['queued', 'running']
+
+def test_failed_job_keeps_its_error():
+    queue = JobQueue(workers=1)
+
+    def fail(stats):
+        raise ValueError('broken')
+
+    job = queue.submit(fail)
+    wait_for(job)
+    assert job.status == JOB_FAILED and job.error == 'broken'
+
+@pytest.fixture
+def server():
+    import app as server
+    server.app.config['TESTING'] = True
+    return server
+
+def use_queue(monkeypatch, server, **limits):
+    queue = JobQueue(workers=1, **limits)
+    monkeypatch.setattr(server, 'job_queue', queue)
+    return queue
+
+def post_text(client):
+    return client.post('/process-text', json={'text': 'Texto de teste'})
+
+def test_too_large_job_is_refused_with_413(monkeypatch, server):
+    use_queue(monkeypatch, server, max_job_cost=0.0001)
+    response = post_text(server.app.test_client())
+    assert response.status_code == 413
+    assert response.json['success'] is False and response.json['estimated_cost'] > 0
+
+def test_client_quota_is_refused_with_429(monkeypatch, server, gate):
+    queue = use_queue(monkeypatch, server, owner_quota=5)
+    # The test client connects from 127.0.0.1
+    queue.submit(block, gate, cost=5, owner='127.0.0.1')
+    response = post_text(server.app.test_client())
+    assert response.status_code == 429
+    assert 'andamento' in response.json['error']
+
+def test_full_queue_is_refused_with_429(monkeypatch, server, gate):
+    queue = use_queue(monkeypatch, server, max_pending=0)
+    queue.submit(block, gate, cost=1, owner='other')
+    response = post_text(server.app.test_client())
+    assert response.status_code == 429
+    assert 'ocupado' in response.json['error']
+
+def test_document_cost_comes_from_preflight(monkeypatch, server, gate):
+    # Scanned-like pages, which the raster engine renders
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    for page_num in range(3):
+        c.drawImage(ImageReader(Image.new('RGB', (400, 500), 'gray')), 0, 0, *A4)
+        c.showPage()
+    c.save()
+    buffer.seek(0)
+
+    client = server.app.test_client()
+    upload = client.post('/upload', data={'document': (buffer, 'doc.pdf')}, content_type='multipart/form-data').json
+    assert upload['preflight']['pages'] == 3
+    costs = upload['preflight']['estimated_cost']
+
+    # A raster job costing more than the limit is refused, a vector one queued
+    queue = use_queue(monkeypatch, server, max_job_cost=(costs['vector'] + costs['raster']) / 2)
+    # Keeps the queued job from running (and writing its output)
+    queue.submit(block, gate, cost=0.001)
+    request = {'file_path': upload['file_path'], 'file_type': 'pdf', 'processing_type': 'resize'}
+    response = client.post('/process', json=dict(request, engine='raster'))
+    assert response.status_code == 413
+    response = client.post('/process', json=dict(request, engine='vector'))
+    assert response.status_code == 202 and response.json['estimated_cost'] == costs['vector']
@@ -0,0 +1,26 @@
+import sys
+import threading
+from app import LazyModule
+
+def test_concurrent_first_access(tmp_path, monkeypatch):
+    # A module slow to execute, touched by several threads at once
+    (tmp_path / 'slow_backend.py').write_text("import time\ntime.sleep(0.2)\n\ndef f():\n    return 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'slow_backend', raising=False)
+
+    module = LazyModule('slow_backend')
+    assert 'slow_backend' not in sys.modules
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(module.f())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == [] and results == [42] * 4
@@ -0,0 +1,149 @@
+import os
+import time
+import pytest
+from PIL import Image, ImageDraw
+import document_processor
+import result_cache
+from page_cache import PageCache
+from pdf_output import IMAGE_FORMAT_FLATE, encode_image
+from thumbnails import THUMBNAIL_WIDTH
+
+OPTIONS = {'chunk_size': 4, 'image_format': IMAGE_FORMAT_FLATE, 'jpeg_quality': 85}
+
+def page_image(page_num, dpi):
+    # Stand-in for a rendered page: its size follows the resolution
+    img = Image.new('RGB', (dpi * 2, dpi * 3), 'white')
+    ImageDraw.Draw(img).text((10, 10), f"{page_num}", fill='black')
+    return img
+
+@pytest.fixture
+def rendered(monkeypatch):
+    # Replace poppler: record the (page_num, dpi) rendered
+    calls = []
+
+    def render_pages(input_file, pages, stats, chunk_size=None):
+        for page_num, dpi in pages:
+            calls.append((page_num, dpi))
+            yield page_num, page_image(page_num, dpi)
+
+    monkeypatch.setattr(document_processor, '_render_pages', render_pages)
+    return calls
+
+def extract(cache, pages, split=False):
+    stats = {}
+    result = list(document_processor._raster_extracts('in.pdf', pages, 'portrait', split, OPTIONS, stats, (cache.folder, 'digest')))
+    return result, stats
+
+def test_parts_round_trip(tmp_path):
+    cache = PageCache(str(tmp_path))
+    img = page_image(0, 200)
+    key = cache.page_key('digest', 0, 200, 'page', IMAGE_FORMAT_FLATE, 85)
+    assert cache.get_parts(key) is None
+
+    encoded = encode_image(img, IMAGE_FORMAT_FLATE)
+    cache.put_parts(key, [(img.width, img.height, encoded, img)])
+    [(width, height, cached, preview)] = cache.get_parts(key)
+    assert (width, height) == img.size
+    assert cached == encoded
+    # The preview is reduced to the thumbnail width
+    assert preview.width == THUMBNAIL_WIDTH
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.part')]
+
+def test_cached_dpis(tmp_path):
+    cache = PageCache(str(tmp_path))
+    img = page_image(0, 10)
+    for page_num, dpi in ((0, 100), (0, 150), (3, 100)):
+        cache.put_parts(cache.page_key('digest', page_num, dpi, 'page', IMAGE_FORMAT_FLATE, 85), [(1, 1, (b'', b''), img)])
+    cache.put_parts(cache.page_key('other', 1, 100, 'page', IMAGE_FORMAT_FLATE, 85), [(1, 1, (b'', b''), img)])
+    assert cache.cached_dpis('digest') == {0: [100, 150], 3: [100]}
+
+def test_trim_evicts_least_recently_used(tmp_path):
+    cache = PageCache(str(tmp_path))
+    keys = [cache.page_key('digest', page_num, 100, 'page', IMAGE_FORMAT_FLATE, 85) for page_num in range(3)]
+    for index, key in enumerate(keys):
+        cache.put_parts(key, [(1, 1, (b'x' * 1000, b''), page_image(index, 10))])
+        timestamp = time.time() - 100 + index
+        os.utime(cache.path(key), (timestamp, timestamp))
+
+    # Reading the oldest page makes it the most recently used
+    assert cache.get_parts(keys[0])
+    cache.max_bytes = sum(os.path.getsize(cache.path(key)) for key in keys) - 1
+    cache.trim()
+    assert [cache.has(key) for key in keys] == [True, False, True]
+
+def test_extracts_are_reused(tmp_path, rendered):
+    cache = PageCache(str(tmp_path))
+    pages = [(0, 100), (1, 100), (2, 150)]
+    first, stats = extract(cache, pages)
+    assert rendered == pages
+    assert (stats['page_cache_hits'], stats['page_cache_misses']) == (0, 3)
+
+    # Another layout of the same pages only renders what is not cached
+    second, stats = extract(cache, pages + [(3, 100)])
+    assert rendered == pages + [(3, 100)]
+    assert (stats['page_cache_hits'], stats['page_cache_misses']) == (3, 1)
+    assert [page_num for page_num, _ in second] == [0, 1, 2, 3]
+    for (_, parts), (_, cached_parts) in zip(first, second):
+        assert [part[:3] for part in parts] == [part[:3] for part in cached_parts]
+
+def test_extracts_depend_on_split(tmp_path, rendered):
+    cache = PageCache(str(tmp_path))
+    extract(cache, [(0, 100)])
+    result, stats = extract(cache, [(0, 100)], split=True)
+    assert stats['page_cache_misses'] == 1
+    [(_, parts)] = result
+    assert [(width, height) for width, height, _, _ in parts] == [(100, 300), (100, 300)]
+
+def test_evicted_page_is_rendered_again(tmp_path, rendered, monkeypatch):
+    cache = PageCache(str(tmp_path))
+    extract(cache, [(0, 100)])
+    # Entry removed between the lookup and the read
+    monkeypatch.setattr(PageCache, 'get_parts', lambda self, key: None)
+    result, stats = extract(cache, [(0, 100)])
+    assert rendered == [(0, 100), (0, 100)]
+    assert stats['page_cache_misses'] == 1 and len(result) == 1
+
+def test_reuse_cached_pages():
+    plan = [('raster', 100, None), ('raster', 100, None), ('vector', None, None), ('raster', 100, None)]
+    cached = {0: [90, 140], 1: [160], 2: [100], 3: [120, 150]}
+    reused = document_processor._reuse_cached_pages(plan, cached)
+    # Only resolutions up to PAGE_CACHE_REUSE_RATIO times finer are used
+    assert [dpi for _, dpi, _ in reused] == [140, 100, None, 120]
+
+def test_failed_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    cache = PageCache(str(tmp_path))
+
+    def full_disk(source, target):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(os, 'replace', full_disk)
+    with pytest.raises(OSError):
+        cache.put_parts(cache.page_key('digest', 0, 100, 'page', IMAGE_FORMAT_FLATE, 85), [(1, 1, (b'x', b''), page_image(0, 10))])
+    assert os.listdir(tmp_path) == []
+
+def test_trim_removes_stale_temporary_files(tmp_path):
+    cache = PageCache(str(tmp_path))
+    key = cache.page_key('digest', 0, 100, 'page', IMAGE_FORMAT_FLATE, 85)
+    stale, fresh, other = (os.path.join(str(tmp_path), name) for name in (
+        f"{key}.page.0badc0de.part", f"{key}.page.1badc0de.part", 'download.pdf.2badc0de.part'
+    ))
+    for path in (stale, fresh, other):
+        open(path, 'wb').close()
+    timestamp = time.time() - result_cache.PART_GRACE - 1
+    for path in (stale, other):
+        os.utime(path, (timestamp, timestamp))
+
+    cache.trim()
+    # Only old temporary files of the cache's own entries are removed
+    assert [os.path.exists(path) for path in (stale, fresh, other)] == [False, True, True]
+
+def test_extracts_survive_a_failed_cache_write(tmp_path, rendered, monkeypatch):
+    cache = PageCache(str(tmp_path))
+
+    def full_disk(self, key, parts):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(PageCache, 'put_parts', full_disk)
+    result, stats = extract(cache, [(0, 100), (1, 100)])
+    assert [page_num for page_num, _ in result] == [0, 1]
+    assert stats['page_cache_misses'] == 2
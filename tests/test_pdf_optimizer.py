@@ -0,0 +1,107 @@
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from pdf_optimizer import optimize_pdf
+
+fitz = pytest.importorskip('fitz')
+
+PAGE_SIZE = (300, 400)
+
+def make_image(size):
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((size[0] // 10, size[1] // 10, size[0] // 2, size[1] // 2), fill=(200, 30, 30))
+    draw.ellipse((size[0] // 3, size[1] // 3, size[0] - 10, size[1] - 10), fill=(20, 40, 220))
+    return img
+
+def write_document(path, img, draw_size, pages=2):
+    # Uncompressed document with text and the same image on every page
+    c = canvas.Canvas(path, pagesize=PAGE_SIZE, pageCompression=0)
+    for page_num in range(pages):
+        c.setFont('Helvetica', 14)
+        c.drawString(20, 370, f"Page {page_num + 1}")
+        c.drawImage(ImageReader(img), 20, 20, *draw_size)
+        c.showPage()
+    c.save()
+
+@pytest.fixture
+def merged_pdf(tmp_path):
+    # Two documents merged by PyPDF2 keep their own copies of the image
+    # and the font, which the optimizer should store once
+    img = make_image((150, 200))
+    parts = [str(tmp_path / 'a.pdf'), str(tmp_path / 'b.pdf')]
+    for part in parts:
+        write_document(part, img, (150, 200))
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(part)
+    path = str(tmp_path / 'merged.pdf')
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+def render(path):
+    pages = []
+    for page in fitz.open(path):
+        pix = page.get_pixmap(dpi=72)
+        pages.append(Image.frombytes('RGB', (pix.width, pix.height), pix.samples))
+    return pages
+
+def max_difference(a, b):
+    return max(high for _, high in ImageChops.difference(a, b).getextrema())
+
+@pytest.mark.parametrize('object_streams', [True, False])
+def test_optimize_round_trip(tmp_path, merged_pdf, object_streams):
+    output = str(tmp_path / 'out.pdf')
+    report = optimize_pdf(merged_pdf, output, {'object_streams': object_streams})
+
+    assert report['objects_merged'] > 0
+    assert report['streams_compressed'] > 0
+    assert report['bytes_after'] < report['bytes_before']
+    assert report['bytes_saved'] == report['bytes_before'] - report['bytes_after']
+
+    data = open(output, 'rb').read()
+    assert (b'/ObjStm' in data) == object_streams
+    assert data.startswith(b'%PDF-1.5' if object_streams else b'%PDF-1.')
+
+    reader = PdfReader(output)
+    assert len(reader.pages) == len(PdfReader(merged_pdf).pages) == 4
+    assert reader.pages[2].extract_text().strip() == 'Page 1'
+
+    # Nothing is downsampled here, so the pages render exactly as before
+    before, after = render(merged_pdf), render(output)
+    assert len(after) == 4
+    for page_before, page_after in zip(before, after):
+        assert max_difference(page_before, page_after) == 0
+
+def test_optimize_downsamples_images(tmp_path):
+    # 900x1200 pixels drawn on 150x200 points is 432 dpi
+    source, output = str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf')
+    write_document(source, make_image((900, 1200)), (150, 200), pages=1)
+    report = optimize_pdf(source, output, {'downsample_dpi': 150})
+
+    assert report['images_downsampled'] == 1
+    assert report['bytes_after'] < report['bytes_before']
+    document = fitz.open(output)
+    width, height = fitz.Pixmap(document, document[0].get_images()[0][0]).irect[2:]
+    assert (width, height) == (312, 417)
+
+    before, after = render(source)[0], render(output)[0]
+    assert max(ImageStat.Stat(ImageChops.difference(before, after)).mean) < 2
+
+def test_optimize_keeps_fine_images_below_threshold(tmp_path):
+    # 200x267 pixels on 150x200 points is 96 dpi, below the target
+    source, output = str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf')
+    write_document(source, make_image((200, 267)), (150, 200), pages=1)
+    report = optimize_pdf(source, output, {'downsample_dpi': 150})
+    assert report['images_downsampled'] == 0
+
+def test_optimize_keeps_larger_result(tmp_path, merged_pdf):
+    # Optimizing an optimized file saves nothing and leaves a copy of it
+    first, second = str(tmp_path / 'first.pdf'), str(tmp_path / 'second.pdf')
+    optimize_pdf(merged_pdf, first)
+    report = optimize_pdf(first, second, {'object_streams': False, 'dedup': False, 'compress': False})
+    assert report['bytes_saved'] == 0
+    assert open(second, 'rb').read() == open(first, 'rb').read()
@@ -0,0 +1,105 @@
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+from PyPDF2 import PdfReader
+from pdf_output import IMAGE_FORMAT_FLATE, IMAGE_FORMAT_JPEG, CanvasOutput, StreamingOutput, encode_image, open_output
+
+fitz = pytest.importorskip('fitz')
+
+PAGE_SIZE = (300, 400)
+# Images are drawn 1:1 at this position, from the bottom-left corner
+POSITION = (20, 30)
+
+def make_image(mode='RGB', size=(120, 160)):
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((10, 10, 60, 80), fill=(200, 30, 30))
+    draw.ellipse((50, 60, 110, 150), fill=(20, 40, 220))
+    return img.convert(mode)
+
+def render(path, page_num=0):
+    # Page as an RGB image at 72 dpi (one pixel per point)
+    pix = fitz.open(path)[page_num].get_pixmap(dpi=72)
+    return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+def placed(img):
+    # The page an image drawn at POSITION should render to
+    page = Image.new('RGB', PAGE_SIZE, 'white')
+    page.paste(img.convert('RGB'), (POSITION[0], PAGE_SIZE[1] - POSITION[1] - img.height))
+    return page
+
+def max_difference(a, b):
+    return max(high for _, high in ImageChops.difference(a, b).getextrema())
+
+def mean_difference(a, b):
+    return max(ImageStat.Stat(ImageChops.difference(a, b)).mean)
+
+def write_pages(output, images):
+    for img in images:
+        output.draw_image(img, *POSITION, img.width, img.height)
+        output.show_page()
+    output.close()
+
+@pytest.mark.parametrize('streaming', [False, True])
+@pytest.mark.parametrize('image_format', [IMAGE_FORMAT_FLATE, IMAGE_FORMAT_JPEG])
+@pytest.mark.parametrize('mode', ['RGB', 'L'])
+def test_output_round_trip(tmp_path, streaming, image_format, mode):
+    path = str(tmp_path / 'out.pdf')
+    images = [make_image(mode), make_image(mode, (80, 60))]
+    output = open_output(path, PAGE_SIZE, streaming=streaming, image_format=image_format)
+    assert isinstance(output, StreamingOutput if streaming else CanvasOutput)
+    write_pages(output, images)
+
+    reader = PdfReader(path)
+    assert len(reader.pages) == output.page_count == 2
+    assert [float(value) for value in reader.pages[0].mediabox] == [0, 0, *PAGE_SIZE]
+
+    assert fitz.open(path).page_count == 2
+    # Lossless images render exactly, JPEG within its quantization error
+    for page_num, img in enumerate(images):
+        if image_format == IMAGE_FORMAT_FLATE:
+            assert max_difference(render(path, page_num), placed(img)) == 0
+        else:
+            assert mean_difference(render(path, page_num), placed(img)) < 2
+
+def test_streaming_output_xref_offsets(tmp_path):
+    path = str(tmp_path / 'out.pdf')
+    write_pages(StreamingOutput(path, PAGE_SIZE), [make_image(), make_image('L')])
+
+    data = open(path, 'rb').read()
+    start = int(data.rsplit(b'startxref', 1)[1].split()[0])
+    assert data[start:start + 4] == b'xref'
+    lines = data[start:].split(b'\n')
+    count = int(lines[1].split()[1])
+    # Every entry points at the start of its own object
+    for obj_id in range(1, count):
+        offset = int(lines[2 + obj_id].split()[0])
+        assert data[offset:].startswith(b'%d 0 obj' % obj_id)
+
+@pytest.mark.parametrize('mode', ['RGB', 'L'])
+def test_flate_image_decodes_to_its_samples(tmp_path, mode):
+    path = str(tmp_path / 'out.pdf')
+    img = make_image(mode)
+    write_pages(StreamingOutput(path, PAGE_SIZE), [img])
+
+    # The predictor-filtered IDAT payload decodes back to the exact samples
+    document = fitz.open(path)
+    xref = document[0].get_images()[0][0]
+    pix = fitz.Pixmap(document, xref)
+    assert (pix.width, pix.height, pix.n) == (*img.size, len(mode))
+    assert pix.samples == img.tobytes()
+
+def test_draw_encoded_image_matches_draw_image(tmp_path):
+    img = make_image()
+    direct, encoded = str(tmp_path / 'direct.pdf'), str(tmp_path / 'encoded.pdf')
+    write_pages(StreamingOutput(direct, PAGE_SIZE), [img])
+
+    output = StreamingOutput(encoded, PAGE_SIZE)
+    output.draw_encoded_image(encode_image(img, IMAGE_FORMAT_FLATE), *POSITION, img.width, img.height)
+    output.show_page()
+    output.close()
+
+    assert max_difference(render(direct), render(encoded)) == 0
+
+def test_open_output_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        open_output(str(tmp_path / 'out.pdf'), PAGE_SIZE, image_format='png')
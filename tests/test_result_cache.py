@@ -0,0 +1,62 @@
+import os
+import hashlib
+import time
+from result_cache import ResultCache, CACHE_SUFFIX, file_digest
+
+def write_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+def age(cache, key, seconds):
+    # Make an entry look last used `seconds` ago
+    timestamp = time.time() - seconds
+    os.utime(cache.path(key), (timestamp, timestamp))
+
+def test_key_depends_on_content_and_parameters(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = cache.key('abc', {'margins': {'top': 1, 'left': 2}, 'engine': 'vector'})
+    assert key == cache.key('abc', {'engine': 'vector', 'margins': {'left': 2, 'top': 1}})
+    assert key != cache.key('abd', {'engine': 'vector', 'margins': {'left': 2, 'top': 1}})
+    assert key != cache.key('abc', {'engine': 'raster', 'margins': {'left': 2, 'top': 1}})
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get('a') is None
+    source = write_file(tmp_path / 'output.pdf', 10)
+    path = cache.put('a', source)
+    assert path.endswith(CACHE_SUFFIX) and not os.path.exists(source)
+    assert cache.get('a') == path
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5, 'entries': 1, 'bytes': 10, 'max_bytes': cache.max_bytes}
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=250)
+    cache.put('a', write_file(tmp_path / 'a.pdf', 100))
+    cache.put('b', write_file(tmp_path / 'b.pdf', 100))
+    age(cache, 'a', 100)
+    age(cache, 'b', 90)
+
+    # A hit makes the oldest entry the most recently used one
+    assert cache.get('a')
+    cache.put('c', write_file(tmp_path / 'c.pdf', 100))
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+    assert cache.stats()['bytes'] == 200
+
+def test_new_entry_is_kept_even_if_too_large(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=50)
+    cache.put('a', write_file(tmp_path / 'a.pdf', 40))
+    path = cache.put('b', write_file(tmp_path / 'b.pdf', 100))
+    assert os.path.exists(path)
+    assert cache.get('a') is None
+
+def test_other_files_are_not_entries(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10)
+    other = write_file(tmp_path / 'upload.pdf', 100)
+    cache.put('a', write_file(tmp_path / 'a.pdf', 5))
+    assert os.path.exists(other)
+    assert cache.stats()['entries'] == 1
+
+def test_file_digest(tmp_path):
+    path = write_file(tmp_path / 'a.pdf', 3)
+    assert file_digest(path) == hashlib.sha256(b'xxx').hexdigest()
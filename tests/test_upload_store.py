@@ -0,0 +1,46 @@
+import io
+import os
+import hashlib
+import threading
+from upload_store import UploadStore
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = UploadStore(str(tmp_path))
+    first = store.save(io.BytesIO(b'content'), 'a.pdf')
+    second = store.save(io.BytesIO(b'content'), 'b.pdf')
+    assert (first['duplicate'], second['duplicate']) == (False, True)
+    assert second['references'] == 2
+    assert os.path.samefile(first['path'], second['path'])
+    assert store.digest(second['path']) == first['digest']
+    # No temporary file is left behind
+    assert os.listdir(store.blob_folder) == [first['digest']]
+
+def test_concurrent_uploads_of_new_content(tmp_path, monkeypatch):
+    store = UploadStore(str(tmp_path))
+    digest = hashlib.sha256(b'new content').hexdigest()
+    # Both uploads find no blob before either has created it
+    barrier = threading.Barrier(2)
+    link = os.link
+
+    def racing_link(source, target):
+        if source == store.blob_path(digest) and not os.path.exists(source):
+            barrier.wait(5)
+            raise FileNotFoundError(source)
+        return link(source, target)
+
+    monkeypatch.setattr(os, 'link', racing_link)
+    results = []
+    threads = [
+        threading.Thread(target=lambda name=name: results.append(store.save(io.BytesIO(b'new content'), name)))
+        for name in ('a.pdf', 'b.pdf')
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(result['duplicate'] for result in results) == [False, True]
+    # Both uploads are links to the one blob
+    for result in results:
+        assert os.path.samefile(result['path'], store.blob_path(digest))
+    assert os.stat(store.blob_path(digest)).st_nlink == 3
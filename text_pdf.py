@@ -0,0 +1,357 @@
+import io
+import time
+import logging
+import functools
+import itertools
+import collections
+from reportlab.lib.pagesizes import A4, A5
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import ActionFlowable, FrameBreak, Paragraph, SimpleDocTemplate, Spacer
+from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
+from reportlab.lib.units import inch
+from reportlab.pdfbase import pdfmetrics
+from reportlab.platypus.doctemplate import BaseDocTemplate, PageTemplate
+from reportlab.platypus.frames import Frame
+from metrics import timed
+
+# Plain text to PDF rendering with reportlab platypus, in one or two
+# columns. document_processor loads this module on the first text job.
+
+# Constants for page sizes (in points)
+A4_WIDTH, A4_HEIGHT = A4  # 595.276, 841.89 points
+A5_WIDTH, A5_HEIGHT = A5  # 419.528, 595.276 points
+
+# Text rendering reads and lays out this many flowables at a time, so only
+# one batch of paragraphs is held in memory however long the text is
+TEXT_BATCH_SIZE = 256
+
+# Text layouts (page size, styles and columns) memoized by their options
+TEXT_LAYOUT_CACHE_SIZE = 64
+TextLayout = collections.namedtuple('TextLayout', 'page_size body_style title_style title_gap columns')
+
+def iter_paragraphs(source):
+    """
+    Yield the paragraphs of a text, separated by blank lines
+
+    source may be a string or any iterable of lines, such as an open text
+    file, which is then read as the paragraphs are consumed.
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source)
+
+    lines = []
+    for line in source:
+        if line.strip():
+            lines.append(line.rstrip('\r\n'))
+        elif lines:
+            yield '\n'.join(lines)
+            lines = []
+    if lines:
+        yield '\n'.join(lines)
+
+class _FlowableStream(list):
+    """
+    Flowables list that refills itself from an iterator
+
+    reportlab's build() consumes its list of flowables from the front and
+    checks len() before each one; topping the list up there keeps about
+    batch_size flowables alive at a time, and the first pages are laid
+    out before the rest of the input has been read.
+    """
+
+    def __init__(self, flowables, batch_size=TEXT_BATCH_SIZE):
+        super().__init__()
+        self.source = iter(flowables)
+        self.batch_size = max(2, batch_size)
+        self.consumed = 0
+
+    def __len__(self):
+        if list.__len__(self) < self.batch_size // 2:
+            self.fill()
+        return list.__len__(self)
+
+    def fill(self):
+        """
+        Read the next batch from the iterator; returns False once it is exhausted
+        """
+        if self.source is None:
+            return False
+        batch = list(itertools.islice(self.source, self.batch_size))
+        if len(batch) < self.batch_size:
+            self.source = None
+        self.consumed += len(batch)
+        self.extend(batch)
+        return bool(batch)
+
+def _balance_columns(flowables, width, height, columns=2):
+    """
+    Split the last page of a multi-column layout into columns of equal height
+
+    Called at the top of each page with the flowables still to be laid
+    out. If they fit on this page, a FrameBreak is inserted where the first
+    column reaches half their height, splitting the paragraph there if
+    needed. Only about a page of flowables is examined per call: a cheap
+    lower bound (one line per paragraph) rules out pages that are not the
+    last, and only then are the heights measured with wrap(), up to a
+    page's worth. Returns True if a break was inserted.
+    """
+    limit = height * columns
+    fill = getattr(flowables, 'fill', lambda: False)
+
+    # Lower bound of the remaining height, reading ahead as needed
+    bound = 0
+    count = 0
+    while True:
+        if count == list.__len__(flowables) and not fill():
+            break
+        flowable = flowables[count]
+        if isinstance(flowable, ActionFlowable):
+            # Explicit breaks are left alone
+            return False
+        if isinstance(flowable, Paragraph):
+            bound += flowable.style.leading
+        elif isinstance(flowable, Spacer):
+            bound += flowable.height
+        if bound > limit:
+            return False
+        count += 1
+
+    # Measure the rest, giving up as soon as it overflows the page
+    heights = []
+    total = 0
+    for flowable in flowables[:count]:
+        _, flowable_height = flowable.wrap(width, height)
+        heights.append(flowable_height + flowable.getSpaceAfter())
+        total += heights[-1]
+        if total > limit:
+            return False
+    if count < 2:
+        return False
+
+    # Find the flowable that crosses half the height
+    target = total / 2
+    above = 0
+    for index, flowable_height in enumerate(heights):
+        if above + flowable_height > target:
+            break
+        above += flowable_height
+
+    # Candidate breaks: (first column height, flowables replacing flowables[index])
+    candidates = [(above, [FrameBreak(), flowables[index]])]
+    candidates.append((above + heights[index], [flowables[index], FrameBreak()]))
+    flowable = flowables[index]
+    if isinstance(flowable, Paragraph):
+        # Round up to whole lines so the first column is the longer one
+        parts = flowable.split(width, target - above + flowable.style.leading)
+        if len(parts) == 2:
+            candidates.append((above + parts[0].wrap(width, height)[1], [parts[0], FrameBreak(), parts[1]]))
+
+    fitting = [
+        (max(first, total - first), replacement) for first, replacement in candidates
+        if first <= height and total - first <= height
+    ]
+    if not fitting:
+        return False
+
+    _, replacement = min(fitting, key=lambda candidate: candidate[0])
+    flowables[index:index + 1] = replacement
+
+    # A paragraph gap carried to the top of the next column is dropped
+    after = index + len(replacement)
+    if isinstance(replacement[-1], ActionFlowable) and after < list.__len__(flowables) and isinstance(flowables[after], Spacer):
+        del flowables[after]
+    return True
+
+@functools.lru_cache(maxsize=TEXT_LAYOUT_CACHE_SIZE)
+def get_text_layout(font_size=12, text_style="normal", text_layout="single", margins=(0.5, 0.5, 0.5, 0.5), orientation='portrait'):
+    """
+    Return the page size, styles and columns of a text rendering
+
+    margins is a (top, right, bottom, left) tuple in inches. Layouts are
+    memoized by their arguments (up to TEXT_LAYOUT_CACHE_SIZE of them), so
+    repeated renderings with the same options skip building the style
+    sheet; the metrics of their fonts are loaded on the first use.
+    """
+    top, right, bottom, left = margins
+
+    # In two-column layout, we use A4 instead of A5 to accommodate two A5 columns side by side
+    if text_layout == "double":
+        page_size = A4 if orientation == 'portrait' else (A4[1], A4[0])
+    else:
+        page_size = A5 if orientation == 'portrait' else (A5_HEIGHT, A5_WIDTH)
+
+    # Set styles
+    styles = getSampleStyleSheet()
+
+    # Create a custom paragraph style based on the text style
+    if text_style == "justified":
+        alignment = TA_JUSTIFY
+    elif text_style == "centered":
+        alignment = TA_CENTER
+    else:  # normal
+        alignment = TA_LEFT
+
+    body_style = ParagraphStyle(
+        'CustomStyle',
+        parent=styles['Normal'],
+        fontSize=font_size,
+        alignment=alignment,
+        leading=font_size * 1.2  # Line height
+    )
+
+    # Create the title style
+    title_style = ParagraphStyle(
+        'Title',
+        parent=styles['Heading1'],
+        fontSize=font_size + 4,
+        alignment=TA_CENTER,
+        spaceAfter=font_size * 2
+    )
+
+    for style in (body_style, title_style):
+        pdfmetrics.getFont(style.fontName)
+
+    columns = ()
+    if text_layout == "double":
+        # Two columns (approximately A5 wide each) with a 20pt gutter
+        column_width = (page_size[0] - (left + right) * inch - 20) / 2
+        column_height = page_size[1] - (top + bottom) * inch
+        columns = tuple(
+            (left * inch + index * (column_width + 20), bottom * inch, column_width, column_height)
+            for index in range(2)
+        )
+
+    return TextLayout(
+        page_size=page_size,
+        body_style=body_style,
+        title_style=title_style,
+        title_gap=font_size * (1.5 if text_layout == "double" else 0.5),
+        columns=columns
+    )
+
+class TwoColumnDocTemplate(BaseDocTemplate):
+    """
+    Document with the two column frames of a text layout and page numbers
+
+    With balance_columns, the columns of the last page are balanced to
+    equal heights (see _balance_columns).
+    """
+
+    def __init__(self, filename, layout, balance_columns=True, **kwargs):
+        BaseDocTemplate.__init__(self, filename, pagesize=layout.page_size, **kwargs)
+
+        # Define the frames (columns)
+        frames = [
+            Frame(x, y, width, height, leftPadding=3, rightPadding=3, bottomPadding=3, topPadding=3, id=f"column{index + 1}")
+            for index, (x, y, width, height) in enumerate(layout.columns)
+        ]
+
+        # Space available to the flowables of a column
+        _, _, width, height = layout.columns[0]
+        self.column_size = (width - 6, height - 6)
+        self.balance_columns = balance_columns
+        self.balanced_pages = 0
+        self._checked_page = None
+
+        self.addPageTemplates(PageTemplate('two_columns', frames, onPage=self.add_page_number))
+
+    def filterFlowables(self, flowables):
+        # At the top of each page, balance the columns if the rest of the
+        # text ends on it (reportlab also passes its own list of pending
+        # page actions here)
+        if flowables is self._hanging or not self.balance_columns:
+            return
+        if self.page != self._checked_page and self.frame.id == 'column1' and self.frame._atTop:
+            self._checked_page = self.page
+            if _balance_columns(flowables, *self.column_size):
+                self.balanced_pages += 1
+
+    def add_page_number(self, canvas, doc):
+        canvas.drawCentredString(self.pagesize[0] / 2, self.bottomMargin / 3, str(canvas.getPageNumber()))
+
+def create_pdf_from_text(text, output_file, title="", font_size=12, text_style="normal", text_layout="single", margins=None, orientation='portrait', stats=None, balance_columns=True, optimize=None):
+    """
+    Create a PDF document from plain text
+    
+    text may be a string or an iterable of lines (e.g. an open .txt file);
+    paragraphs are read and laid out in batches of TEXT_BATCH_SIZE, so
+    memory does not grow with the length of the text.
+    
+    text_layout options:
+    - 'single': Normal single column layout
+    - 'double': Two-column layout
+
+    In the two-column layout text flows from one column into the next,
+    splitting paragraphs where a column ends, and the columns of the last
+    page are balanced to equal heights. With balance_columns=False a column
+    break follows every third paragraph instead (the former layout). If a
+    stats dict is given, the number of pages produced is stored in it.
+    optimize is the same as for document_processor.resize_pdf_to_a5 and
+    applies when output_file is a path.
+    """
+    try:
+        if stats is None:
+            stats = {}
+        start = time.perf_counter()
+
+        # Set default margins if not provided
+        if margins is None:
+            margins = {'top': 0.5, 'right': 0.5, 'bottom': 0.5, 'left': 0.5}
+
+        # Page size, styles and columns are shared by renderings with the same options
+        layout = get_text_layout(
+            font_size, text_style, text_layout,
+            (margins['top'], margins['right'], margins['bottom'], margins['left']), orientation
+        )
+        page_margins = {
+            'leftMargin': margins['left'] * inch,
+            'rightMargin': margins['right'] * inch,
+            'topMargin': margins['top'] * inch,
+            'bottomMargin': margins['bottom'] * inch
+        }
+
+        # Create a PDF document
+        if text_layout == "double":
+            doc = TwoColumnDocTemplate(output_file, layout, balance_columns, **page_margins)
+        else:
+            doc = SimpleDocTemplate(output_file, pagesize=layout.page_size, **page_margins)
+
+        # Paragraphs are read lazily, as the layout needs them
+        paragraphs = iter_paragraphs(text)
+
+        def story():
+            # Add title if provided
+            if title:
+                yield Paragraph(title, layout.title_style)
+                yield Spacer(1, layout.title_gap)
+
+            # Process paragraphs
+            for i, para in enumerate(paragraphs):
+                if i > 0:
+                    # Add space between paragraphs
+                    yield Spacer(1, font_size * 0.5)
+
+                    # Former two-column layout: a column break every few paragraphs
+                    if text_layout == "double" and not balance_columns and i % 3 == 0:
+                        yield FrameBreak()
+
+                yield Paragraph(para.replace('\n', '<br/>'), layout.body_style)
+
+        # Build the document, feeding the flowables in batches
+        flowables = _FlowableStream(story())
+        with timed(stats, 'layout'):
+            doc.build(flowables)
+        
+        stats['flowables'] = flowables.consumed
+        stats['pages_out'] = doc.page
+        if text_layout == "double":
+            stats['balanced_pages'] = doc.balanced_pages
+        if optimize and isinstance(output_file, str):
+            from pdf_optimizer import optimize_output
+            optimize_output(output_file, optimize, stats)
+        stats['wall_time'] = round(time.perf_counter() - start, 4)
+        return True
+    
+    except Exception as e:
+        logging.error(f"Error creating PDF from text: {str(e)}")
+        return False
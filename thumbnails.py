@@ -0,0 +1,99 @@
+import os
+import uuid
+from result_cache import ResultCache
+
+# Thumbnail widths in pixels that may be requested; the first is the default
+THUMBNAIL_WIDTHS = (240, 480)
+THUMBNAIL_WIDTH = THUMBNAIL_WIDTHS[0]
+THUMBNAIL_SUFFIX = '.webp'
+THUMBNAIL_QUALITY = 70
+
+def compose_thumbnail(img, page_size, box, width=THUMBNAIL_WIDTH):
+    """
+    Draw an image onto a white page, as it is placed on the output page
+
+    page_size is (width, height) and box is (x, y, width, height) of the
+    image on the page, in points from the bottom-left corner like PDF
+    coordinates. Returns the page as an RGB image `width` pixels wide.
+    """
+    from PIL import Image
+
+    page_width, page_height = page_size
+    scale = width / page_width
+    thumbnail = Image.new('RGB', (width, max(1, round(page_height * scale))), 'white')
+
+    x, y, box_width, box_height = box
+    size = (max(1, round(box_width * scale)), max(1, round(box_height * scale)))
+    part = img.convert('RGB')
+    part.thumbnail(size)
+    thumbnail.paste(part, (round(x * scale), round((page_height - y - box_height) * scale)))
+    return thumbnail
+
+def save_thumbnail(img, path, width=THUMBNAIL_WIDTH):
+    """
+    Save an image as a WebP thumbnail at path, scaled down to width pixels
+
+    The file is written under a temporary name and renamed, so readers never
+    see a partial thumbnail.
+    """
+    from PIL import Image
+
+    if img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        img.convert('RGB').save(temp_path, format='WEBP', quality=THUMBNAIL_QUALITY)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+class ThumbnailCache(ResultCache):
+    """
+    Disk cache of low-resolution page thumbnails of processed documents
+
+    A thumbnail is keyed by the document file name, the page number and the
+    width. Missing thumbnails are rendered on request; the raster engine
+    can also write them while it processes a document (see template()).
+    The least recently used thumbnails are evicted beyond max_bytes.
+    """
+
+    def __init__(self, folder, max_bytes=256 * 1024 * 1024):
+        os.makedirs(folder, exist_ok=True)
+        super().__init__(folder, max_bytes, suffix=THUMBNAIL_SUFFIX)
+
+    def page_key(self, filename, page, width=THUMBNAIL_WIDTH):
+        return f"{os.path.splitext(filename)[0]}_p{page}_w{width}"
+
+    def template(self, filename, width=THUMBNAIL_WIDTH):
+        """
+        Return the thumbnail path of every page of filename, with a {page} field
+        """
+        return self.path(self.page_key(filename, '{page}', width))
+
+    def get_or_render(self, pdf_path, page, width=THUMBNAIL_WIDTH):
+        """
+        Return the thumbnail path of a page (1-based), rendering it on a miss
+
+        Returns None if the document has no such page.
+        """
+        key = self.page_key(os.path.basename(pdf_path), page, width)
+        path = self.get(key)
+        if path:
+            return path
+
+        from pdf2image import convert_from_path
+
+        images = convert_from_path(pdf_path, first_page=page, last_page=page, size=(width, None))
+        if not images:
+            return None
+
+        save_thumbnail(images[0], self.path(key), width)
+        self.trim()
+        return self.path(key)
+
+    def trim(self):
+        """
+        Evict the least recently used thumbnails until the cache fits
+        """
+        self._evict()
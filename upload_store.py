@@ -0,0 +1,406 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+# Uploaded content is stored once per SHA-256 digest in the blob folder;
+# every upload is a hard link to its blob, so the link count of a blob is
+# its reference count (plus one for the blob itself)
+BLOB_FOLDER = 'blobs'
+
+# Chunked uploads in progress, one folder per upload
+CHUNK_FOLDER = 'chunks'
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+class UploadError(Exception):
+    """
+    Raised for invalid or unknown chunked uploads
+    """
+
+class UploadStore:
+    """
+    Deduplicating store for uploaded files
+
+    Files are hashed while they are written, so they are read only once.
+    Identical content is kept as a single blob; each upload gets its own
+    path (a hard link to the blob) that can be used like a regular file.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.blob_folder = os.path.join(folder, BLOB_FOLDER)
+        os.makedirs(self.blob_folder, exist_ok=True)
+
+    def save(self, stream, filename, chunk_size=1024 * 1024):
+        """
+        Store the content of a binary stream and return the upload info
+
+        Returns a dict with the upload path, the content digest and size,
+        whether the content was already stored and its reference count.
+        """
+        digest = hashlib.sha256()
+        size = 0
+
+        # Write to a temporary file while hashing the stream
+        temp_path = os.path.join(self.blob_folder, f".{uuid.uuid4().hex}.part")
+        try:
+            with open(temp_path, 'wb') as f:
+                for block in iter(lambda: stream.read(chunk_size), b''):
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+
+            content_digest = digest.hexdigest()
+            upload_path = os.path.join(self.folder, f"{content_digest}_{uuid.uuid4().hex[:8]}_{filename}")
+            blob_path = self.blob_path(content_digest)
+
+            try:
+                # Same content already stored: just add a reference, and
+                # refresh the age shared by all links to the content
+                os.link(blob_path, upload_path)
+                os.utime(blob_path)
+                duplicate = True
+            except FileNotFoundError:
+                # New content: link (rather than rename) the temporary file
+                # as the blob, so of two uploads of the same new content
+                # only one creates it and the other becomes a reference
+                try:
+                    os.link(temp_path, blob_path)
+                    duplicate = False
+                except FileExistsError:
+                    os.utime(blob_path)
+                    duplicate = True
+                os.link(blob_path, upload_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return {
+            'path': upload_path,
+            'digest': content_digest,
+            'size': size,
+            'duplicate': duplicate,
+            'references': os.stat(blob_path).st_nlink - 1
+        }
+
+    def blob_path(self, content_digest):
+        return os.path.join(self.blob_folder, content_digest)
+
+    def digest(self, upload_path):
+        """
+        Return the content digest of an upload without reading it, or None
+
+        None is returned for paths that are not uploads of this store.
+        """
+        name = os.path.basename(upload_path)
+        content_digest = name.split('_', 1)[0]
+        if os.path.dirname(os.path.abspath(upload_path)) != os.path.abspath(self.folder) or len(content_digest) != 64:
+            return None
+        try:
+            if os.path.samefile(upload_path, self.blob_path(content_digest)):
+                return content_digest
+        except FileNotFoundError:
+            pass
+        return None
+
+    def cleanup(self, ttl, max_bytes=None, orphan_grace=60):
+        """
+        Remove uploads older than ttl seconds, then unreferenced blobs
+
+        If max_bytes is given, the oldest uploads are also removed until the
+        stored content fits. Returns the number of files removed.
+        """
+        removed = 0
+        now = time.time()
+
+        uploads = []
+        for entry in os.scandir(self.folder):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime < now - ttl:
+                removed += _remove(entry.path)
+            else:
+                uploads.append((stat.st_mtime, entry.path, stat.st_ino))
+
+        blobs = self._blobs()
+        if max_bytes is not None:
+            # Drop the oldest references until the content fits
+            total = sum(size for size, _, _ in blobs.values())
+            for _, path, inode in sorted(uploads):
+                if total <= max_bytes:
+                    break
+                removed += _remove(path)
+                blob = blobs.get(inode)
+                if blob is not None:
+                    size, blob_path, links = blob
+                    blobs[inode] = (size, blob_path, links - 1)
+                    if links - 1 <= 1:
+                        total -= size
+
+        # Blobs only linked from the blob folder have no uploads left
+        for inode, (size, blob_path, links) in blobs.items():
+            if links <= 1:
+                try:
+                    if os.stat(blob_path).st_nlink <= 1 and os.path.getmtime(blob_path) < now - orphan_grace:
+                        removed += _remove(blob_path)
+                except FileNotFoundError:
+                    pass
+
+        return removed
+
+    def _blobs(self):
+        # inode -> (size, path, link count) of every blob
+        blobs = {}
+        for entry in os.scandir(self.blob_folder):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            blobs[stat.st_ino] = (stat.st_size, entry.path, stat.st_nlink)
+        return blobs
+
+class ChunkedUploads:
+    """
+    Resumable uploads sent as numbered chunks
+
+    start() opens an upload of a known size, split into fixed-size chunks.
+    Chunks can be sent in any order and re-sent; each is written to its own
+    file, so an interrupted upload resumes by sending the chunks missing
+    from status(). complete() streams the chunks in order into the
+    UploadStore and checks the size and, if given, the SHA-256 of the
+    whole file. State lives on disk, so any server process can take the
+    next chunk.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.folder = os.path.join(store.folder, CHUNK_FOLDER)
+        os.makedirs(self.folder, exist_ok=True)
+
+    def start(self, filename, size, chunk_size=DEFAULT_CHUNK_SIZE, sha256=None):
+        """
+        Open an upload and return its info (upload_id, chunk_size, chunks)
+        """
+        if size < 0 or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise UploadError("Invalid upload size or chunk size")
+
+        upload_id = uuid.uuid4().hex
+        info = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'chunk_size': chunk_size,
+            'chunks': max(1, -(-size // chunk_size)),
+            'sha256': sha256.lower() if sha256 else None
+        }
+        os.makedirs(self._path(upload_id))
+        with open(os.path.join(self._path(upload_id), 'upload.json'), 'w') as f:
+            json.dump(info, f)
+        return info
+
+    def info(self, upload_id):
+        try:
+            with open(os.path.join(self._path(upload_id), 'upload.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            raise UploadError("Upload not found")
+
+    def status(self, upload_id):
+        """
+        Return the upload info with the indexes of the chunks received so far
+        """
+        info = self.info(upload_id)
+        info['received'] = sorted(
+            int(name[:-len('.chunk')]) for name in os.listdir(self._path(upload_id)) if name.endswith('.chunk')
+        )
+        return info
+
+    def write_chunk(self, upload_id, index, stream, sha256=None, block_size=1024 * 1024):
+        """
+        Store chunk number index (0-based) from a binary stream
+
+        The chunk must have its exact expected size; if sha256 is given the
+        chunk content must match it.
+        """
+        info = self.info(upload_id)
+        if not 0 <= index < info['chunks']:
+            raise UploadError("Invalid chunk index")
+        expected = min(info['chunk_size'], info['size'] - index * info['chunk_size'])
+
+        digest = hashlib.sha256()
+        size = 0
+        chunk_path = os.path.join(self._path(upload_id), f"{index}.chunk")
+        temp_path = f"{chunk_path}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            with open(temp_path, 'wb') as f:
+                for block in iter(lambda: stream.read(block_size), b''):
+                    size += len(block)
+                    if size > expected:
+                        raise UploadError("Chunk is larger than expected")
+                    digest.update(block)
+                    f.write(block)
+
+            if size != expected:
+                raise UploadError(f"Chunk has {size} bytes, expected {expected}")
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise UploadError("Chunk checksum mismatch")
+
+            # Re-sent chunks simply replace the previous copy
+            os.replace(temp_path, chunk_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return size
+
+    def complete(self, upload_id):
+        """
+        Assemble a fully received upload into the store and return its info
+
+        Returns the same dict as UploadStore.save(), plus the filename.
+        """
+        info = self.status(upload_id)
+        missing = sorted(set(range(info['chunks'])) - set(info['received']))
+        if missing:
+            raise UploadError(f"Missing chunks: {missing[:10]}")
+
+        paths = [os.path.join(self._path(upload_id), f"{index}.chunk") for index in range(info['chunks'])]
+        with _ChunkReader(paths) as stream:
+            stored = self.store.save(stream, info['filename'])
+
+        if info['sha256'] and stored['digest'] != info['sha256']:
+            _remove(stored['path'])
+            raise UploadError("File checksum mismatch")
+
+        self.abort(upload_id)
+        stored['filename'] = info['filename']
+        return stored
+
+    def abort(self, upload_id):
+        shutil.rmtree(self._path(upload_id), ignore_errors=True)
+
+    def cleanup(self, ttl):
+        """
+        Remove uploads that received no chunk for ttl seconds
+        """
+        removed = 0
+        limit = time.time() - ttl
+        for entry in os.scandir(self.folder):
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < limit:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def _path(self, upload_id):
+        # Only ids created by start() map to a folder
+        if len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+            raise UploadError("Upload not found")
+        return os.path.join(self.folder, upload_id)
+
+class _ChunkReader:
+    """
+    Read-only stream over chunk files in order
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.current = None
+
+    def read(self, size=-1):
+        while True:
+            if self.current is None:
+                if not self.paths:
+                    return b''
+                self.current = open(self.paths.pop(0), 'rb')
+            data = self.current.read(size)
+            if data:
+                return data
+            self.current.close()
+            self.current = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.current is not None:
+            self.current.close()
+
+def remove_expired_files(folder, ttl, keep_suffix=None):
+    """
+    Remove files in folder older than ttl seconds
+
+    Files ending with keep_suffix are left alone (e.g. cached outputs,
+    which are bounded by their own cache). Returns the number removed.
+    """
+    removed = 0
+    limit = time.time() - ttl
+    for entry in os.scandir(folder):
+        if not entry.is_file() or (keep_suffix and entry.name.endswith(keep_suffix)):
+            continue
+        try:
+            if entry.stat().st_mtime < limit:
+                removed += _remove(entry.path)
+        except FileNotFoundError:
+            pass
+    return removed
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        logging.error(f"Error removing {path}: {str(e)}")
+        return 0
+
+class Janitor:
+    """
+    Background thread running cleanup tasks every `interval` seconds
+
+    Each task is a callable taking no arguments; errors are logged and do
+    not stop the other tasks or later runs.
+    """
+
+    def __init__(self, tasks, interval=600):
+        self.tasks = tasks
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        removed = 0
+        for task in self.tasks:
+            try:
+                removed += task() or 0
+            except Exception as e:
+                logging.error(f"Error running cleanup task: {str(e)}")
+        if removed:
+            logging.info(f"Janitor removed {removed} file(s)")
+        return removed
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
@@ -0,0 +1,486 @@
+import os
+import sys
+import json
+import time
+import atexit
+import queue
+import shutil
+import logging
+import tempfile
+import threading
+import functools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # LibreOffice's Python bindings; only importable with the office's
+    # own Python or when its program folder is on the path
+    import uno
+    import office_client
+except ImportError:
+    uno = office_client = None
+
+# LibreOffice binary, pool size and limits (seconds)
+SOFFICE_BINARY = os.environ.get('SOFFICE_BINARY') or shutil.which('soffice') or shutil.which('libreoffice')
+OFFICE_WORKERS = int(os.environ.get('OFFICE_WORKERS', '1'))
+CONVERSION_TIMEOUT = 120
+STARTUP_TIMEOUT = 30
+
+# Python with the UNO bindings that runs office_client.py when this one
+# has none (found next to soffice or as python3 when not set)
+OFFICE_PYTHON = os.environ.get('OFFICE_PYTHON')
+OFFICE_CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'office_client.py')
+
+# Documents converted per worker call in convert_many
+BATCH_SIZE = 8
+
+# How a worker talks to LibreOffice (see OfficeWorker)
+MODE_UNO = 'uno'
+MODE_CLIENT = 'client'
+MODE_CLI = 'cli'
+
+class ConversionError(Exception):
+    """
+    Raised when a document cannot be converted
+    """
+
+def is_available():
+    return SOFFICE_BINARY is not None
+
+@functools.lru_cache(maxsize=None)
+def office_python(binary=SOFFICE_BINARY):
+    """
+    Return a Python interpreter that can import uno, or None
+
+    LibreOffice's own builds ship one next to soffice; distributions
+    package the bindings for the system python3 instead.
+    """
+    candidates = [OFFICE_PYTHON]
+    if binary:
+        candidates.append(os.path.join(os.path.dirname(os.path.realpath(binary)), 'python'))
+    candidates.append(shutil.which('python3'))
+
+    for candidate in candidates:
+        if not candidate or not os.access(candidate, os.X_OK):
+            continue
+        try:
+            subprocess.run(
+                [candidate, '-c', 'import uno'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=STARTUP_TIMEOUT, check=True
+            )
+            return candidate
+        except (OSError, subprocess.SubprocessError):
+            continue
+    return None
+
+class OfficeWorker:
+    """
+    One warm LibreOffice instance with its own user profile
+
+    The instance runs as a listener on a named pipe and documents are
+    converted over UNO, so the start-up cost is paid once:
+    - 'uno': this Python has the bindings and drives the office directly
+    - 'client': each batch is handed to office_client.py, run by a Python
+      that has them (see office_python), like unoconv does
+    Without any Python with the bindings ('cli') nothing stays running:
+    the profile is initialized once and each batch is converted by a
+    single `soffice --convert-to` call that reuses it.
+    """
+
+    def __init__(self, index, binary=SOFFICE_BINARY):
+        self.index = index
+        self.binary = binary
+        if uno is not None:
+            self.mode = MODE_UNO
+        else:
+            self.python = office_python(binary)
+            self.mode = MODE_CLIENT if self.python else MODE_CLI
+        # Named pipe of the listener, unique per process like the profile,
+        # so pools of several server or batch processes never share an office
+        self.pipe_name = f"office_{os.getpid()}_{index}"
+        self.profile_dir = os.path.join(tempfile.gettempdir(), f"office_profile_{os.getpid()}_{index}")
+        self.process = None
+        self.desktop = None
+        self.conversions = 0
+        self.failures = 0
+        self.restarts = 0
+
+    @property
+    def profile_url(self):
+        return 'file://' + self.profile_dir
+
+    def start(self):
+        if self.mode == MODE_CLI:
+            # Initialize the profile once; later calls start from it warm
+            if not os.path.isdir(self.profile_dir):
+                subprocess.run(
+                    [self.binary, '--headless', '--terminate_after_init', f"-env:UserInstallation={self.profile_url}"],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=STARTUP_TIMEOUT
+                )
+            return
+
+        self.process = subprocess.Popen(
+            [
+                self.binary, '--headless', '--invisible', '--nologo', '--norestore',
+                '--nodefault', '--nolockcheck',
+                f"-env:UserInstallation={self.profile_url}",
+                f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"
+            ],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        if self.mode == MODE_CLIENT:
+            # The client waits for the listener itself
+            try:
+                errors = self._run_client([], STARTUP_TIMEOUT + 10, connect_timeout=STARTUP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                errors = None
+            if errors != []:
+                self.stop()
+                raise ConversionError(f"LibreOffice worker {self.index} did not start")
+            return
+
+        # Wait for the listener, then connect to its desktop
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            try:
+                self.desktop = office_client.connect(self.pipe_name)
+                return
+            except Exception:
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    raise ConversionError(f"LibreOffice worker {self.index} did not start")
+                time.sleep(0.25)
+
+    def stop(self):
+        """
+        Stop the instance and remove its profile
+
+        The profile is named after this process, so no later process would
+        reuse it; a restarted worker initializes a fresh one.
+        """
+        self.desktop = None
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def restart(self):
+        logging.warning(f"Restarting LibreOffice worker {self.index}")
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def is_healthy(self):
+        """
+        Check that the instance is running and accepting connections
+
+        A 'cli' worker has no instance; it is ready once its profile exists.
+        """
+        if self.mode == MODE_CLI:
+            return os.path.isdir(self.profile_dir)
+        if self.process is None or self.process.poll() is not None:
+            return False
+        if self.mode == MODE_CLIENT:
+            # The client of each batch reports a lost connection
+            return True
+        if self.desktop is None:
+            return False
+        try:
+            # Any call on the desktop fails once the connection is lost
+            self.desktop.getFrames()
+            return True
+        except Exception:
+            return False
+
+    def convert_batch(self, pairs, timeout=CONVERSION_TIMEOUT):
+        """
+        Convert (input_file, output_file) pairs; returns a list of errors (None on success)
+        """
+        if not self.is_healthy():
+            self.restart()
+
+        if self.mode == MODE_CLI:
+            return self._convert_batch_cli(pairs, timeout)
+        if self.mode == MODE_CLIENT:
+            return self._convert_batch_client(pairs, timeout)
+        return [self._convert_uno(input_file, output_file, timeout) for input_file, output_file in pairs]
+
+    def _convert_uno(self, input_file, output_file, timeout):
+        result = {}
+
+        def run():
+            try:
+                office_client.convert(self.desktop, input_file, output_file)
+            except Exception as e:
+                result['error'] = str(e)
+
+        # Run the call on a thread so a hung conversion can be abandoned;
+        # restarting the instance makes the pending call fail
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            self.failures += 1
+            self.restart()
+            return f"Conversion timed out after {timeout}s"
+
+        if 'error' in result:
+            self.failures += 1
+            # A crashed instance is restarted for the next document
+            if not self.is_healthy():
+                self.restart()
+            return result['error']
+
+        self.conversions += 1
+        return None
+
+    def _run_client(self, pairs, timeout, connect_timeout=0):
+        # Run office_client.py on pairs; returns its list of errors, or
+        # None when the client could not reach the listener or failed
+        completed = subprocess.run(
+            [self.python, OFFICE_CLIENT, self.pipe_name, str(connect_timeout)],
+            input=json.dumps([[os.path.abspath(input_file), os.path.abspath(output_file)] for input_file, output_file in pairs]),
+            capture_output=True, text=True, timeout=timeout
+        )
+        try:
+            errors = json.loads(completed.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            errors = None
+        if completed.returncode != 0 or not isinstance(errors, list) or len(errors) != len(pairs):
+            logging.error(f"LibreOffice client of worker {self.index} failed: {completed.stderr.strip()[-500:] or errors}")
+            return None
+        return errors
+
+    def _convert_batch_client(self, pairs, timeout):
+        try:
+            errors = self._run_client(pairs, timeout * len(pairs))
+        except subprocess.TimeoutExpired:
+            errors = [f"Conversion timed out after {timeout * len(pairs)}s"] * len(pairs)
+            # The office may be stuck on the document; start it over
+            self.stop()
+        if errors is None:
+            errors = ['LibreOffice client failed'] * len(pairs)
+            # The listener is started again before the next batch
+            self.stop()
+
+        for error in errors:
+            if error is None:
+                self.conversions += 1
+            else:
+                self.failures += 1
+        return errors
+
+    def _convert_batch_cli(self, pairs, timeout):
+        # One soffice call converts the whole batch in a scratch folder;
+        # inputs are staged under unique names so outputs cannot collide
+        work_dir = tempfile.mkdtemp(prefix='office_batch_')
+        try:
+            staged = []
+            for index, (input_file, _) in enumerate(pairs):
+                staged_file = os.path.join(work_dir, f"{index}_{os.path.basename(input_file)}")
+                try:
+                    os.link(input_file, staged_file)
+                except OSError:
+                    shutil.copyfile(input_file, staged_file)
+                staged.append(staged_file)
+
+            out_dir = os.path.join(work_dir, 'out')
+            os.makedirs(out_dir)
+            try:
+                subprocess.run(
+                    [
+                        self.binary, '--headless', '--norestore', '--nolockcheck',
+                        f"-env:UserInstallation={self.profile_url}",
+                        '--convert-to', 'pdf', '--outdir', out_dir
+                    ] + staged,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    timeout=timeout * len(pairs)
+                )
+            except subprocess.TimeoutExpired:
+                self.failures += len(pairs)
+                return [f"Conversion timed out after {timeout * len(pairs)}s"] * len(pairs)
+
+            errors = []
+            for staged_file, (_, output_file) in zip(staged, pairs):
+                converted = os.path.join(out_dir, os.path.splitext(os.path.basename(staged_file))[0] + '.pdf')
+                if os.path.exists(converted):
+                    shutil.move(converted, output_file)
+                    self.conversions += 1
+                    errors.append(None)
+                else:
+                    self.failures += 1
+                    errors.append('LibreOffice produced no output')
+            return errors
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+class OfficeConverterPool:
+    """
+    Pool of warm LibreOffice workers shared by all requests
+
+    Each conversion borrows an idle worker; convert_many spreads batches
+    of documents over all workers. Workers stay warm when a Python with
+    the UNO bindings is found (see OfficeWorker); otherwise each batch
+    starts soffice, and health() reports the 'cli' mode.
+    """
+
+    def __init__(self, size=OFFICE_WORKERS, binary=SOFFICE_BINARY):
+        if binary is None:
+            raise ConversionError("LibreOffice is not installed")
+        self.workers = [OfficeWorker(index, binary) for index in range(max(1, size))]
+        self._idle = queue.Queue()
+        try:
+            for worker in self.workers:
+                worker.start()
+                self._idle.put(worker)
+        except Exception:
+            # Stop the workers already running: nothing else would
+            self.close()
+            raise
+
+    def convert(self, input_file, output_file, timeout=CONVERSION_TIMEOUT):
+        """
+        Convert one document, raising ConversionError on failure
+        """
+        error = self._run_batch([(input_file, output_file)], timeout)[0]
+        if error is not None:
+            raise ConversionError(error)
+
+    def convert_many(self, pairs, timeout=CONVERSION_TIMEOUT, batch_size=BATCH_SIZE):
+        """
+        Convert many (input_file, output_file) pairs; returns the errors in order
+        """
+        batches = [pairs[i:i + batch_size] for i in range(0, len(pairs), batch_size)]
+        with ThreadPoolExecutor(max_workers=len(self.workers)) as executor:
+            results = executor.map(lambda batch: self._run_batch(batch, timeout), batches)
+            return [error for batch_errors in results for error in batch_errors]
+
+    def health(self):
+        return [
+            {
+                'worker': worker.index,
+                'mode': worker.mode,
+                'healthy': worker.is_healthy(),
+                'conversions': worker.conversions,
+                'failures': worker.failures,
+                'restarts': worker.restarts
+            }
+            for worker in self.workers
+        ]
+
+    def close(self):
+        """
+        Stop every worker and remove their profiles
+        """
+        for worker in self.workers:
+            worker.stop()
+
+    def _run_batch(self, pairs, timeout):
+        # Wait for an idle worker, leaving room for the queued conversions
+        try:
+            worker = self._idle.get(timeout=timeout * 2)
+        except queue.Empty:
+            return ["No LibreOffice worker available"] * len(pairs)
+        try:
+            return worker.convert_batch(pairs, timeout)
+        except Exception as e:
+            logging.error(f"Error in LibreOffice worker {worker.index}: {str(e)}")
+            return [str(e)] * len(pairs)
+        finally:
+            self._idle.put(worker)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Return the process-wide converter pool, starting it on first use
+
+    The pool is closed when the process exits, so its listeners and
+    profiles do not outlive it.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OfficeConverterPool()
+            atexit.register(_close_pool)
+        return _pool
+
+def _close_pool():
+    if _pool is not None:
+        _pool.close()
+
+def _reset_pool():
+    # A forked child must not drive its parent's listeners (nor close
+    # them at exit), and the lock may have been held by another thread
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+def benchmark(paths, workers=OFFICE_WORKERS, repeat=1):
+    """
+    Convert the given documents through a fresh pool and measure it
+
+    Returns start-up time, throughput (documents per second) and the
+    per-document latency of single conversions.
+    """
+    start = time.perf_counter()
+    pool = OfficeConverterPool(size=workers)
+    startup = time.perf_counter() - start
+
+    out_dir = tempfile.mkdtemp(prefix='office_bench_')
+    try:
+        # Latency: one document at a time
+        latencies = []
+        for index, path in enumerate(paths * repeat):
+            begin = time.perf_counter()
+            try:
+                pool.convert(path, os.path.join(out_dir, f"single_{index}.pdf"))
+            except ConversionError as e:
+                logging.error(f"Error converting {path}: {str(e)}")
+            latencies.append(time.perf_counter() - begin)
+
+        # Throughput: all documents in batches over every worker
+        pairs = [(path, os.path.join(out_dir, f"batch_{index}.pdf")) for index, path in enumerate(paths * repeat)]
+        begin = time.perf_counter()
+        errors = pool.convert_many(pairs)
+        elapsed = time.perf_counter() - begin
+    finally:
+        pool.close()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    latencies.sort()
+    return {
+        'workers': workers,
+        'documents': len(pairs),
+        'startup_time': round(startup, 3),
+        'latency_p50': round(latencies[len(latencies) // 2], 3),
+        'latency_p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        'latency_max': round(latencies[-1], 3),
+        'throughput': round(len(pairs) / elapsed, 3) if elapsed else None,
+        'failures': sum(1 for error in errors if error is not None)
+    }
+
+if __name__ == '__main__':
+    # Usage: python word_converter.py [--workers N] [--repeat N] file.docx [...]
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Benchmark the pooled Word to PDF converter')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--workers', type=int, default=OFFICE_WORKERS)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    if not is_available():
+        sys.exit('LibreOffice (soffice) was not found')
+    print(json.dumps(benchmark(args.files, args.workers, args.repeat), indent=2))